@@ -1,6 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate, useOutletContext } from 'react-router-dom';
-import html2canvas from 'html2canvas';
 import {
   Box,
   Container,
@@ -54,7 +53,6 @@ import {
   LineChart,
   Line,
 } from 'recharts';
-import { jsPDF } from 'jspdf';
 
 const AnalysisReport = () => {
   const { id } = useParams();
@@ -103,6 +101,51 @@ const AnalysisReport = () => {
     }
   };
 
+  // Read the Server-Sent Events stream and merge each section into the analysis as it arrives
+  const streamAnalysis = async () => {
+    const response = await fetch(`http://localhost:8000/api/analyses/${id}/stream/`, {
+      headers: {
+        'Authorization': `Bearer ${user.access_token}`,
+        'Accept': 'text/event-stream',
+      },
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error('Failed to stream analysis');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        const eventName = rawEvent.match(/^event: (.*)$/m)?.[1];
+        const eventData = rawEvent.match(/^data: (.*)$/m)?.[1];
+        if (!eventData) continue;
+        const payload = JSON.parse(eventData);
+
+        if (eventName === 'section') {
+          setAnalysis((previous) => ({
+            ...previous,
+            analysis_result: { ...previous.analysis_result, [payload.section]: payload.data },
+          }));
+          setLoading(false);
+        } else if (eventName === 'error') {
+          throw new Error(payload.detail || payload.error || 'Failed to analyze loan application');
+        }
+      }
+    }
+  };
+
   useEffect(() => {
     const fetchAnalysis = async () => {
       try {
@@ -127,6 +170,11 @@ const AnalysisReport = () => {
         
         setCustomerName(customerInput.customer_name || 'Unknown');
         setStatus(data.status || 'pending');
+
+        // Analyses created in stream mode have no result yet, generate it section by section
+        if (!data.analysis_result || Object.keys(data.analysis_result).length === 0) {
+          await streamAnalysis();
+        }
       } catch (error) {
         console.error('Error fetching analysis:', error);
         setError(error.message);
@@ -373,128 +421,29 @@ const AnalysisReport = () => {
   };
 
   const generatePDF = async () => {
-    const doc = new jsPDF();
-    const result = parseAnalysisResult(analysis);
-    
-    // Helper function to add a new page if needed
-    const addPageIfNeeded = (height) => {
-      if (doc.internal.getCurrentPageInfo().pageNumber === 1) {
-        if (doc.internal.getCurrentPageInfo().pageNumber * doc.internal.pageSize.height - doc.internal.getVerticalCoordinateString() < height) {
-          doc.addPage();
-        }
+    // Rendered (and cached) on the server, the browser only saves the file
+    try {
+      const response = await fetch(`http://localhost:8000/api/analyses/${id}/report/`, {
+        headers: {
+          'Accept': 'application/pdf',
+          'Authorization': `Bearer ${user.access_token}`,
+        },
+      });
+      if (!response.ok) {
+        throw new Error(`Server returned ${response.status}`);
       }
-    };
-
-    // Title
-    doc.setFontSize(24);
-    doc.text('Loan Analysis Report', 20, 20);
-    doc.setFontSize(12);
-    doc.setLineWidth(0.5);
-    doc.line(20, 25, 190, 25);
-    let yPos = 40;
-
-    // Executive Summary Section
-    doc.setFontSize(18);
-    doc.text('Executive Summary', 20, yPos);
-    yPos += 10;
-    
-    // Overall Assessment
-    doc.setFontSize(12);
-    const assessment = doc.splitTextToSize(result.summary.overall_assessment, 170);
-    doc.text(assessment, 20, yPos);
-    yPos += assessment.length * 7 + 10;
-
-    // Key Strengths
-    doc.setFontSize(14);
-    doc.text('Key Strengths:', 20, yPos);
-    yPos += 7;
-    doc.setFontSize(12);
-    result.summary.key_strengths.forEach(strength => {
-      doc.text('• ' + strength, 25, yPos);
-      yPos += 7;
-    });
-    yPos += 5;
-
-    // Key Concerns
-    doc.setFontSize(14);
-    doc.text('Key Concerns:', 20, yPos);
-    yPos += 7;
-    doc.setFontSize(12);
-    result.summary.key_concerns.forEach(concern => {
-      doc.text('• ' + concern, 25, yPos);
-      yPos += 7;
-    });
-    yPos += 5;
-
-    // Recommendations
-    doc.setFontSize(14);
-    doc.text('Recommendations:', 20, yPos);
-    yPos += 7;
-    doc.setFontSize(12);
-    result.summary.recommendations.forEach(rec => {
-      const recText = doc.splitTextToSize('• ' + rec, 165);
-      doc.text(recText, 25, yPos);
-      yPos += recText.length * 7;
-    });
-    yPos += 10;
-
-    // Add a new page for metrics and charts
-    doc.addPage();
-    yPos = 20;
 
-    // Financial Metrics
-    doc.setFontSize(18);
-    doc.text('Financial Metrics', 20, yPos);
-    yPos += 10;
-    doc.setFontSize(12);
-    
-    const metrics = [
-      ['Debt-to-Income Ratio:', `${result.financial_metrics.debt_to_income_ratio}%`],
-      ['Loan-to-Value Ratio:', `${result.financial_metrics.loan_to_value_ratio}%`],
-      ['Credit Utilization:', `${result.financial_metrics.credit_utilization}%`],
-      ['Monthly Payment:', `$${result.loan_metrics.monthly_payment.toLocaleString()}`],
-      ['Total Interest:', `$${result.loan_metrics.total_interest_paid.toLocaleString()}`],
-      ['Break-even Years:', result.loan_metrics.break_even_years.toString()]
-    ];
-
-    metrics.forEach(([label, value]) => {
-      doc.text(`${label} ${value}`, 25, yPos);
-      yPos += 7;
-    });
-    yPos += 10;
-
-    // Capture and add charts
-    const chartIds = [
-      'debt-breakdown-chart',
-      'income-expenses-chart',
-      'net-worth-chart',
-      'amortization-chart'
-    ];
-
-    for (const chartId of chartIds) {
-      const chartElement = document.getElementById(chartId);
-      if (chartElement) {
-        try {
-          // Add new page for each chart
-          doc.addPage();
-          
-          const canvas = await html2canvas(chartElement);
-          const imgData = canvas.toDataURL('image/png');
-          
-          // Calculate aspect ratio to fit chart on page
-          const imgWidth = doc.internal.pageSize.getWidth() - 40;
-          const imgHeight = (canvas.height * imgWidth) / canvas.width;
-          
-          doc.addImage(imgData, 'PNG', 20, 20, imgWidth, imgHeight);
-        } catch (error) {
-          console.error(`Error capturing chart ${chartId}:`, error);
-        }
-      }
+      const url = URL.createObjectURL(await response.blob());
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `loan-analysis-report-${id}.pdf`;
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      URL.revokeObjectURL(url);
+    } catch (err) {
+      setError('Failed to download the report: ' + err.message);
     }
-
-    // Save the PDF
-    const fileName = `loan-analysis-report-${new Date().toISOString().split('T')[0]}.pdf`;
-    doc.save(fileName);
   };
 
   if (loading) {
@@ -26,21 +26,10 @@ const History = () => {
   const [analyses, setAnalyses] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [nextPage, setNextPage] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
-  const getCustomerName = (analysis) => {
-    try {
-      const result = analysis.analysis_result;
-      if (typeof result === 'string') {
-        const parsedResult = JSON.parse(result);
-        const match = parsedResult.summary.overall_assessment.match(/^([^']+)'s/);
-        return match ? match[1] : 'N/A';
-      }
-      const match = result.summary.overall_assessment.match(/^([^']+)'s/);
-      return match ? match[1] : 'N/A';
-    } catch (e) {
-      return 'N/A';
-    }
-  };
+  const getCustomerName = (analysis) => analysis.customer_name || 'N/A';
 
   const getDecision = (analysis) => {
     // Simply return the status from the analyses table
@@ -66,9 +55,10 @@ const History = () => {
     fetchAnalyses();
   }, []);
 
-  const fetchAnalyses = async () => {
+  // The list is paginated newest first, `next` points at the following page
+  const fetchAnalyses = async (url = 'http://localhost:8000/api/analyses/', append = false) => {
     try {
-      const response = await fetch('http://localhost:8000/api/analyses/', {
+      const response = await fetch(url, {
         headers: {
           'Authorization': `Bearer ${user.access_token}`,
           'Content-Type': 'application/json',
@@ -80,14 +70,21 @@ const History = () => {
       }
 
       const data = await response.json();
-      setAnalyses(data);
+      setAnalyses((previous) => (append ? [...previous, ...data.results] : data.results));
+      setNextPage(data.next);
     } catch (err) {
       setError(err.message);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
+  const loadMore = () => {
+    setLoadingMore(true);
+    fetchAnalyses(nextPage, true);
+  };
+
   if (loading) {
     return (
       <Box display="flex" justifyContent="center" alignItems="center" minHeight="60vh">
@@ -174,6 +171,14 @@ const History = () => {
           ))}
         </Grid>
       )}
+
+      {nextPage && (
+        <Box sx={{ display: 'flex', justifyContent: 'center', mt: 4 }}>
+          <Button variant="outlined" onClick={loadMore} disabled={loadingMore}>
+            {loadingMore ? 'Loading...' : 'Load More'}
+          </Button>
+        </Box>
+      )}
     </Container>
   );
 };
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import { useNavigate, useOutletContext } from 'react-router-dom';
 
 const NewAnalysis = () => {
@@ -8,6 +8,9 @@ const NewAnalysis = () => {
   const [customerPhone, setCustomerPhone] = useState('');
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  // One key per distinct submission: double-clicks and retries of the same
+  // body reuse it, so the server runs the analysis only once
+  const idempotency = useRef({ key: null, body: null });
 
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -25,16 +28,22 @@ const NewAnalysis = () => {
         throw new Error('Customer phone number is required');
       }
 
-      const response = await fetch('http://localhost:8000/api/analyses/', {
+      const body = JSON.stringify({
+        customer_input: customerInput,
+        customer_phone: customerPhone,
+      });
+      if (idempotency.current.body !== body) {
+        idempotency.current = { key: crypto.randomUUID(), body };
+      }
+
+      const response = await fetch('http://localhost:8000/api/analyses/?mode=stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
           'Authorization': `Bearer ${user.access_token}`,
+          'Idempotency-Key': idempotency.current.key,
         },
-        body: JSON.stringify({
-          customer_input: customerInput,
-          customer_phone: customerPhone,
-        }),
+        body,
       });
 
       let data;
@@ -27,11 +27,13 @@ const History = () => {
   const [analyses, setAnalyses] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [nextPage, setNextPage] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
-  const fetchAnalyses = async () => {
+  // The list is paginated newest first, `next` points at the following page
+  const fetchAnalyses = async (url = 'http://localhost:8000/api/analyses/?page_size=100', append = false) => {
     try {
-      setLoading(true);
-      const response = await fetch('http://localhost:8000/api/analyses/', {
+      const response = await fetch(url, {
         headers: {
           'Authorization': `Bearer ${user.access_token}`,
           'Content-Type': 'application/json',
@@ -43,15 +45,22 @@ const History = () => {
       }
       
       const data = await response.json();
-      setAnalyses(data);
+      setAnalyses((previous) => (append ? [...previous, ...data.results] : data.results));
+      setNextPage(data.next);
     } catch (error) {
       console.error('Error fetching analyses:', error);
       setError(error.message);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
+  const loadMore = () => {
+    setLoadingMore(true);
+    fetchAnalyses(nextPage, true);
+  };
+
   useEffect(() => {
     fetchAnalyses();
   }, []);
@@ -204,6 +213,14 @@ const History = () => {
           </Grid>
         ))}
       </Grid>
+
+      {nextPage && (
+        <Box sx={{ display: 'flex', justifyContent: 'center', mt: 4 }}>
+          <Button variant="outlined" onClick={loadMore} disabled={loadingMore}>
+            {loadingMore ? 'Loading...' : 'Load More'}
+          </Button>
+        </Box>
+      )}
     </Container>
   );
 };
@@ -1,74 +1,59 @@
-import requests
+"""
+Batch credit risk scoring with the Groq chat completions API.
+
+Reads applicant profiles from a JSONL or CSV file and asks the model for a
+risk level, assessment and recommendations for each one. Requests run
+concurrently (--concurrency) and are spaced to stay under --rate requests
+per second. Failed requests are retried with backoff on 429, 5xx and
+network errors.
+
+Results are streamed to the output JSONL as they finish, one line per row,
+and the file is the checkpoint: rerunning the same command skips the rows
+already in it, so an interrupted run resumes where it stopped. Rows that
+still fail after the retries go to <output>.failures.jsonl and are tried
+again on the next run.
+
+    export GROQ_API_KEY=...
+    python credit_risk_analysis.py applicants.jsonl --output scores.jsonl --concurrency 8 --rate 5
+
+--api-url (or GROQ_API_URL) points it at any OpenAI-compatible endpoint,
+such as the local stub in server/benchmarks for offline runs. The API key is
+only read from GROQ_API_KEY. Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import csv
 import json
+import logging
 import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import httpx
 
-# 🟢 Set your Groq API Key (Replace with your actual key)
-GROQ_API_KEY = "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"
-
-# 🟢 Define the API URL
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-
-# 🟢 Headers for authentication
-headers = {
-    "Authorization": f"Bearer {GROQ_API_KEY}",
-    "Content-Type": "application/json"
-}
-
-# 🟢 Detailed Customer Profile for Credit Risk Analysis
-customer_details = {
-    "full_name": "John Doe",
-    "age": 45,
-    "credit_score": 620,
-    "annual_income": 50000,
-    "employment_status": "Full-time",
-    "total_debt": 25000,
-    "missed_payments_last_12_months": 3,
-    "loan_types": ["Mortgage", "Credit Card", "Personal Loan"],
-    "debt_to_income_ratio": "48%",
-    "existing_loans": [
-        {"type": "Mortgage", "balance": 150000, "monthly_payment": 1200},
-        {"type": "Credit Card", "balance": 5000, "monthly_payment": 200},
-        {"type": "Personal Loan", "balance": 10000, "monthly_payment": 300}
-    ],
-    "recent_credit_inquiries": 2,
-    "bankruptcies": 0,
-    "foreclosures": 0,
-    "on_time_payment_percentage": "85%",
-    "savings_account_balance": 10000
-}
-
-# 🟢 Construct Prompt for Detailed Credit Risk Analysis
-prompt = f"""
+logger = logging.getLogger('credit_risk_analysis')
+
+DEFAULT_API_URL = 'https://api.groq.com/openai/v1/chat/completions'
+DEFAULT_MODEL = 'llama-3.3-70b-versatile'
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+PROMPT = """
 Analyze the credit risk of the following customer based on financial and credit details.
 Assess risk level (Low, Medium, High) and provide a comprehensive explanation.
 
 **Customer Profile:**
-- Full Name: {customer_details["full_name"]}
-- Age: {customer_details["age"]}
-- Credit Score: {customer_details["credit_score"]}
-- Annual Income: ${customer_details["annual_income"]}
-- Employment Status: {customer_details["employment_status"]}
-- Total Debt: ${customer_details["total_debt"]}
-- Missed Payments in Last 12 Months: {customer_details["missed_payments_last_12_months"]}
-- Debt-to-Income Ratio: {customer_details["debt_to_income_ratio"]}
-- Existing Loans:
-  - Mortgage: ${customer_details["existing_loans"][0]["balance"]} (Monthly Payment: ${customer_details["existing_loans"][0]["monthly_payment"]})
-  - Credit Card: ${customer_details["existing_loans"][1]["balance"]} (Monthly Payment: ${customer_details["existing_loans"][1]["monthly_payment"]})
-  - Personal Loan: ${customer_details["existing_loans"][2]["balance"]} (Monthly Payment: ${customer_details["existing_loans"][2]["monthly_payment"]})
-- Recent Credit Inquiries: {customer_details["recent_credit_inquiries"]}
-- Bankruptcies: {customer_details["bankruptcies"]}
-- Foreclosures: {customer_details["foreclosures"]}
-- On-Time Payment Percentage: {customer_details["on_time_payment_percentage"]}
-- Savings Account Balance: ${customer_details["savings_account_balance"]}
+{profile}
 
 **Analysis Requirements:**
-1️⃣ **Risk Level (Low, Medium, High)**
-2️⃣ **Factors contributing to the risk score**
-3️⃣ **Debt-to-Income Ratio assessment**
-4️⃣ **Impact of existing loans & credit inquiries**
-5️⃣ **Payment history analysis**
-6️⃣ **Likelihood of future financial distress**
-7️⃣ **If risk is HIGH, provide specific recommendations to improve creditworthiness**
+1. **Risk Level (Low, Medium, High)**
+2. **Factors contributing to the risk score**
+3. **Debt-to-Income Ratio assessment**
+4. **Impact of existing loans & credit inquiries**
+5. **Payment history analysis**
+6. **Likelihood of future financial distress**
+7. **If risk is HIGH, provide specific recommendations to improve creditworthiness**
 
 **Output format:**
 {{
@@ -78,34 +63,342 @@ Assess risk level (Low, Medium, High) and provide a comprehensive explanation.
 }}
 """
 
-# 🟢 Send request to Groq API
-data = {
-    "model": "llama-3.3-70b-versatile",
-    "messages": [{"role": "user", "content": prompt}]
-}
 
-response = requests.post(GROQ_API_URL, headers=headers, json=data)
+class RequestFailed(Exception):
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+# Reading input
+
+def _csv_value(value):
+    """
+    CSV cells stay text, apart from JSON lists/objects such as existing_loans.
+    Numbers read the same in the prompt either way, and casting would rewrite
+    phone numbers (+1555...) and zero-padded ids (007).
+    """
+    value = value.strip()
+    if not value:
+        return None
+    if value[0] in '[{':
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _nest(flat):
+    """{'customer.credit_score': 700} -> {'customer': {'credit_score': 700}}"""
+    nested = {}
+    for key, value in flat.items():
+        if key is None or value is None:
+            continue
+        target = nested
+        *parents, leaf = key.strip().split('.')
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = value
+    return nested
+
+
+def read_profiles(path):
+    """Yield (row number, profile dict) from a .jsonl/.ndjson or .csv file, lazily"""
+    suffix = Path(path).suffix.lower()
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        if suffix == '.csv':
+            for number, row in enumerate(csv.DictReader(handle), 1):
+                yield number, _nest({key: _csv_value(value or '') for key, value in row.items()})
+            return
+        number = 0
+        for line in handle:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                profile = json.loads(line)
+            except ValueError as e:
+                raise SystemExit(f'{path}: row {number} is not valid JSON: {e}')
+            if not isinstance(profile, dict):
+                raise SystemExit(f'{path}: row {number} is not a JSON object')
+            yield number, profile
+
+
+def row_key(number, profile, id_field):
+    """The checkpoint key of a row: its --id-field value, or its row number"""
+    if id_field:
+        value = profile.get(id_field)
+        if value is None:
+            raise SystemExit(f'Row {number} has no {id_field!r} field')
+        return str(value)
+    return number
+
+
+# Checkpoint
+
+def completed_rows(path):
+    """
+    Keys of the rows already in the output, which is truncated after its last
+    complete line (a run killed mid-write leaves a partial one)
+    """
+    done = set()
+    if not path.exists():
+        return done
+    good_bytes = 0
+    with open(path, 'rb') as handle:
+        for line in handle:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                done.add(json.loads(line)['row'])
+            except (ValueError, KeyError, TypeError):
+                break
+            good_bytes += len(line)
+    if good_bytes != path.stat().st_size:
+        logger.warning('Dropping an incomplete record at the end of %s', path)
+        with open(path, 'r+b') as handle:
+            handle.truncate(good_bytes)
+    return done
+
+
+class JSONLWriter:
+    def __init__(self, path, mode):
+        self.handle = open(path, mode, encoding='utf-8')
+
+    def write(self, record):
+        # One flushed line per record, so a crash loses at most the row in flight
+        self.handle.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
 
-# 🟢 Handle Response Properly
-try:
-    response_data = response.json()  # Parse JSON response
+# Calling the API
 
-    if "choices" in response_data:
-        # Extract message content
-        result = response_data["choices"][0]["message"]["content"]
+class RateLimiter:
+    """Spaces request starts at least 1/rate seconds apart"""
 
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def format_value(value, indent='  '):
+    if isinstance(value, list):
+        return ''.join(f'\n{indent}- {format_value(item, indent + "  ")}' for item in value) or 'None'
+    if isinstance(value, dict):
+        return ', '.join(f'{key.replace("_", " ").title()}: {format_value(item, indent)}'
+                         for key, item in value.items())
+    return 'None' if value is None else str(value)
+
+
+def build_prompt(profile):
+    lines = [f'- {key.replace("_", " ").title()}: {format_value(value)}' for key, value in profile.items()]
+    return PROMPT.format(profile='\n'.join(lines))
+
+
+def parse_content(content):
+    """The model's JSON answer, tolerating a ```json fence around it"""
+    text = (content or '').strip()
+    if text.startswith('```'):
+        text = text.strip('`')
+        text = text[4:] if text.lower().startswith('json') else text
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class Scorer:
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.limiter = RateLimiter(args.rate)
+        self.headers = {'Content-Type': 'application/json'}
+        api_key = os.environ.get('GROQ_API_KEY')
+        if api_key:
+            self.headers['Authorization'] = f'Bearer {api_key}'
+
+    async def request(self, profile):
+        await self.limiter.acquire()
+        payload = {
+            'model': self.args.model,
+            'messages': [{'role': 'user', 'content': build_prompt(profile)}],
+            'temperature': self.args.temperature,
+            'response_format': {'type': 'json_object'},
+        }
+        try:
+            response = await self.client.post(self.args.api_url, json=payload, headers=self.headers)
+        except httpx.HTTPError as e:
+            raise RequestFailed(f'{type(e).__name__}: {e}', retryable=True)
+        if response.status_code != 200:
+            raise RequestFailed(
+                f'HTTP {response.status_code}: {response.text[:200]}',
+                retryable=response.status_code in RETRY_STATUSES,
+                retry_after=_retry_after(response),
+            )
         try:
-            # Convert result to JSON (if valid)
-            formatted_result = json.loads(result)
-            print("🔹 Credit Risk Analysis Response 🔹")
-            print(json.dumps(formatted_result, indent=4))  # Pretty-print JSON response
-        except json.JSONDecodeError:
-            print("⚠️ The response was not a valid JSON, displaying raw output:\n")
-            print(result)
-    else:
-        print("⚠️ No valid response from API:", response_data)
-
-except requests.exceptions.JSONDecodeError:
-    print("❌ Error: API response is not valid JSON:", response.text)
-except Exception as e:
-    print("❌ Unexpected Error:", str(e))
+            return response.json()
+        except ValueError:
+            raise RequestFailed(f'Response is not JSON: {response.text[:200]}', retryable=True)
+
+    async def score(self, key, profile):
+        """The output record for one row; raises RequestFailed once the retries are used up"""
+        started = time.monotonic()
+        for attempt in range(self.args.retries + 1):
+            try:
+                data = await self.request(profile)
+                break
+            except RequestFailed as e:
+                if not e.retryable or attempt == self.args.retries:
+                    raise
+                delay = e.retry_after or min(self.args.backoff * 2 ** attempt, 30.0) * random.uniform(0.5, 1.0)
+                logger.debug('Row %s: %s, retrying in %.1fs', key, e, delay)
+                await asyncio.sleep(delay)
+
+        try:
+            content = data['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            raise RequestFailed(f'No completion in response: {str(data)[:200]}')
+        result = parse_content(content)
+        return {
+            'row': key,
+            'result': result,
+            'raw': content if result is None else None,
+            'model': data.get('model', self.args.model),
+            'usage': data.get('usage'),
+            'attempts': attempt + 1,
+            'seconds': round(time.monotonic() - started, 3),
+        }
+
+
+async def run(args):
+    output = Path(args.output)
+    done = set() if args.restart else completed_rows(output)
+    writer = JSONLWriter(output, 'w' if args.restart else 'a')
+    failures = JSONLWriter(Path(args.failures), 'w')
+    counts = {'scored': 0, 'skipped': 0, 'failed': 0}
+    queued = 0
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    started = time.monotonic()
+
+    async def worker(scorer):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            key, profile = item
+            try:
+                writer.write(await scorer.score(key, profile))
+                counts['scored'] += 1
+            except Exception as e:
+                # Any error fails only this row: a worker that died would leave
+                # run() blocked on queue.put once the queue filled up
+                unexpected = not isinstance(e, RequestFailed)
+                error = f'{type(e).__name__}: {e}' if unexpected else str(e)
+                logger.warning('Row %s failed: %s', key, error, exc_info=unexpected)
+                failures.write({'row': key, 'error': error})
+                counts['failed'] += 1
+            total = counts['scored'] + counts['failed']
+            if args.progress and total % args.progress == 0:
+                logger.info('%d scored, %d failed, %.1f rows/s', counts['scored'], counts['failed'],
+                            total / (time.monotonic() - started))
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            scorer = Scorer(client, args)
+            workers = [asyncio.create_task(worker(scorer)) for _ in range(args.concurrency)]
+            # The queue is bounded, so the input is read only as fast as rows are scored
+            for number, profile in read_profiles(args.input):
+                key = row_key(number, profile, args.id_field)
+                if key in done:
+                    counts['skipped'] += 1
+                    continue
+                if args.limit and queued >= args.limit:
+                    break
+                await queue.put((key, profile))
+                queued += 1
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+    finally:
+        writer.close()
+        failures.close()
+
+    counts['seconds'] = round(time.monotonic() - started, 2)
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help='Applicant profiles, .jsonl/.ndjson (one object per line) or .csv '
+                                      '(dotted headers like loan.balance become nested fields)')
+    parser.add_argument('--output', default=None,
+                        help='Results JSONL, also the resume checkpoint (default: <input>.scores.jsonl)')
+    parser.add_argument('--failures', default=None,
+                        help='JSONL of rows that failed this run (default: <output>.failures.jsonl)')
+    parser.add_argument('--id-field', default=None,
+                        help='Field that identifies a row for resuming (default: the row number)')
+    parser.add_argument('--restart', action='store_true', help='Ignore and overwrite an existing output')
+    parser.add_argument('--concurrency', type=int, default=4, help='Requests in flight at once')
+    parser.add_argument('--rate', type=float, default=0.0, help='Max requests started per second (0: unlimited)')
+    parser.add_argument('--retries', type=int, default=3, help='Retries per row on 429, 5xx and network errors')
+    parser.add_argument('--backoff', type=float, default=1.0, help='First retry delay in seconds, doubled each time')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Seconds per request')
+    parser.add_argument('--limit', type=int, default=0, help='Score at most this many rows this run')
+    parser.add_argument('--api-url', default=os.environ.get('GROQ_API_URL', DEFAULT_API_URL),
+                        help='Chat completions endpoint (default: GROQ_API_URL or Groq)')
+    parser.add_argument('--model', default=os.environ.get('GROQ_MODEL', DEFAULT_MODEL))
+    parser.add_argument('--temperature', type=float, default=0.2)
+    parser.add_argument('--progress', type=int, default=100, help='Log progress every N rows (0: never)')
+    parser.add_argument('--verbose', action='store_true', help='Also log each retry')
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    if args.output is None:
+        args.output = str(Path(args.input).with_suffix('.scores.jsonl'))
+    if args.failures is None:
+        args.failures = f'{args.output}.failures.jsonl'
+    if args.api_url == DEFAULT_API_URL and not os.environ.get('GROQ_API_KEY'):
+        parser.error('Set GROQ_API_KEY, or point --api-url at a local endpoint')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s', stream=sys.stderr)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    try:
+        counts = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print(f'Interrupted, rerun the same command to resume from {args.output}', file=sys.stderr)
+        return 130
+    print(json.dumps(counts), file=sys.stderr)
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,7 +5,9 @@ from .models import Analysis
 class AnalysisAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'customer_phone', 'created_at', 'updated_at')
     list_filter = ('created_at', 'user')
-    search_fields = ('customer_phone', 'customer_input')
+    # icontains ('%x%') cannot use an index, so this still scans the table, but it
+    # matches the short summary columns instead of every customer_input text
+    search_fields = ('customer_phone', 'customer_name')
     readonly_fields = ('created_at', 'updated_at')
     
     def get_queryset(self, request):
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+class AnalysisConfig(AppConfig):
+    name = 'analysis'
+
+    def ready(self):
+        from .db import configure_connection
+
+        connection_created.connect(configure_connection, dispatch_uid='analysis.db.configure_connection')
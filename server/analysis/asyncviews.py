@@ -0,0 +1,58 @@
+"""
+Async actions for DRF viewsets.
+
+DRF 3.14 views are synchronous, so under ASGI every request holds a thread
+from start to finish, including the seconds spent waiting for Groq. A
+viewset with AsyncViewSetMixin can give an action an async twin named
+a<action> (acreate, aretrieve). as_async_view builds a Django async view
+that awaits those twins on the event loop and hands every other action to
+the ordinary sync view. Authentication, permissions and content negotiation
+still run DRF's own code, through db_call, because they may touch the ORM.
+"""
+from .db import db_call
+
+
+class AsyncViewSetMixin:
+    @classmethod
+    def as_async_view(cls, actions, **initkwargs):
+        sync_view = cls.as_view(actions, **initkwargs)
+
+        async def view(request, *args, **kwargs):
+            action = actions.get(request.method.lower())
+            if action is None or not hasattr(cls, f'a{action}'):
+                return await db_call(sync_view, request, *args, **kwargs)
+
+            # Set up the instance the way ViewSetMixin.as_view does
+            self = cls(**initkwargs)
+            self.action_map = actions
+            for method, name in actions.items():
+                setattr(self, method, getattr(self, name))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.actions = actions
+        # APIView.as_view applies csrf_exempt, whose wrapper is sync in Django 4.2
+        view.csrf_exempt = True
+        return view
+
+    async def adispatch(self, request, *args, **kwargs):
+        """APIView.dispatch for an action with an async handler"""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await db_call(self.initial, request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
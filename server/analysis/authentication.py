@@ -0,0 +1,184 @@
+"""
+Supabase bearer-token authentication.
+
+Tokens are verified locally: HS256 tokens against SUPABASE_JWT_SECRET and
+asymmetric ones against the project's JWKS, whose keys are cached. The
+remote `supabase.auth.get_user` call is only a fallback for tokens that
+cannot be checked locally. Verified token -> user mappings are kept in a
+bounded TTL cache so repeat requests skip verification and the user lookup.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .clients import get_supabase
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+class LocalVerificationUnavailable(Exception):
+    """The token cannot be checked locally and needs the remote fallback"""
+
+
+class TokenUserCache:
+    """Thread-safe LRU mapping of token digests to users, with per-entry expiry"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        # Keep digests rather than raw bearer tokens in memory
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, token, user, token_expires_at=None):
+        expires_at = time.time() + self.ttl
+        if token_expires_at:
+            # Never keep a mapping past the token's own expiry
+            expires_at = min(expires_at, token_expires_at)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenUserCache(
+    max_entries=getattr(settings, 'SUPABASE_AUTH_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'SUPABASE_AUTH_CACHE_TTL', 300)
+)
+
+_jwks_client = None
+_jwks_lock = threading.Lock()
+
+
+def get_jwks_client():
+    """Return the JWKS client for the project, keys are cached between calls"""
+    global _jwks_client
+    with _jwks_lock:
+        if _jwks_client is None:
+            _jwks_client = jwt.PyJWKClient(
+                f"{settings.SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json",
+                cache_keys=True,
+                lifespan=getattr(settings, 'SUPABASE_JWKS_CACHE_TTL', 600),
+                timeout=5
+            )
+        return _jwks_client
+
+
+def verify_token_locally(token):
+    """Check signature, expiry and audience without a network round-trip"""
+    try:
+        algorithm = jwt.get_unverified_header(token).get('alg')
+    except jwt.InvalidTokenError:
+        raise AuthenticationFailed('Invalid token')
+
+    if algorithm == 'HS256':
+        secret = getattr(settings, 'SUPABASE_JWT_SECRET', None)
+        if not secret:
+            raise LocalVerificationUnavailable('SUPABASE_JWT_SECRET is not configured')
+        key = secret
+    elif algorithm in ('RS256', 'ES256') and settings.SUPABASE_URL:
+        try:
+            key = get_jwks_client().get_signing_key_from_jwt(token).key
+        except (jwt.PyJWKClientError, jwt.InvalidTokenError) as e:
+            raise LocalVerificationUnavailable(str(e))
+    else:
+        raise LocalVerificationUnavailable(f'Unsupported token algorithm {algorithm}')
+
+    try:
+        return jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=getattr(settings, 'SUPABASE_JWT_AUDIENCE', 'authenticated'),
+            options={'require': ['exp', 'sub']}
+        )
+    except jwt.ExpiredSignatureError:
+        raise AuthenticationFailed('Token has expired')
+    except jwt.InvalidTokenError:
+        raise AuthenticationFailed('Invalid token')
+
+
+def verify_token_remotely(token):
+    """Ask Supabase to verify the token and return claims-like user data"""
+    response = get_supabase().auth.get_user(token)
+    user_data = response.user
+    if not user_data:
+        raise AuthenticationFailed('Invalid token')
+    return {'email': user_data.email, 'exp': None}
+
+
+class SupabaseAuthentication(BaseAuthentication):
+    def authenticate(self, request):
+        with timed('auth'):
+            return self._authenticate(request)
+
+    def _authenticate(self, request):
+        auth_header = request.META.get('HTTP_AUTHORIZATION')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return None
+
+        token = auth_header.split(' ')[1]
+
+        django_user = token_cache.get(token)
+        if django_user is not None:
+            return (django_user, token)
+
+        try:
+            try:
+                claims = verify_token_locally(token)
+            except LocalVerificationUnavailable as e:
+                logger.info('Local token verification unavailable, asking Supabase: %s', e)
+                claims = verify_token_remotely(token)
+
+            email = claims.get('email')
+            if not email:
+                raise AuthenticationFailed('Token has no email claim')
+
+            # Get or create Django user
+            django_user, created = User.objects.get_or_create(
+                username=email,
+                defaults={
+                    'email': email,
+                    'is_active': True
+                }
+            )
+        except AuthenticationFailed:
+            raise
+        except Exception as e:
+            logger.warning('Authentication error: %s', e)
+            raise AuthenticationFailed('Invalid token or authentication failed')
+
+        token_cache.set(token, django_user, claims.get('exp'))
+        return (django_user, token)
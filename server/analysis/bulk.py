@@ -0,0 +1,289 @@
+"""
+Bulk loan analysis from a JSONL or CSV upload.
+
+Rows are validated with the same rules as a single create, then analysed by
+a bounded pool of threads so a batch of applications runs `concurrency` at a
+time instead of one after another. Under ASGI, aevents runs the rows as
+asyncio tasks instead, awaiting Groq on the event loop. Progress is reported
+row by row, in completion order, as the analyses finish.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.parsers import BaseParser
+
+from .db import db_call
+from .llm import aanalyze_loan, analyze_loan
+from .metrics import timed
+from .models import Analysis
+from .serializers import AnalysisSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class BulkUploadParser(BaseParser):
+    """Accepts a raw JSONL or CSV request body and hands it on as text"""
+    media_type = '*/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        return stream.read().decode(encoding) if stream is not None else ''
+
+
+def read_upload(request):
+    """Return (text, kind) for a multipart `file`, a JSON array or a raw body"""
+    upload = request.FILES.get('file')
+    if upload is not None:
+        content = upload.read().decode('utf-8-sig')
+        return content, detect_kind(content, upload.name, upload.content_type)
+    if isinstance(request.data, list):
+        return '\n'.join(json.dumps(row) for row in request.data), 'jsonl'
+    if isinstance(request.data, str):
+        return request.data.lstrip('\ufeff'), detect_kind(request.data, '', request.content_type)
+    raise ValueError('Upload a JSONL or CSV file as `file`, or send it as the request body')
+
+
+def detect_kind(content, filename='', content_type=''):
+    filename = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if filename.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    if filename.endswith(('.jsonl', '.ndjson', '.json')) or 'json' in content_type:
+        return 'jsonl'
+    return 'jsonl' if content.lstrip().startswith('{') else 'csv'
+
+
+def _csv_row(row):
+    """
+    Build customer_input from a CSV row, `a.b` columns become nested keys.
+
+    Cells stay text: casting would turn a phone like +15551234567 or an id
+    like 007 into a different number, and the metrics and the schema coerce
+    numeric strings ("9000", "6.5%") wherever a number is needed.
+    """
+    if row.get('customer_input'):
+        return row['customer_input'], row.get('customer_phone')
+
+    customer_input = {}
+    for column, value in row.items():
+        if not column or value in (None, ''):
+            continue
+        target = customer_input
+        *parents, key = column.strip().split('.')
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[key] = value.strip()
+    return customer_input, customer_input.get('customer_phone')
+
+
+def _jsonl_row(row):
+    if 'customer_input' in row:
+        customer_input = row['customer_input']
+        phone = row.get('customer_phone')
+        if phone is None and isinstance(customer_input, dict):
+            phone = customer_input.get('customer_phone')
+        return customer_input, phone
+    # The whole object is the application
+    return row, row.get('customer_phone')
+
+
+def parse_rows(content, kind):
+    """Yield (row number, data, error) for every row of the upload"""
+    if kind == 'csv':
+        for number, row in enumerate(csv.DictReader(io.StringIO(content)), start=1):
+            customer_input, phone = _csv_row(row)
+            yield number, {'customer_input': customer_input, 'customer_phone': phone}, None
+        return
+
+    lines = (line for line in content.splitlines() if line.strip())
+    for number, line in enumerate(lines, start=1):
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, None, {'non_field_errors': [f'Invalid JSON: {str(e)}']}
+            continue
+        if not isinstance(row, dict):
+            yield number, None, {'non_field_errors': ['Each line must be a JSON object']}
+            continue
+        customer_input, phone = _jsonl_row(row)
+        yield number, {'customer_input': customer_input, 'customer_phone': phone}, None
+
+
+def validate_row(data):
+    """Validate a row like a single create, returns (validated data, errors)"""
+    customer_input = data['customer_input']
+    if not isinstance(customer_input, str):
+        customer_input = json.dumps(customer_input)
+    serializer = AnalysisSerializer(data={
+        'customer_input': customer_input,
+        'customer_phone': str(data['customer_phone'] or ''),
+    })
+    with timed('validation'):
+        valid = serializer.is_valid()
+    if not valid:
+        return None, serializer.errors
+    return serializer.validated_data, None
+
+
+class BulkAnalysisRun:
+    """Analyses the valid rows of an upload with at most `concurrency` in flight"""
+
+    def __init__(self, user, content, kind, concurrency=None):
+        self.user = user
+        self.concurrency = max(1, min(
+            concurrency or _setting('ANALYSIS_BULK_CONCURRENCY', 4),
+            _setting('ANALYSIS_BULK_MAX_CONCURRENCY', 16)
+        ))
+        self.rows = []
+        self.invalid = []
+        self.stopped = False
+        max_rows = _setting('ANALYSIS_BULK_MAX_ROWS', 1000)
+        for number, data, error in parse_rows(content, kind):
+            if number > max_rows:
+                raise ValueError(f'Uploads are limited to {max_rows} rows')
+            if error is None:
+                data, errors = validate_row(data)
+                error = errors
+            if error is None:
+                self.rows.append((number, data))
+            else:
+                self.invalid.append((number, error))
+
+        if not self.rows and not self.invalid:
+            raise ValueError('The upload has no rows')
+
+    def create_row(self, data):
+        return Analysis.objects.create(
+            user=self.user,
+            customer_phone=data['customer_phone'],
+            customer_input=data['customer_input'],
+            analysis_result={}
+        )
+
+    def row_event(self, number, analysis, error, started):
+        event = {
+            'event': 'failed' if error else 'succeeded',
+            'row': number,
+            'id': analysis.id,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        if error:
+            event['error'] = error
+        else:
+            event.update({field: getattr(analysis, field) for field in Analysis.SUMMARY_FIELDS})
+        return event
+
+    def analyze_row(self, number, data):
+        """Create and analyse one row's Analysis, returns its progress event"""
+        started = time.perf_counter()
+        try:
+            analysis = self.create_row(data)
+            try:
+                analysis_result = analyze_loan(data['customer_input'])
+                error = None
+            except Exception as e:
+                logger.warning("Bulk analysis error on row %d: %s", number, e)
+                analysis_result = {'error': str(e)}
+                error = str(e)
+            analysis.save_result(analysis_result)
+            return self.row_event(number, analysis, error, started)
+        finally:
+            close_old_connections()
+
+    async def aanalyze_row(self, number, data, slots):
+        """analyze_row with the ORM work through db_call and the Groq call awaited"""
+        async with slots:
+            if self.stopped:
+                return None
+            started = time.perf_counter()
+            analysis = await db_call(self.create_row, data)
+            try:
+                analysis_result = await aanalyze_loan(data['customer_input'])
+                error = None
+            except Exception as e:
+                logger.warning("Bulk analysis error on row %d: %s", number, e)
+                analysis_result = {'error': str(e)}
+                error = str(e)
+            await db_call(analysis.save_result, analysis_result)
+            return self.row_event(number, analysis, error, started)
+
+    def accepted_events(self):
+        yield {
+            'event': 'accepted',
+            'rows': len(self.rows) + len(self.invalid),
+            'valid': len(self.rows),
+            'invalid': len(self.invalid),
+            'concurrency': self.concurrency,
+        }
+        for number, errors in self.invalid:
+            yield {'event': 'invalid', 'row': number, 'errors': errors}
+
+    def done_event(self, counts, started):
+        elapsed = time.perf_counter() - started
+        return {
+            'event': 'done',
+            'succeeded': counts['succeeded'],
+            'failed': counts['failed'],
+            'invalid': len(self.invalid),
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(len(self.rows) / elapsed, 3) if elapsed > 0 else None,
+        }
+
+    def events(self):
+        """Generate progress events: accepted, one per row, then done"""
+        started = time.perf_counter()
+        yield from self.accepted_events()
+
+        counts = {'succeeded': 0, 'failed': 0}
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='bulk-analysis')
+        try:
+            futures = [executor.submit(self.analyze_row, number, data) for number, data in self.rows]
+            for future in as_completed(futures):
+                try:
+                    event = future.result()
+                except Exception as e:
+                    logger.exception("Bulk analysis row error")
+                    event = {'event': 'failed', 'error': str(e)}
+                counts[event['event']] += 1
+                yield event
+        finally:
+            # A client that disconnects stops the rows that have not started yet
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        yield self.done_event(counts, started)
+
+    async def aevents(self):
+        """events for ASGI, with the rows run as asyncio tasks `concurrency` at a time"""
+        started = time.perf_counter()
+        for event in self.accepted_events():
+            yield event
+
+        counts = {'succeeded': 0, 'failed': 0}
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = [asyncio.ensure_future(self.aanalyze_row(number, data, slots)) for number, data in self.rows]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    event = await next_done
+                except Exception as e:
+                    logger.exception("Bulk analysis row error")
+                    event = {'event': 'failed', 'error': str(e)}
+                counts[event['event']] += 1
+                yield event
+        finally:
+            # A client that disconnects stops the rows that have not started yet,
+            # like the thread pool, the ones in flight still save their result
+            self.stopped = True
+
+        yield self.done_event(counts, started)
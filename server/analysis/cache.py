@@ -0,0 +1,147 @@
+"""
+Content-addressed cache for analysis results.
+
+Identical applications (same customer_input once canonicalized, same model,
+same prompt version) map to the same key, so a re-submit is answered from a
+local SQLite file instead of another LLM call. Entries expire after a TTL and
+the table is kept under a size bound by evicting the least recently used rows.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from .financials import parse_customer_input
+
+
+def canonicalize(customer_input):
+    """Stable text form of customer_input: sorted compact JSON or normalized text"""
+    data = parse_customer_input(customer_input)
+    if data is not None:
+        return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return re.sub(r'\s+', ' ', str(customer_input)).strip()
+
+
+def cache_key(customer_input, model, prompt_version):
+    payload = f"{model}\n{prompt_version}\n{canonicalize(customer_input)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """SQLite-backed TTL + LRU cache of analysis_result dicts"""
+
+    def __init__(self, path, ttl, max_entries):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self._connection().execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self._connection().execute(
+            'CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)'
+        )
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, hit):
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        """Return the cached result for key, or None on a miss or expired entry"""
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT value, created_at FROM results WHERE key = ?', (key,)
+        ).fetchone()
+
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            self._count(hit=False)
+            return None
+
+        conn.execute(
+            'UPDATE results SET last_used = ?, hits = hits + 1 WHERE key = ?', (now, key)
+        )
+        self._count(hit=True)
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store a result and evict expired and least recently used entries"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO results (key, value, created_at, last_used, hits) '
+            'VALUES (?, ?, ?, ?, 0)',
+            (key, json.dumps(value, separators=(',', ':')), now, now)
+        )
+        conn.execute('DELETE FROM results WHERE created_at < ?', (now - self.ttl,))
+        conn.execute(
+            'DELETE FROM results WHERE key IN ('
+            'SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        self._connection().execute('DELETE FROM results')
+
+    def stats(self):
+        size, stored_hits = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM results'
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'size': size,
+            # Hits recorded on the stored entries by every process sharing the file
+            'stored_hits': stored_hits,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide result cache, or None when caching is disabled"""
+    global _cache
+    if not getattr(settings, 'ANALYSIS_CACHE_ENABLED', True):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                settings.ANALYSIS_CACHE_PATH,
+                ttl=settings.ANALYSIS_CACHE_TTL,
+                max_entries=settings.ANALYSIS_CACHE_MAX_ENTRIES
+            )
+        return _cache
@@ -0,0 +1,184 @@
+"""
+Shared, lazily created clients for outbound services.
+
+Nothing connects at import time, so management commands and tests start
+without credentials or network. Each client is built on first use and then
+reused by every thread, which keeps HTTP keep-alive connections (and their
+TLS sessions) pooled instead of handshaking on every analysis.
+
+Async clients (get_async_groq) are bound to the event loop they were created
+on, so there is one per running loop; under ASGI that is one per process.
+"""
+import asyncio
+import threading
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+_clients = {}
+_stats = {}
+# Event loop -> {name: client}
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _build_supabase():
+    from supabase import create_client
+
+    if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
+        raise ImproperlyConfigured('SUPABASE_URL and SUPABASE_KEY must be set')
+    return create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+
+
+def _groq_options(http_client_class):
+    if not settings.GROQ_API_KEY:
+        raise ImproperlyConfigured('GROQ_API_KEY not found in environment variables')
+    http_client = http_client_class(
+        timeout=settings.GROQ_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=settings.GROQ_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GROQ_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.GROQ_KEEPALIVE_EXPIRY
+        )
+    )
+    return {
+        'api_key': settings.GROQ_API_KEY,
+        'base_url': settings.GROQ_BASE_URL or None,
+        'http_client': http_client,
+        'max_retries': 0,  # Retries and backoff are handled by analysis/upstream.py
+    }
+
+
+def _build_groq():
+    from groq import Groq
+
+    return Groq(**_groq_options(httpx.Client))
+
+
+def _build_async_groq():
+    from groq import AsyncGroq
+
+    return AsyncGroq(**_groq_options(httpx.AsyncClient))
+
+
+_builders = {
+    'supabase': _build_supabase,
+    'groq': _build_groq,
+    'async_groq': _build_async_groq,
+}
+
+
+def get_client(name):
+    """Return the shared client called name, creating it on first use"""
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                started = time.perf_counter()
+                client = _builders[name]()
+                _clients[name] = client
+                _stats[name] = {
+                    'created_at': time.time(),
+                    'init_seconds': round(time.perf_counter() - started, 4),
+                    'uses': 0,
+                }
+    _stats[name]['uses'] += 1
+    return client
+
+
+def get_supabase():
+    return get_client('supabase')
+
+
+def get_groq():
+    return get_client('groq')
+
+
+def get_async_client(name):
+    """
+    Return the async client called name for the running event loop.
+
+    A client installed with set_client is used on every loop instead.
+    """
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(name)
+        if client is None:
+            client = clients[name] = _builders[name]()
+    return client
+
+
+def get_async_groq():
+    return get_async_client('async_groq')
+
+
+def set_client(name, client):
+    """Install a ready-made client, e.g. a stand-in pointed at a local server"""
+    with _lock:
+        _clients[name] = client
+        _stats[name] = {'created_at': time.time(), 'init_seconds': 0.0, 'uses': 0}
+
+
+def reset_clients():
+    """Close and forget every client, e.g. after forking a worker process"""
+    with _lock:
+        for client in _clients.values():
+            for session in _http_sessions(client).values():
+                session.close()
+        _clients.clear()
+        _stats.clear()
+        # Their loops are gone in a forked process, so they cannot be closed
+        _async_clients.clear()
+
+
+def _http_sessions(client):
+    """The httpx clients (connection pools) behind a service client"""
+    sessions = {}
+    inner = getattr(client, '_client', None)  # Groq keeps its httpx.Client here
+    if isinstance(inner, (httpx.Client, httpx.AsyncClient)):
+        sessions['http'] = inner
+    postgrest = getattr(client, 'postgrest', None)
+    if postgrest is not None and isinstance(getattr(postgrest, 'session', None), httpx.Client):
+        sessions['postgrest'] = postgrest.session
+    auth = getattr(client, 'auth', None)
+    if auth is not None and isinstance(getattr(auth, '_http_client', None), httpx.Client):
+        sessions['auth'] = auth._http_client
+    return sessions
+
+
+def _pool_stats(session):
+    pool = getattr(getattr(session, '_transport', None), '_pool', None)
+    connections = list(getattr(pool, 'connections', []) or [])
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        'connections': len(connections),
+        'idle': idle,
+        'active': len(connections) - idle,
+        'max_connections': getattr(pool, '_max_connections', None),
+        'max_keepalive_connections': getattr(pool, '_max_keepalive_connections', None),
+    }
+
+
+def pool_stats():
+    """Creation, usage and connection pool figures for every live client"""
+    with _lock:
+        clients = dict(_clients)
+        stats = {name: dict(values) for name, values in _stats.items()}
+        for loop_clients in list(_async_clients.values()):
+            for name, client in loop_clients.items():
+                clients[name] = client
+                stats.setdefault(name, {})
+    for name, client in clients.items():
+        stats[name]['pools'] = {
+            label: _pool_stats(session)
+            for label, session in _http_sessions(client).items()
+        }
+    return stats
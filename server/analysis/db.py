@@ -0,0 +1,120 @@
+"""
+Primary/replica routing and per-connection database tuning.
+
+Writes, and every read that is not explicitly marked, go to the primary
+('default'). Views mark the reads that can tolerate replica lag (list and
+retrieve) with replica_reads(user); inside that block reads go to a random
+database from DATABASE_REPLICAS. Reads of anything a worker or transaction
+depends on (jobs, the outbox, idempotency keys) therefore never see stale
+rows.
+
+Read-your-writes: Analysis.save pins its user to the primary for
+DB_REPLICA_PIN_SECONDS after the commit. The pin lives in the Django cache,
+so with several worker processes CACHES must be shared between them (the
+default file cache is). A client that creates an analysis and immediately
+lists or fetches it reads the primary, whichever worker serves it.
+
+configure_connection runs for every new connection (see apps.py). On
+SQLite it switches the file to WAL, so readers no longer block the writer,
+and sets a busy timeout, so a second writer waits for the lock instead of
+failing with "database is locked".
+
+db_call awaits ORM work from async views on the event loop's shared thread
+pool (see asyncviews.py).
+"""
+import contextvars
+import logging
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'default'
+PIN_KEY = 'db-primary-pin:{}'
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def replicas():
+    return _setting('DATABASE_REPLICAS', [])
+
+
+def pin_to_primary(user_id):
+    """Send the user's reads to the primary until the replicas have caught up"""
+    if user_id is None or not replicas():
+        return
+    cache.set(PIN_KEY.format(user_id), True, timeout=_setting('DB_REPLICA_PIN_SECONDS', 5))
+
+
+def is_pinned(user_id):
+    return user_id is not None and cache.get(PIN_KEY.format(user_id)) is not None
+
+
+@contextmanager
+def replica_reads(user):
+    """Let reads in the block use a replica, unless the user wrote recently"""
+    enabled = bool(replicas()) and not is_pinned(getattr(user, 'pk', None))
+    token = _replica_reads.set(enabled)
+    try:
+        yield enabled
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return PRIMARY
+        # Follow a related lookup to the database its instance came from
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return random.choice(replicas())
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every database holds the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema from the primary
+        return db == PRIMARY
+
+
+def db_call(fn, *args, **kwargs):
+    """
+    Await blocking (ORM) work from async code.
+
+    It runs on the shared executor rather than a thread kept for the whole
+    request, so a request waiting on Groq does not hold a thread. Each call
+    must be self-contained: a transaction cannot span two db_calls.
+    """
+    return sync_to_async(fn, thread_sensitive=False)(*args, **kwargs)
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created handler: WAL, synchronous and busy timeout for SQLite"""
+    if connection.vendor != 'sqlite':
+        return
+    journal_mode = _setting('SQLITE_JOURNAL_MODE', 'WAL').upper()
+    synchronous = _setting('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+    if journal_mode not in JOURNAL_MODES or synchronous not in SYNCHRONOUS_MODES:
+        logger.warning("Ignoring unknown SQLite journal_mode %s or synchronous %s", journal_mode, synchronous)
+        return
+    busy_timeout = int(_setting('SQLITE_BUSY_TIMEOUT', 20) * 1000)
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+        cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+        cursor.execute(f'PRAGMA synchronous = {synchronous}')
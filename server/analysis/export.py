@@ -0,0 +1,186 @@
+"""
+Streaming CSV and NDJSON export of a user's analyses.
+
+Rows are read in batches of ANALYSIS_EXPORT_BATCH_SIZE, walking the user's
+analyses by id. Each batch is its own short query and is encoded and sent
+before the next one is read, so memory stays flat however many analyses a
+user has, and no cursor or read transaction stays open for the whole
+download. Under WSGI the response iterates the batches directly. Under ASGI
+it gets an async iterator that runs each query through db_call, because
+Django would read a sync iterator into a list there before sending any of it.
+
+Besides the summary columns, every row has risk details flattened out of the
+stored result (only its light sections are decoded). ?fields= adds the
+customer_input and the whole analysis_result, and gzip=true compresses the
+file as it is streamed.
+"""
+import csv
+import io
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+from . import storage
+from .db import db_call
+from .models import Analysis
+
+COLUMNS = ('id', 'customer_name', 'customer_phone', 'loan_amount', 'risk_score', 'approval_probability',
+           'approval_recommendation', 'status', 'created_at', 'updated_at')
+# Column -> (section, key) in analysis_result
+RISK_COLUMNS = {
+    'risk_factors': ('credit_risk_analysis', 'risk_factors'),
+    'debt_to_income_ratio': ('financial_metrics', 'debt_to_income_ratio'),
+    'loan_to_value_ratio': ('financial_metrics', 'loan_to_value_ratio'),
+    'market_risk': ('property_analysis', 'market_risk'),
+    'economic_conditions_risk': ('economic_factors', 'economic_conditions_risk'),
+    'decision_tier': ('scoring', 'tier'),
+}
+OPTIONAL_FIELDS = ('customer_input', 'analysis_result')
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+# Spreadsheets run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class CSVRenderer(BaseRenderer):
+    """Lets DRF content negotiation accept `?format=csv` and `Accept: text/csv`"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only reached for error responses, exports bypass the renderer
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for key, value in (data or {}).items():
+            writer.writerow([key, value if isinstance(value, str) else json.dumps(value)])
+        return out.getvalue().encode(self.charset)
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, separators=(',', ':'), cls=DjangoJSONEncoder)
+    elif hasattr(value, 'isoformat'):
+        return value.isoformat()
+    elif not isinstance(value, str):
+        return value
+    if value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class AnalysisExport:
+    def __init__(self, queryset, kind, fields=(), compress=False, batch_size=None):
+        self.queryset = queryset
+        self.kind = kind
+        self.fields = [name for name in OPTIONAL_FIELDS if name in fields]
+        self.compress = compress
+        self.batch_size = batch_size or _setting('ANALYSIS_EXPORT_BATCH_SIZE', 500)
+        result_columns = (Analysis.RESULT_COLUMNS if 'analysis_result' in self.fields
+                          else Analysis.LIGHT_RESULT_COLUMNS)
+        self.columns = list(dict.fromkeys(
+            [*COLUMNS, *result_columns, *(['customer_input'] if 'customer_input' in self.fields else [])]
+        ))
+        self.header = [*COLUMNS, *RISK_COLUMNS, *self.fields]
+
+    @property
+    def content_type(self):
+        return 'application/gzip' if self.compress else FORMATS[self.kind]
+
+    @property
+    def filename(self):
+        return f"analyses.{self.kind}{'.gz' if self.compress else ''}"
+
+    def fetch(self, after_id):
+        """The next batch of rows after after_id, in id order"""
+        return list(
+            self.queryset.filter(id__gt=after_id).order_by('id').values(*self.columns)[:self.batch_size]
+        )
+
+    def record(self, row):
+        """A row as an ordered dict of exported fields"""
+        if 'analysis_result' in self.fields:
+            result = storage.decode(row['result_json'], row['result_data'], row['result_charts'])
+        else:
+            result = storage.decode_light(row['result_json'], row['result_data'])
+        record = {column: row[column] for column in COLUMNS}
+        for column, (section, key) in RISK_COLUMNS.items():
+            value = result.get(section) if isinstance(result, dict) else None
+            record[column] = value.get(key) if isinstance(value, dict) else None
+        if 'customer_input' in self.fields:
+            record['customer_input'] = row['customer_input']
+        if 'analysis_result' in self.fields:
+            record['analysis_result'] = result
+        return record
+
+    def encode(self, rows, first):
+        if self.kind == 'ndjson':
+            return ''.join(
+                json.dumps(self.record(row), separators=(',', ':'), cls=DjangoJSONEncoder) + '\n'
+                for row in rows
+            )
+        out = io.StringIO()
+        writer = csv.writer(out)
+        if first:
+            writer.writerow(self.header)
+        for row in rows:
+            record = self.record(row)
+            if isinstance(record['risk_factors'], list):
+                record['risk_factors'] = '; '.join(str(factor) for factor in record['risk_factors'])
+            writer.writerow([_cell(record[name]) for name in self.header])
+        return out.getvalue()
+
+    def _compressor(self):
+        # wbits=31 writes a gzip header and trailer
+        return zlib.compressobj(6, zlib.DEFLATED, 31) if self.compress else None
+
+    def _chunk(self, compressor, text):
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor is not None else data
+
+    def chunks(self):
+        """The file as a sync iterator of bytes"""
+        compressor = self._compressor()
+        last_id = 0
+        first = True
+        while True:
+            rows = self.fetch(last_id)
+            if first or rows:
+                chunk = self._chunk(compressor, self.encode(rows, first))
+                if chunk:
+                    yield chunk
+            if len(rows) < self.batch_size:
+                break
+            last_id = rows[-1]['id']
+            first = False
+        if compressor is not None:
+            yield compressor.flush()
+
+    async def achunks(self):
+        """The file as an async iterator of bytes, for ASGI"""
+        compressor = self._compressor()
+        last_id = 0
+        first = True
+        while True:
+            rows = await db_call(self.fetch, last_id)
+            if first or rows:
+                chunk = self._chunk(compressor, self.encode(rows, first))
+                if chunk:
+                    yield chunk
+            if len(rows) < self.batch_size:
+                break
+            last_id = rows[-1]['id']
+            first = False
+        if compressor is not None:
+            yield compressor.flush()
@@ -0,0 +1,83 @@
+"""
+Query-string filtering and sorting for the analyses list.
+
+Every supported combination is served by one of the composite indexes
+declared on Analysis.Meta, all of which lead with `user` because every
+query is scoped to the requesting user.
+"""
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import Analysis
+
+# Sort fields accepted by ?ordering= (prefix with '-' for descending)
+ORDERING_FIELDS = ('created_at', 'loan_amount', 'risk_score', 'approval_probability')
+DEFAULT_ORDERING = '-created_at'
+# Numeric range filters: query parameter prefix -> model field
+RANGE_FILTERS = {
+    'loan_amount': 'loan_amount',
+    'risk_score': 'risk_score',
+    'approval_probability': 'approval_probability',
+}
+
+
+def parse_ordering(params):
+    """Return (field, descending) for the ?ordering= parameter"""
+    ordering = params.get('ordering') or DEFAULT_ORDERING
+    field = ordering.lstrip('-')
+    if field not in ORDERING_FIELDS:
+        raise ValidationError({'ordering': f'Must be one of {list(ORDERING_FIELDS)}, optionally prefixed with "-"'})
+    return field, ordering.startswith('-')
+
+
+def _parse_timestamp(name, value, end_of_day=False):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({name: 'Must be an ISO 8601 date or datetime'})
+        parsed = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _parse_number(name, value):
+    try:
+        return float(value)
+    except ValueError:
+        raise ValidationError({name: 'Must be a number'})
+
+
+def filter_analyses(queryset, params):
+    """Apply the list filters in params to a user-scoped Analysis queryset"""
+    status = params.get('status')
+    if status:
+        statuses = [value.strip() for value in status.split(',') if value.strip()]
+        valid = [choice[0] for choice in Analysis.STATUS_CHOICES]
+        invalid = [value for value in statuses if value not in valid]
+        if invalid:
+            raise ValidationError({'status': f'Invalid status {invalid}. Must be one of: {valid}'})
+        queryset = queryset.filter(status__in=statuses)
+
+    recommendation = params.get('approval_recommendation')
+    if recommendation:
+        queryset = queryset.filter(approval_recommendation=recommendation)
+
+    if params.get('created_after'):
+        queryset = queryset.filter(created_at__gte=_parse_timestamp('created_after', params['created_after']))
+    if params.get('created_before'):
+        queryset = queryset.filter(
+            created_at__lte=_parse_timestamp('created_before', params['created_before'], end_of_day=True)
+        )
+
+    for prefix, field in RANGE_FILTERS.items():
+        for suffix, lookup in (('min', 'gte'), ('max', 'lte')):
+            name = f'{prefix}_{suffix}'
+            if params.get(name) not in (None, ''):
+                queryset = queryset.filter(**{f'{field}__{lookup}': _parse_number(name, params[name])})
+
+    return queryset
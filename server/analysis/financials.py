@@ -0,0 +1,257 @@
+"""
+Deterministic loan and household metrics.
+
+Everything the LLM used to work out by hand (payments, interest, DTI, LTV,
+net worth and the amortization rows) is computed here from the structured
+customer_details / loan_details / market_conditions fields. The amortization
+helpers take scalars or NumPy arrays and broadcast, so a whole grid of loans
+can be evaluated in one pass.
+
+Interest rates are annual percentages throughout (6.5 means 6.5%), as the
+application form sends them. A rate is never guessed to be a fraction, since
+0.5 is a valid rate too.
+"""
+import json
+import math
+
+import numpy as np
+
+AMORTIZATION_YEARS = (1, 5, 10)
+EARLY_PAYMENT_EXTRA = 0.20  # 20% extra on top of the regular monthly payment
+
+
+def parse_customer_input(customer_input):
+    """Return customer_input as a dict, or None when it is not structured JSON"""
+    if isinstance(customer_input, dict):
+        return customer_input
+    try:
+        data = json.loads(customer_input)
+    except (TypeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def to_number(value):
+    """Coerce '6.5%', '$1,200' or 1200 to a float, None if not numeric or not finite"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            number = float(value)
+        except OverflowError:
+            return None
+    elif isinstance(value, str):
+        cleaned = value.replace(',', '').replace('$', '').replace('%', '').strip()
+        try:
+            number = float(cleaned)
+        except ValueError:
+            return None
+    else:
+        return None
+    # float() accepts 'nan' and 'inf', which no amount or rate can be
+    return number if math.isfinite(number) else None
+
+
+def _pick(sources, *names):
+    """First numeric value found under any of the names in any of the sources"""
+    for source in sources:
+        if not isinstance(source, dict):
+            continue
+        for name in names:
+            value = to_number(source.get(name))
+            if value is not None:
+                return value
+    return None
+
+
+def _round(value, digits=2):
+    return None if value is None else round(float(value), digits)
+
+
+def _monthly_rate(annual_rate):
+    """Monthly rate as a fraction from an annual percentage: 6.5 -> 0.065 / 12"""
+    return np.asarray(annual_rate, dtype=float) / 100.0 / 12.0
+
+
+def monthly_payment(principal, annual_rate, months):
+    """Level monthly payment, P * r(1+r)^n / ((1+r)^n - 1), broadcast over arrays (annual_rate in %)"""
+    principal = np.asarray(principal, dtype=float)
+    months = np.asarray(months, dtype=float)
+    r = _monthly_rate(annual_rate)
+    growth = np.power(1.0 + r, months)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amortized = principal * r * growth / (growth - 1.0)
+    return np.where(r > 0, amortized, principal / months)
+
+
+def remaining_balance(principal, annual_rate, payment, months_paid):
+    """Outstanding balance after a number of level payments"""
+    principal = np.asarray(principal, dtype=float)
+    payment = np.asarray(payment, dtype=float)
+    months_paid = np.asarray(months_paid, dtype=float)
+    r = _monthly_rate(annual_rate)
+    growth = np.power(1.0 + r, months_paid)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        balance = principal * growth - payment * (growth - 1.0) / r
+    balance = np.where(r > 0, balance, principal - payment * months_paid)
+    return np.clip(balance, 0.0, None)
+
+
+def payoff_months(principal, annual_rate, payment):
+    """Months needed to clear the loan at a given payment (fractional last month)"""
+    principal = np.asarray(principal, dtype=float)
+    payment = np.asarray(payment, dtype=float)
+    r = _monthly_rate(annual_rate)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        months = -np.log1p(-r * principal / payment) / np.log1p(r)
+    months = np.where(r > 0, months, principal / payment)
+    # Payments that never cover the interest never pay the loan off
+    return np.where(payment > r * principal, months, np.inf)
+
+
+def amortization_rows(principal, annual_rate, months, payment, years=AMORTIZATION_YEARS):
+    """Cumulative principal/interest and remaining balance at the given years"""
+    term_years = float(months) / 12.0
+    years = np.array([year for year in years if year <= term_years] or [term_years])
+    months_paid = np.minimum(years * 12.0, months)
+    balance = remaining_balance(principal, annual_rate, payment, months_paid)
+    principal_paid = principal - balance
+    interest_paid = payment * months_paid - principal_paid
+    return [
+        {
+            'year': int(year) if float(year).is_integer() else round(float(year), 2),
+            'principal_paid': round(float(p), 2),
+            'interest_paid': round(float(i), 2),
+            'remaining_balance': round(float(b), 2),
+        }
+        for year, p, i, b in zip(years, principal_paid, interest_paid, balance)
+    ]
+
+
+def break_even_years(property_value, growth_5yr, principal, annual_rate, payment, months):
+    """First full year in which property appreciation covers cumulative interest"""
+    if not property_value or growth_5yr is None:
+        return None
+    annual_growth = (1.0 + growth_5yr / 100.0) ** (1.0 / 5.0) - 1.0
+    years = np.arange(1, int(np.ceil(months / 12.0)) + 1)
+    months_paid = np.minimum(years * 12.0, months)
+    balance = remaining_balance(principal, annual_rate, payment, months_paid)
+    interest = payment * months_paid - (principal - balance)
+    appreciation = property_value * (np.power(1.0 + annual_growth, years) - 1.0)
+    covered = np.nonzero(appreciation >= interest)[0]
+    return int(years[covered[0]]) if covered.size else None
+
+
+def extract_loan_inputs(data):
+    """Pull the numbers the engine needs out of a structured customer_input"""
+    customer = data.get('customer_details') or {}
+    loan = data.get('loan_details') or {}
+    market = data.get('market_conditions') or {}
+
+    monthly_income = _pick([customer], 'monthly_income')
+    if monthly_income is None:
+        annual_income = _pick([customer], 'annual_income', 'yearly_income')
+        monthly_income = annual_income / 12.0 if annual_income is not None else None
+
+    months = _pick([loan], 'loan_term_months', 'term_months')
+    if months is None:
+        years = _pick([loan], 'loan_term_years', 'loan_term', 'term_years')
+        months = years * 12.0 if years is not None else None
+
+    return {
+        'loan_amount': _pick([data, loan], 'loan_amount', 'principal'),
+        'annual_rate': _pick([loan, market], 'interest_rate', 'annual_interest_rate'),
+        'months': months,
+        'property_value': _pick([loan, customer], 'property_value', 'home_value'),
+        'monthly_income': monthly_income,
+        'monthly_savings': _pick([customer], 'monthly_savings'),
+        'monthly_expenses': _pick([customer], 'monthly_expenses'),
+        'car_payment': _pick([customer], 'car_loan_payment', 'car_payment') or 0.0,
+        'credit_card_payment': _pick([customer], 'credit_card_payment', 'credit_card_payments') or 0.0,
+        'other_debt_payment': _pick([customer], 'other_debt_payments', 'monthly_debt_payments') or 0.0,
+        'total_assets': _pick([customer], 'total_assets', 'assets'),
+        'total_liabilities': _pick([customer], 'total_liabilities', 'liabilities'),
+        'credit_utilization': _pick([customer], 'credit_utilization'),
+        'credit_score': _pick([customer, data], 'credit_score'),
+        'growth_5yr': _pick([market, loan], 'property_value_growth_5yr'),
+        'property_tax_rate': _pick([market, loan], 'property_tax_rate'),
+        'inflation_rate': _pick([market], 'inflation_rate'),
+    }
+
+
+def compute_metrics(customer_input):
+    """
+    Compute financial_metrics, loan_metrics and chart_data locally.
+
+    Returns None when customer_input is unstructured or lacks the loan amount,
+    rate, term or income, in which case the LLM still has to do the maths.
+    """
+    data = parse_customer_input(customer_input)
+    if data is None:
+        return None
+
+    v = extract_loan_inputs(data)
+    if None in (v['loan_amount'], v['annual_rate'], v['months'], v['monthly_income']) \
+            or v['months'] <= 0 or v['monthly_income'] <= 0:
+        return None
+
+    principal, rate, months = v['loan_amount'], v['annual_rate'], v['months']
+    payment = float(monthly_payment(principal, rate, months))
+    total_interest = payment * months - principal
+
+    extra_payment = payment * (1.0 + EARLY_PAYMENT_EXTRA)
+    early_months = float(payoff_months(principal, rate, extra_payment))
+    early_interest = float(
+        extra_payment * early_months - principal
+    ) if np.isfinite(early_months) else total_interest
+
+    monthly_debt = payment + v['car_payment'] + v['credit_card_payment'] + v['other_debt_payment']
+    income = v['monthly_income']
+    savings = v['monthly_savings']
+    if v['monthly_expenses'] is not None:
+        expenses = v['monthly_expenses']
+    elif savings is not None:
+        expenses = income - savings
+    else:
+        expenses = monthly_debt
+
+    assets, liabilities = v['total_assets'], v['total_liabilities']
+    net_worth = assets - liabilities if None not in (assets, liabilities) else None
+
+    return {
+        'financial_metrics': {
+            'debt_to_income_ratio': _round(monthly_debt / income * 100),
+            'loan_to_value_ratio': _round(principal / v['property_value'] * 100) if v['property_value'] else None,
+            'credit_utilization': _round(v['credit_utilization']),
+            'savings_rate': _round(savings / income * 100) if savings is not None else None,
+            'monthly_savings': _round(savings),
+            'net_worth': _round(net_worth),
+            'total_assets': _round(assets),
+            'total_liabilities': _round(liabilities),
+        },
+        'loan_metrics': {
+            'monthly_payment': _round(payment),
+            'total_interest_paid': _round(total_interest),
+            'break_even_years': break_even_years(
+                v['property_value'], v['growth_5yr'], principal, rate, payment, months
+            ),
+            'early_payment_savings': _round(max(total_interest - early_interest, 0.0)),
+        },
+        'chart_data': {
+            'debt_breakdown': {
+                'Car Loan': _round(v['car_payment']),
+                'Mortgage': _round(payment),
+                'Credit Cards': _round(v['credit_card_payment']),
+            },
+            'income_vs_expenses': {
+                'Income': _round(income),
+                'Expenses': _round(expenses),
+                'Savings': _round(savings if savings is not None else income - expenses),
+            },
+            'net_worth_composition': {
+                'Assets': _round(assets),
+                'Liabilities': _round(liabilities),
+            },
+            'loan_amortization': amortization_rows(principal, rate, months, payment),
+        },
+    }
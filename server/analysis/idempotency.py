@@ -0,0 +1,243 @@
+"""
+Idempotent create and in-flight request coalescing.
+
+A create sent with an `Idempotency-Key` header claims that key for the user.
+Repeats of the same request get the stored response back (marked with
+`Idempotent-Replayed: true`) instead of a second Analysis row, Supabase
+insert and Groq call; a repeat that arrives while the first request is still
+running waits for it. Reusing a key for a different body is a 422.
+
+SingleFlight coalesces identical work inside one process: concurrent callers
+with the same key share a single execution and its result. AsyncSingleFlight
+does the same for coroutines on an event loop.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .db import db_call
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Response headers stored with the body and sent again on replay
+REPLAYED_HEADERS = ('Location', 'Retry-After')
+POLL_INTERVAL = 0.1
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def request_fingerprint(request):
+    """Hash of what makes two creates the same request: path, mode and body"""
+    body = json.dumps(request.data, sort_keys=True, separators=(',', ':'), default=str)
+    payload = f"{request.path}\n{request.query_params.get('mode', '')}\n{body}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _error(status, message, **headers):
+    return Response({'error': message}, status=status, headers=headers or None)
+
+
+def replay(record):
+    response = Response(record.response_body, status=record.response_status,
+                        headers=record.response_headers or None)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def claim(user, key, fingerprint):
+    """
+    Claim key for this request.
+
+    Returns (record, None) when this request should run, or (None, response)
+    when it is a repeat that must not: the replayed response, or an error.
+    """
+    deadline = time.monotonic() + _setting('IDEMPOTENCY_WAIT', 30.0)
+    while True:
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(user=user, key=key, request_hash=fingerprint)
+            return record, None
+        except IntegrityError:
+            pass
+
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            # Released by the request that held it, claim it again
+            continue
+
+        now = timezone.now()
+        expired = record.created_at < now - timedelta(seconds=_setting('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+        abandoned = (record.state == 'in_progress' and
+                     record.created_at < now - timedelta(seconds=_setting('IDEMPOTENCY_LOCK_TIMEOUT', 300)))
+        if expired or abandoned:
+            IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+            continue
+
+        if record.request_hash != fingerprint:
+            return None, _error(422, f'{HEADER} was already used for a different request')
+        if record.state == 'completed':
+            logger.info("Idempotent replay", extra={'idempotency_key': key, 'analysis_id': record.analysis_id})
+            return None, replay(record)
+        if time.monotonic() >= deadline:
+            return None, _error(409, f'A request with this {HEADER} is still in progress', **{'Retry-After': '1'})
+        time.sleep(POLL_INTERVAL)
+
+
+def complete(record, response):
+    """Store a successful response for replay; otherwise free the key for a retry"""
+    if not 200 <= response.status_code < 300:
+        record.delete()
+        return
+    data = response.data if isinstance(response.data, dict) else {}
+    record.state = 'completed'
+    record.response_status = response.status_code
+    record.response_body = response.data
+    record.response_headers = {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)}
+    record.analysis_id = data.get('id')
+    record.save(update_fields=['state', 'response_status', 'response_body', 'response_headers', 'analysis'])
+
+
+def idempotent(request, handler):
+    """Run handler() once per Idempotency-Key, replaying its response for repeats"""
+    key = request.headers.get(HEADER, '').strip()
+    if not key:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        return _error(400, f'{HEADER} must be at most {MAX_KEY_LENGTH} characters')
+
+    record, response = claim(request.user, key, request_fingerprint(request))
+    if response is not None:
+        return response
+    try:
+        response = handler()
+    except BaseException:
+        record.delete()
+        raise
+    complete(record, response)
+    return response
+
+
+async def aidempotent(request, handler):
+    """idempotent for async views: handler is a coroutine function"""
+    key = request.headers.get(HEADER, '').strip()
+    if not key:
+        return await handler()
+    if len(key) > MAX_KEY_LENGTH:
+        return _error(400, f'{HEADER} must be at most {MAX_KEY_LENGTH} characters')
+
+    record, response = await db_call(claim, request.user, key, request_fingerprint(request))
+    if response is not None:
+        return response
+    try:
+        response = await handler()
+    except BaseException:
+        await db_call(record.delete)
+        raise
+    await db_call(complete, record, response)
+    return response
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.results = []
+        self.error = None
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its outcome"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.results.pop()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None:
+                    # Copied before this caller can modify the result, so
+                    # every waiter gets its own
+                    call.results = [copy.deepcopy(result) for _ in range(call.waiters)]
+            call.done.set()
+        return result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines: callers on one event loop share a single await"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = self._calls.get((loop, key))
+        if future is not None:
+            try:
+                # Shielded so a cancelled waiter does not cancel the call it shares
+                return copy.deepcopy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # The caller it was waiting for went away, run it again
+            return await self.do(key, fn, *args, **kwargs)
+
+        future = self._calls[(loop, key)] = loop.create_future()
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved, there may be no waiter to do so
+            future.exception()
+            raise
+        else:
+            # Waiters resume after this caller may have modified the result
+            future.set_result(copy.deepcopy(result))
+        finally:
+            del self._calls[(loop, key)]
+        return result
+
+    def in_flight(self):
+        return len(self._calls)
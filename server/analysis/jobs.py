@@ -0,0 +1,251 @@
+"""
+Database-backed job queue for loan analyses.
+
+Jobs live in the AnalysisJob table, so any process that shares the database
+can pick them up - no external broker is needed. Workers claim a job with a
+compare-and-set UPDATE on its state, which keeps two workers (threads or
+processes) from running the same analysis. The stream endpoint takes part
+too: it claims the analysis it is about to run (claim), so concurrent
+connections wait for its job instead of starting another LLM call.
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .db import db_call
+from .models import AnalysisJob
+from .llm import analyze_loan
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class AnalysisWorkerPool:
+    """A pool of worker threads that drain the AnalysisJob queue"""
+
+    def __init__(self, size=None, poll_interval=None, lease_timeout=None, max_attempts=None):
+        self.size = size or _setting('ANALYSIS_JOB_WORKERS', 4)
+        self.poll_interval = poll_interval or _setting('ANALYSIS_JOB_POLL_INTERVAL', 2.0)
+        self.lease_timeout = lease_timeout or _setting('ANALYSIS_JOB_LEASE_TIMEOUT', 300)
+        self.max_attempts = max_attempts or _setting('ANALYSIS_JOB_MAX_ATTEMPTS', 1)
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """Start the worker threads (no-op if already running)"""
+        with self._lock:
+            if self.running:
+                return
+            self._stopping.clear()
+            self.requeue_stale()
+            self._threads = [
+                threading.Thread(
+                    target=self._work,
+                    name=f"analysis-worker-{index}",
+                    daemon=True
+                )
+                for index in range(self.size)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=None):
+        """Ask the workers to exit after their current job and wait for them"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wake(self):
+        """Signal idle workers that a new job is waiting"""
+        self._wakeup.set()
+
+    def requeue_stale(self):
+        """Put back jobs whose worker died mid-run so they are not stuck forever"""
+        cutoff = timezone.now() - timedelta(seconds=self.lease_timeout)
+        return AnalysisJob.objects.filter(
+            state='running',
+            started_at__lt=cutoff
+        ).update(state='queued', worker='')
+
+    def claim_next(self, worker_name):
+        """Atomically move the oldest queued job to running and return it"""
+        while True:
+            candidate = (
+                AnalysisJob.objects.filter(state='queued')
+                .order_by('enqueued_at', 'id')
+                .values_list('id', flat=True)
+                .first()
+            )
+            if candidate is None:
+                return None
+
+            claimed = AnalysisJob.objects.filter(id=candidate, state='queued').update(
+                state='running',
+                worker=worker_name,
+                started_at=timezone.now(),
+                finished_at=None,
+                attempts=F('attempts') + 1
+            )
+            if claimed:
+                return AnalysisJob.objects.select_related('analysis', 'analysis__user').get(id=candidate)
+            # Another worker won the race for this job, try the next one
+
+    def run_job(self, job):
+        """Run the analysis for a claimed job and record the outcome"""
+        analysis = job.analysis
+        try:
+            analysis.save_result(analyze_loan(analysis.customer_input))
+            job.state = 'succeeded'
+            job.error = ''
+        except Exception as e:
+            logger.warning("Job %s failed (attempt %d): %s", job.id, job.attempts, e)
+            job.error = str(e)
+            if job.attempts < self.max_attempts:
+                job.state = 'queued'
+            else:
+                job.state = 'failed'
+                analysis.save_result({'error': str(e)})
+
+        job.finished_at = timezone.now() if job.is_finished else None
+        job.save(update_fields=['state', 'error', 'finished_at'])
+        return job
+
+    def run_once(self, worker_name=None):
+        """Claim and run a single job, returns False when the queue is empty"""
+        job = self.claim_next(worker_name or self.name)
+        if job is None:
+            return False
+        self.run_job(job)
+        return True
+
+    def _work(self):
+        worker_name = f"{self.name}:{threading.current_thread().name}"
+        while not self._stopping.is_set():
+            close_old_connections()
+            try:
+                found = self.run_once(worker_name)
+            except Exception:
+                logger.exception("Worker %s error", worker_name)
+                found = False
+
+            if not found:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        close_old_connections()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide worker pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = AnalysisWorkerPool()
+        return _pool
+
+
+def _wake_workers():
+    if _setting('ANALYSIS_JOB_EMBEDDED_WORKERS', True):
+        pool = get_pool()
+        pool.start()
+        transaction.on_commit(pool.wake)
+
+
+def enqueue(analysis):
+    """Queue an analysis for background processing and return its job"""
+    job = AnalysisJob.objects.create(analysis=analysis)
+    _wake_workers()
+    return job
+
+
+def claim(analysis, worker_name):
+    """
+    Take an analysis to run outside the worker pool, e.g. while streaming it.
+
+    Returns its job, now running under worker_name, or None when another
+    owner is running it or it has already succeeded. A queued or failed job,
+    or a running one whose lease has expired (its owner died), is claimed with
+    the same compare-and-set as claim_next. Without a job, the unique analysis
+    column lets only one of several concurrent claims create it.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=_setting('ANALYSIS_JOB_LEASE_TIMEOUT', 300))
+    claimed = AnalysisJob.objects.filter(
+        Q(state__in=('queued', 'failed')) | Q(state='running', started_at__lt=stale),
+        analysis=analysis
+    ).update(
+        state='running',
+        worker=worker_name,
+        started_at=now,
+        finished_at=None,
+        attempts=F('attempts') + 1
+    )
+    if not claimed:
+        try:
+            with transaction.atomic():
+                AnalysisJob.objects.create(
+                    analysis=analysis, state='running', worker=worker_name, started_at=now, attempts=1
+                )
+        except IntegrityError:
+            return None
+    return AnalysisJob.objects.get(analysis=analysis)
+
+
+def finish(job, error=''):
+    """Record the outcome of a job run through claim"""
+    job.state = 'failed' if error else 'succeeded'
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['state', 'error', 'finished_at'])
+    return job
+
+
+def release(job):
+    """Hand a claimed job that was not finished back to the worker pool"""
+    AnalysisJob.objects.filter(id=job.id, state='running', worker=job.worker).update(state='queued', worker='')
+    _wake_workers()
+
+
+def wait_for(job, timeout):
+    """Block until the job reaches a terminal state or the timeout expires"""
+    deadline = timezone.now() + timedelta(seconds=timeout)
+    interval = 0.25
+    while not job.is_finished and timezone.now() < deadline:
+        time.sleep(interval)
+        interval = min(interval * 2, 2.0)
+        job.refresh_from_db()
+    return job
+
+
+async def await_for(job, timeout):
+    """wait_for for async callers, sleeping on the event loop between polls"""
+    deadline = timezone.now() + timedelta(seconds=timeout)
+    interval = 0.25
+    while not job.is_finished and timezone.now() < deadline:
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, 2.0)
+        await db_call(job.refresh_from_db)
+    return job
@@ -0,0 +1,210 @@
+"""
+Pull a JSON object out of model output and fix the usual LLM mistakes.
+
+find_objects scans the text once, tracking strings and nesting, and yields
+each balanced top-level object (or the unterminated tail of a truncated
+one). Braces inside strings are skipped, and text around the object is
+ignored. A greedy `\\{.*\\}` match would instead span from the first brace of
+a preamble to the last brace of an epilogue.
+
+repair_json is a second single pass over a candidate that fixes what models
+commonly get wrong instead of throwing the whole analysis away:
+- trailing commas and // or /* */ comments
+- single-quoted strings and unquoted keys
+- Python literals: True, False, None
+- NaN and Infinity, which json.loads would otherwise accept, become null
+- raw newlines and tabs inside strings
+- bare values such as 35% or $1200
+- output cut off before the closing brackets
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = {
+    'true': 'true', 'false': 'false', 'null': 'null',
+    'True': 'true', 'False': 'false', 'None': 'null',
+    'NaN': 'null', 'Infinity': 'null', '-Infinity': 'null', 'undefined': 'null',
+}
+_DELIMITERS = set('{}[],:"\'') | set(' \t\r\n')
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+def find_objects(text):
+    """Yield each top-level {...} span in text, then an unterminated tail if any"""
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            if depth:
+                in_string = True
+        elif char == '{':
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                yield text[start:index + 1]
+                start = None
+    if start is not None:
+        yield text[start:]
+
+
+def _is_number(token):
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return token.lower() not in ('nan', 'inf', '-inf', 'infinity', '-infinity', '+inf')
+
+
+def _drop_trailing_comma(out):
+    while out and out[-1] in ' \t\r\n':
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+
+def _last_significant(out):
+    for piece in reversed(out):
+        if piece not in (' ', '\t', '\r', '\n'):
+            return piece
+    return None
+
+
+def repair_json(text):
+    """Rewrite almost-JSON text as JSON, see the module docstring for what is fixed"""
+    out = []
+    stack = []
+    dangling_key = False
+    index = 0
+    length = len(text)
+    while index < length:
+        char = text[index]
+
+        if char in '"\'':
+            # Copy a string, normalising the quotes and escaping raw control characters
+            dangling_key = bool(stack) and stack[-1] == '}' and _last_significant(out) in ('{', ',')
+            quote = char
+            out.append('"')
+            index += 1
+            while index < length:
+                char = text[index]
+                if char == '\\' and index + 1 < length:
+                    following = text[index + 1]
+                    # \' is not a JSON escape
+                    out.append("'" if following == "'" else char + following)
+                    index += 2
+                    continue
+                if char == quote:
+                    break
+                if char == '"':
+                    out.append('\\"')
+                else:
+                    out.append(_CONTROL_ESCAPES.get(char, char))
+                index += 1
+            out.append('"')
+            index += 1
+        elif char == '/' and text.startswith('//', index):
+            end = text.find('\n', index)
+            index = length if end == -1 else end
+        elif char == '/' and text.startswith('/*', index):
+            end = text.find('*/', index + 2)
+            index = length if end == -1 else end + 2
+        elif char in '{[':
+            dangling_key = False
+            stack.append('}' if char == '{' else ']')
+            out.append(char)
+            index += 1
+        elif char in '}]':
+            _drop_trailing_comma(out)
+            if stack:
+                out.append(stack.pop())
+            index += 1
+            if not stack:
+                break
+        elif char in _DELIMITERS:
+            if char not in ' \t\r\n':
+                dangling_key = False
+            out.append(char)
+            index += 1
+        else:
+            end = index
+            while end < length and text[end] not in _DELIMITERS:
+                end += 1
+            token = text[index:end]
+            dangling_key = False
+            if token in _LITERALS:
+                out.append(_LITERALS[token])
+            elif _is_number(token):
+                out.append(token)
+            else:
+                # An unquoted key, or a value like 35% the schema can coerce
+                out.append(json.dumps(token))
+            index = end
+
+    # Cut off mid-object: drop a dangling separator and close what is open
+    while out and out[-1] in ' \t\r\n':
+        out.pop()
+    if out and out[-1] == ':':
+        out.append('null')
+    elif dangling_key and out and out[-1] == '"':
+        # The output stopped right after a key
+        out.append(':null')
+    _drop_trailing_comma(out)
+    out.extend(reversed(stack))
+    return ''.join(out)
+
+
+def _null_constant(name):
+    # NaN and Infinity cannot be stored as JSON, nor compared as scores
+    return None
+
+
+def _strict_loads(text):
+    return json.loads(text, parse_constant=_null_constant)
+
+
+def loads(text):
+    """json.loads, falling back to repair_json when the text is not valid JSON"""
+    try:
+        return _strict_loads(text)
+    except json.JSONDecodeError as error:
+        repaired = repair_json(text)
+        value = _strict_loads(repaired)
+        logger.info("Repaired malformed JSON from the model", extra={'json_error': str(error)})
+        return value
+
+
+def extract_json(text):
+    """The first JSON object in text that parses, repaired if need be"""
+    try:
+        value = _strict_loads(text)
+        if isinstance(value, dict):
+            return value
+    except json.JSONDecodeError:
+        pass
+
+    last_error = None
+    for candidate in find_objects(text):
+        try:
+            value = loads(candidate)
+        except json.JSONDecodeError as error:
+            last_error = error
+            continue
+        if isinstance(value, dict):
+            return value
+    if last_error is not None:
+        raise ValueError(f"Could not parse JSON in response: {last_error}")
+    raise ValueError("No JSON object found in response")
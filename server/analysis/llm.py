@@ -0,0 +1,496 @@
+import json
+import logging
+from .financials import compute_metrics
+from .cache import cache_key, get_cache
+from .db import db_call
+from .idempotency import AsyncSingleFlight, SingleFlight
+from .upstream import UpstreamUnavailable, achat_completion, chat_completion
+from .streaming import SectionParser
+from .jsonrepair import extract_json
+from .schema import validate_analysis, validate_section
+from .log import log_payload, sample_payloads
+from .metrics import record_usage, timed
+from .scoring import triage
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "llama-3.3-70b-versatile"
+# Bump whenever a prompt or the post-processing of the response changes, so
+# results cached for the old prompt are not served for the new one.
+PROMPT_VERSION = "2"
+
+# Structured prompt to get detailed JSON response
+SYSTEM_PROMPT = """You are an expert loan analysis system. Analyze the provided loan application data and return a detailed JSON response.
+            You must ONLY return a valid JSON object matching this exact structure (do not include comments in output):
+
+            {
+              "summary": {
+                "overall_assessment": "A detailed paragraph summarizing the loan application analysis in human-friendly terms",
+                "key_strengths": [
+                  "List of 2-3 key positive factors"
+                ],
+                "key_concerns": [
+                  "List of 2-3 key risk factors or concerns"
+                ],
+                "recommendations": [
+                  "List of 3-4 actionable recommendations for the applicant"
+                ]
+              },
+              "credit_risk_analysis": {
+                "risk_score": (number 0-100),
+                "risk_factors": [(list of risk factor strings)],
+                "approval_probability": (number 0-100),
+                "approval_recommendation": ("Approved", "Denied", or "Manual Review")
+              },
+              "financial_metrics": {
+                "debt_to_income_ratio": (calculated as total monthly debt / monthly income * 100),
+                "loan_to_value_ratio": (calculated as loan amount / property value * 100),
+                "credit_utilization": (from input or calculate),
+                "savings_rate": (from input or calculate as monthly_savings / monthly_income * 100),
+                "monthly_savings": (from input),
+                "net_worth": (total_assets - total_liabilities),
+                "total_assets": (from input),
+                "total_liabilities": (from input)
+              },
+              "loan_metrics": {
+                "monthly_payment": (calculated using loan amount, term, and interest rate),
+                "total_interest_paid": (calculated over full loan term),
+                "break_even_years": (calculated based on property appreciation),
+                "early_payment_savings": (potential savings with 20% extra monthly payment)
+              },
+              "property_analysis": {
+                "property_value_growth_5yr": (from input),
+                "market_risk": ("Low", "Moderate", or "High", based on location and market factors),
+                "property_tax_rate": (from input)
+              },
+              "economic_factors": {
+                "economic_conditions_risk": ("Low", "Moderate", or "High"),
+                "inflation_rate": (current rate from input),
+                "interest_rate_trend": ("Increasing", "Stable", or "Decreasing")
+              },
+              "chart_data": {
+                "debt_breakdown": {
+                  "Car Loan": (monthly car payment),
+                  "Mortgage": (calculated monthly mortgage),
+                  "Credit Cards": (monthly credit card payments)
+                },
+                "income_vs_expenses": {
+                  "Income": (monthly income),
+                  "Expenses": (estimated monthly expenses),
+                  "Savings": (monthly savings)
+                },
+                "net_worth_composition": {
+                  "Assets": (total assets),
+                  "Liabilities": (total liabilities)
+                },
+                "loan_amortization": [
+                  {
+                    "year": 1,
+                    "principal_paid": (first year principal),
+                    "interest_paid": (first year interest),
+                    "remaining_balance": (end of year 1 balance)
+                  },
+                  {
+                    "year": 5,
+                    "principal_paid": (cumulative 5 year principal),
+                    "interest_paid": (cumulative 5 year interest),
+                    "remaining_balance": (end of year 5 balance)
+                  },
+                  {
+                    "year": 10,
+                    "principal_paid": (cumulative 10 year principal),
+                    "interest_paid": (cumulative 10 year interest),
+                    "remaining_balance": (end of year 10 balance)
+                  }
+                ]
+              }
+            }
+
+            Make the overall_assessment engaging and easy to understand, focusing on:
+            1. The applicant's financial health
+            2. The loan's affordability
+            3. Property and market conditions
+            4. Final verdict on the loan
+
+            Recommendations should be specific and actionable, such as:
+            - Ways to improve approval chances
+            - Suggestions for better loan terms
+            - Financial management advice
+            - Property-related considerations
+
+            Calculate all metrics based on standard financial formulas:
+            1. Monthly mortgage payment = P * (r * (1 + r)^n) / ((1 + r)^n - 1)
+               where P = principal, r = monthly interest rate, n = total months
+            2. DTI = Total Monthly Debt Payments / Monthly Income
+            3. LTV = Loan Amount / Property Value
+            4. Use market standards for risk assessment
+
+            Return ONLY the JSON object, no other text or explanation."""
+
+# Used when financials.compute_metrics could work out the numbers locally, so
+# the model only writes the judgement and narrative sections.
+NARRATIVE_SYSTEM_PROMPT = """You are an expert loan analysis system. The financial and loan metrics for the application have already been calculated and are given to you; do not recalculate them.
+You must ONLY return a valid JSON object matching this exact structure (do not include comments in output):
+
+{
+  "summary": {
+    "overall_assessment": "A detailed paragraph summarizing the loan application analysis in human-friendly terms",
+    "key_strengths": ["2-3 key positive factors"],
+    "key_concerns": ["2-3 key risk factors or concerns"],
+    "recommendations": ["3-4 specific, actionable recommendations for the applicant"]
+  },
+  "credit_risk_analysis": {
+    "risk_score": (number 0-100),
+    "risk_factors": [(list of risk factor strings)],
+    "approval_probability": (number 0-100),
+    "approval_recommendation": ("Approved", "Denied", or "Manual Review")
+  },
+  "property_analysis": {
+    "property_value_growth_5yr": (from input),
+    "market_risk": ("Low", "Moderate", or "High"),
+    "property_tax_rate": (from input)
+  },
+  "economic_factors": {
+    "economic_conditions_risk": ("Low", "Moderate", or "High"),
+    "inflation_rate": (from input),
+    "interest_rate_trend": ("Increasing", "Stable", or "Decreasing")
+  }
+}
+
+Base the assessment on the applicant's financial health, the loan's affordability (using the given metrics), property and market conditions, and give a final verdict.
+Return ONLY the JSON object, no other text or explanation."""
+
+REQUIRED_FIELDS = [
+    'summary',
+    'credit_risk_analysis',
+    'financial_metrics',
+    'loan_metrics',
+    'property_analysis',
+    'economic_factors',
+    'chart_data'
+]
+NARRATIVE_FIELDS = ['summary', 'credit_risk_analysis', 'property_analysis', 'economic_factors']
+
+# Identical applications analysed at the same time share one LLM call
+_in_flight = SingleFlight()
+_in_flight_async = AsyncSingleFlight()
+
+
+def build_request(customer_input):
+    """Build the chat messages, expected fields and token budget for an analysis"""
+    # Work out the numbers locally when the input is structured enough
+    metrics = compute_metrics(customer_input)
+    if metrics:
+        system_prompt = NARRATIVE_SYSTEM_PROMPT
+        required_fields = NARRATIVE_FIELDS
+        max_tokens = 1024
+        metrics_text = json.dumps(
+            {key: metrics[key] for key in ('financial_metrics', 'loan_metrics')},
+            separators=(',', ':')
+        )
+        user_prompt = f"""Please analyze this loan application and return ONLY a JSON response matching the specified format:
+
+Customer Information:
+{customer_input}
+
+Calculated Metrics:
+{metrics_text}
+
+Remember: Return ONLY the JSON object, no other text."""
+    else:
+        system_prompt = SYSTEM_PROMPT
+        required_fields = REQUIRED_FIELDS
+        max_tokens = 2048
+        user_prompt = f"""Please analyze this loan application and return ONLY a JSON response matching the specified format:
+
+Customer Information:
+{customer_input}
+
+Remember: Return ONLY the JSON object, no other text."""
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    return messages, required_fields, max_tokens, metrics
+
+
+def parse_response(response_text):
+    """Parse the model output into a dict, tolerating text around the JSON and common slips"""
+    return extract_json(response_text)
+
+
+def check_required_fields(analysis_json, required_fields):
+    """Check the analysis against the schema, returning it with values coerced"""
+    return validate_analysis(analysis_json, required_fields)
+
+
+def analyze_loan(customer_input):
+    """
+    Analyze loan application.
+
+    Clear-cut applications are decided by the local scoring tier, repeats
+    are answered from the result cache, concurrent identical applications
+    wait for the one already being analysed, and only the rest reach the LLM.
+    """
+    local_result, scoring = triage(customer_input)
+    if local_result is not None:
+        return local_result
+
+    key = cache_key(customer_input, MODEL_NAME, PROMPT_VERSION)
+    analysis_json = _in_flight.do(key, cached_analysis, customer_input, key)
+    if scoring:
+        analysis_json['scoring'] = scoring
+    return analysis_json
+
+
+async def aanalyze_loan(customer_input):
+    """analyze_loan for async callers, awaiting the Groq call instead of holding a thread"""
+    local_result, scoring = triage(customer_input)
+    if local_result is not None:
+        return local_result
+
+    key = cache_key(customer_input, MODEL_NAME, PROMPT_VERSION)
+    analysis_json = await _in_flight_async.do(key, acached_analysis, customer_input, key)
+    if scoring:
+        analysis_json['scoring'] = scoring
+    return analysis_json
+
+
+def cached_analysis(customer_input, key):
+    """The cached result for key, generating and caching it on a miss"""
+    cache = get_cache()
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        logger.info("Analysis cache hit", extra={'cache_key': key[:12]})
+        return cached
+
+    analysis_json = generate_analysis(customer_input)
+    if cache is not None:
+        cache.set(key, analysis_json)
+    return analysis_json
+
+
+async def acached_analysis(customer_input, key):
+    # The result cache is a SQLite file, read and written off the event loop
+    cache = await db_call(get_cache)
+    cached = await db_call(cache.get, key) if cache is not None else None
+    if cached is not None:
+        logger.info("Analysis cache hit", extra={'cache_key': key[:12]})
+        return cached
+
+    analysis_json = await agenerate_analysis(customer_input)
+    if cache is not None:
+        await db_call(cache.set, key, analysis_json)
+    return analysis_json
+
+
+def completion_options(messages, max_tokens, stream=False):
+    return {
+        'model': MODEL_NAME,
+        'messages': messages,
+        'temperature': 0.1,
+        'max_tokens': max_tokens,
+        'top_p': 1,
+        'stream': stream,
+    }
+
+
+def read_completion(completion, required_fields, metrics, sampled):
+    """The validated analysis in a (non-streamed) completion"""
+    if not completion.choices:
+        raise ValueError("No choices in completion response")
+
+    record_usage(getattr(completion, 'usage', None))
+    response_text = completion.choices[0].message.content.strip()
+    log_payload(logger, "Raw model response", response_text, sampled)
+
+    with timed('parse'):
+        analysis_json = parse_response(response_text)
+
+        # Validate against the schema, coercing near misses
+        analysis_json = check_required_fields(analysis_json, required_fields)
+
+    if metrics:
+        analysis_json.update(metrics)
+
+    logger.info("Loan analysis generated", extra={
+        'narrative_only': metrics is not None,
+        'total_tokens': getattr(getattr(completion, 'usage', None), 'total_tokens', None),
+    })
+    return analysis_json
+
+
+def _api_error(error):
+    logger.warning("Groq API error: %s: %s", type(error).__name__, error)
+    return ValueError(f"Groq API error: {str(error)}")
+
+
+def _analysis_error(error):
+    logger.exception("Loan analysis failed")
+    return ValueError(f"Failed to analyze loan application: {str(error)}")
+
+
+def generate_analysis(customer_input):
+    """Analyze loan application and return structured data"""
+    sampled = sample_payloads()
+    try:
+        log_payload(logger, "Customer input", customer_input, sampled)
+        messages, required_fields, max_tokens, metrics = build_request(customer_input)
+        try:
+            completion = chat_completion(**completion_options(messages, max_tokens))
+            return read_completion(completion, required_fields, metrics, sampled)
+        except UpstreamUnavailable:
+            raise
+        except Exception as api_error:
+            raise _api_error(api_error)
+
+    except UpstreamUnavailable:
+        # Keep the type so callers can tell the client to come back later
+        raise
+    except Exception as e:
+        raise _analysis_error(e)
+
+
+async def agenerate_analysis(customer_input):
+    """generate_analysis with the completion awaited"""
+    sampled = sample_payloads()
+    try:
+        log_payload(logger, "Customer input", customer_input, sampled)
+        messages, required_fields, max_tokens, metrics = build_request(customer_input)
+        try:
+            completion = await achat_completion(**completion_options(messages, max_tokens))
+            return read_completion(completion, required_fields, metrics, sampled)
+        except UpstreamUnavailable:
+            raise
+        except Exception as api_error:
+            raise _api_error(api_error)
+
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        raise _analysis_error(e)
+
+
+class StreamedAnalysis:
+    """
+    The sections of one streamed completion, fed chunk by chunk.
+
+    Shared by stream_analysis and astream_analysis, which differ only in how
+    they read the stream and the cache.
+    """
+
+    def __init__(self, metrics, required_fields):
+        # Locally computed metrics are known before the model says anything
+        self.analysis_json = dict(metrics or {})
+        self.required_fields = required_fields
+        self.parser = SectionParser()
+
+    def feed(self, chunk):
+        """The sections completed by one stream chunk"""
+        # Groq reports usage on the final chunk of a stream
+        x_groq = getattr(chunk, 'x_groq', None)
+        if x_groq is not None:
+            record_usage(getattr(x_groq, 'usage', None))
+        if not chunk.choices:
+            return []
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            return []
+        completed = []
+        for section, value in self.parser.feed(delta):
+            # Locally computed metrics win over anything the model repeats
+            if section in self.analysis_json:
+                continue
+            value = validate_section(section, value)
+            self.analysis_json[section] = value
+            completed.append((section, value))
+        return completed
+
+    def finish(self):
+        """Sections still missing once the stream ends, then check the whole result"""
+        completed = []
+        if not self.parser.finished:
+            # The output did not stream as a single clean object, parse it whole
+            with timed('parse'):
+                sections = parse_response(self.parser.buffer.strip())
+            for section, value in sections.items():
+                if section not in self.analysis_json:
+                    value = validate_section(section, value)
+                    self.analysis_json[section] = value
+                    completed.append((section, value))
+        self.analysis_json = check_required_fields(self.analysis_json, self.required_fields)
+        return completed
+
+
+def stream_analysis(customer_input):
+    """
+    Analyze a loan application with a streamed completion.
+
+    Yields (section, value) pairs as soon as each top-level section is known:
+    locally computed metrics first, then every section of the model output
+    the moment its JSON value is complete.
+    """
+    local_result, scoring = triage(customer_input)
+    if local_result is not None:
+        yield from local_result.items()
+        return
+
+    cache = get_cache()
+    key = cache_key(customer_input, MODEL_NAME, PROMPT_VERSION)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        yield from cached.items()
+        if scoring:
+            yield 'scoring', scoring
+        return
+
+    messages, required_fields, max_tokens, metrics = build_request(customer_input)
+    streamed = StreamedAnalysis(metrics, required_fields)
+    yield from streamed.analysis_json.items()
+
+    stream = chat_completion(**completion_options(messages, max_tokens, stream=True))
+    for chunk in stream:
+        yield from streamed.feed(chunk)
+    yield from streamed.finish()
+
+    if cache is not None:
+        cache.set(key, streamed.analysis_json)
+    if scoring:
+        yield 'scoring', scoring
+
+
+async def astream_analysis(customer_input):
+    """stream_analysis for async callers, reading the stream from the async Groq client"""
+    local_result, scoring = triage(customer_input)
+    if local_result is not None:
+        for item in local_result.items():
+            yield item
+        return
+
+    cache = await db_call(get_cache)
+    key = cache_key(customer_input, MODEL_NAME, PROMPT_VERSION)
+    cached = await db_call(cache.get, key) if cache is not None else None
+    if cached is not None:
+        for item in cached.items():
+            yield item
+        if scoring:
+            yield 'scoring', scoring
+        return
+
+    messages, required_fields, max_tokens, metrics = build_request(customer_input)
+    streamed = StreamedAnalysis(metrics, required_fields)
+    for item in streamed.analysis_json.items():
+        yield item
+
+    stream = await achat_completion(**completion_options(messages, max_tokens, stream=True))
+    async for chunk in stream:
+        for item in streamed.feed(chunk):
+            yield item
+    for item in streamed.finish():
+        yield item
+
+    if cache is not None:
+        await db_call(cache.set, key, streamed.analysis_json)
+    if scoring:
+        yield 'scoring', scoring
@@ -0,0 +1,53 @@
+"""
+Structured logging helpers.
+
+JSONFormatter writes one JSON object per record, including any `extra=`
+fields. Large payloads (customer input, raw model output) are only logged
+at DEBUG, for a sampled fraction of analyses, and truncated, so the hot
+path does not serialise and write them for every request.
+"""
+import json
+import logging
+import random
+
+from django.conf import settings
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def sample_payloads():
+    """Decide once per analysis whether its large payloads are logged"""
+    rate = getattr(settings, 'LOG_PAYLOAD_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+def truncate(value, limit=None):
+    limit = limit or getattr(settings, 'LOG_PAYLOAD_MAX_CHARS', 2000)
+    if not isinstance(value, str):
+        value = json.dumps(value, default=str)
+    if len(value) <= limit:
+        return value
+    return f'{value[:limit]}... ({len(value)} chars)'
+
+
+def log_payload(logger, message, payload, sampled, **extra):
+    """Log a large payload at DEBUG, only when sampled and DEBUG is enabled"""
+    if sampled and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message, extra={'payload': truncate(payload), **extra})
@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis.cache import get_cache
+
+
+class Command(BaseCommand):
+    help = 'Show statistics for, or clear, the analysis result cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Remove every cached result')
+
+    def handle(self, *args, **options):
+        cache = get_cache()
+        if cache is None:
+            raise CommandError('The analysis cache is disabled (ANALYSIS_CACHE_ENABLED=False)')
+
+        if options['clear']:
+            cache.clear()
+            self.stdout.write(self.style.SUCCESS('Analysis cache cleared'))
+            return
+
+        self.stdout.write(json.dumps(cache.stats(), indent=2))
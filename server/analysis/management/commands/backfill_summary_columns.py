@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from analysis.models import Analysis, extract_summary
+from analysis.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Fill the denormalized summary columns of existing analyses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows read and written per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fields = list(Analysis.SUMMARY_FIELDS)
+        last_id = 0
+        updated = 0
+
+        while True:
+            # Walk the table by primary key so each batch is an index range scan
+            batch = list(
+                Analysis.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'customer_input', *Analysis.LIGHT_RESULT_COLUMNS, *fields)[:batch_size]
+            )
+            if not batch:
+                break
+
+            changed = []
+            for analysis in batch:
+                values = extract_summary(analysis.customer_input, analysis.light_result())
+                if any(getattr(analysis, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(analysis, field, value)
+                    changed.append(analysis)
+
+            # bulk_update skips Analysis.save, so nothing is queued for Supabase
+            Analysis.objects.bulk_update(changed, fields)
+            updated += len(changed)
+            last_id = batch[-1].id
+            self.stdout.write(f'Processed up to id {last_id}, {updated} row(s) updated')
+
+        if updated:
+            # The rollups behind /stats/ are kept current by Analysis.save, which bulk_update skipped
+            rows = rebuild(batch_size=max(batch_size, 1000))
+            self.stdout.write(f'Rebuilt {rows} rollup row(s)')
+        self.stdout.write(self.style.SUCCESS(f'Backfill complete, {updated} row(s) updated'))
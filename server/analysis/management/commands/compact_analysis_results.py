@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from analysis import storage
+from analysis.models import Analysis, CompressionDictionary
+
+
+class Command(BaseCommand):
+    help = 'Rewrite stored analysis results in the ANALYSIS_RESULT_STORAGE format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Rows read and written per batch')
+        parser.add_argument('--train-dictionary', action='store_true',
+                            help='Train a compression dictionary from stored results first')
+        parser.add_argument('--samples', type=int, default=500,
+                            help='Most recent results to train the dictionary on')
+        parser.add_argument('--dictionary-size', type=int, default=16 * 1024,
+                            help='Dictionary size in bytes')
+
+    def handle(self, *args, **options):
+        mode = storage.storage_mode()
+        if options['train_dictionary']:
+            if mode == 'json':
+                raise CommandError('Set ANALYSIS_RESULT_STORAGE to zlib or zstd to train a dictionary')
+            self.train(mode, options['samples'], options['dictionary_size'])
+
+        batch_size = options['batch_size']
+        last_id = 0
+        rewritten = skipped = 0
+        before = after = 0
+
+        while True:
+            # Walk the table by primary key so each batch is an index range scan
+            batch = list(
+                Analysis.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'updated_at', *Analysis.RESULT_COLUMNS)[:batch_size]
+            )
+            if not batch:
+                break
+
+            with transaction.atomic():
+                for analysis in batch:
+                    columns = [getattr(analysis, column) for column in Analysis.RESULT_COLUMNS]
+                    encoded = storage.encode(storage.decode(*columns), mode)
+                    # Only write the row if nothing saved it since it was read: every
+                    # result write bumps updated_at. update() skips Analysis.save, which
+                    # is fine as the result itself is unchanged, so nothing is mirrored.
+                    written = Analysis.objects.filter(pk=analysis.pk, updated_at=analysis.updated_at).update(
+                        **dict(zip(Analysis.RESULT_COLUMNS, encoded))
+                    )
+                    if written:
+                        before += storage.stored_size(*columns)
+                        after += storage.stored_size(*encoded)
+                        rewritten += 1
+                    else:
+                        skipped += 1
+            last_id = batch[-1].id
+            self.stdout.write(f'Processed up to id {last_id}, {rewritten} row(s) rewritten')
+
+        if skipped:
+            # A concurrent save already stored these in the current format
+            self.stdout.write(f'Skipped {skipped} row(s) saved during the run')
+        ratio = f' ({after / before:.0%} of the original size)' if before else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored results as {mode}: {before} -> {after} bytes{ratio}'
+        ))
+
+    def train(self, mode, sample_count, size):
+        samples = []
+        for analysis in Analysis.objects.order_by('-id').only('id', *Analysis.RESULT_COLUMNS)[:sample_count]:
+            result = analysis.analysis_result
+            if not isinstance(result, dict):
+                continue
+            # Train on the documents exactly as they are compressed
+            light, heavy = storage.split(result)
+            samples.extend(storage.dumps(part) for part in (light, heavy) if part)
+        if not samples:
+            raise CommandError('There are no stored results to train a dictionary on')
+
+        samples.reverse()
+        data = storage.train_dictionary(mode, samples, size)
+        dictionary = CompressionDictionary.objects.create(codec=mode, data=data, sample_count=len(samples))
+        storage.forget_dictionaries()
+        self.stdout.write(f'Trained {mode} dictionary {dictionary.id}: {len(data)} bytes from {len(samples)} samples')
@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the portfolio rollups behind /api/analyses/stats/ from the analyses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only rebuild the rollups of the user with this email')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Analyses read per batch')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(email=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user with email {options['user']}")
+
+        rows = rebuild(user, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} rollup row(s)'))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from analysis.jobs import AnalysisWorkerPool
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of workers that process queued loan analyses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of worker threads (defaults to ANALYSIS_JOB_WORKERS)')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue and exit instead of waiting for new jobs')
+
+    def handle(self, *args, **options):
+        pool = AnalysisWorkerPool(size=options['workers'])
+
+        if options['once']:
+            pool.requeue_stale()
+            processed = 0
+            while pool.run_once():
+                processed += 1
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} job(s)'))
+            return
+
+        self.stdout.write(f'Starting {pool.size} analysis worker(s) as {pool.name}')
+        pool.start()
+        try:
+            while pool.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping workers after their current jobs...')
+            pool.stop()
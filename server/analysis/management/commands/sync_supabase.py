@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from analysis.sync import SupabaseSyncWorker
+
+
+class Command(BaseCommand):
+    help = 'Mirror pending analysis changes from the outbox to Supabase'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the outbox and exit instead of running continuously')
+
+    def handle(self, *args, **options):
+        worker = SupabaseSyncWorker()
+
+        if options['once']:
+            synced = 0
+            while True:
+                processed = worker.run_once()
+                if not processed:
+                    break
+                synced += processed
+            self.stdout.write(self.style.SUCCESS(f'Synced {synced} analyses'))
+            return
+
+        self.stdout.write('Starting Supabase sync worker')
+        worker.start()
+        try:
+            while worker.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping Supabase sync worker...')
+            worker.stop()
@@ -0,0 +1,252 @@
+"""
+Process-local metrics in the Prometheus text exposition format.
+
+Stages of an analysis (auth, validation of bulk rows, llm, parse, db_save, supabase_sync,
+report_render) record their durations in one labelled histogram, so `/metrics` shows where
+request time goes. Groq token usage is counted per request, as are local scoring
+decisions, and the client pool and result cache statistics are exported as
+gauges when scraped.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import HttpResponse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; from a cached token lookup up to a slow completion
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            series = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class GaugeCallback:
+    """Gauges whose samples are produced by a function at scrape time"""
+
+    def __init__(self, name, documentation, labelnames, callback):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} gauge'
+        for key, value in self.callback():
+            if value is None:
+                continue
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+stage_seconds = Histogram(
+    'lendsure_stage_duration_seconds',
+    'Time spent in each stage of handling an analysis',
+    ['stage']
+)
+llm_requests = Counter(
+    'lendsure_llm_requests_total',
+    'Groq chat completion attempts by outcome',
+    ['outcome']
+)
+llm_tokens = Counter(
+    'lendsure_llm_tokens_total',
+    'Groq tokens used, by kind',
+    ['kind']
+)
+llm_tokens_per_request = Histogram(
+    'lendsure_llm_tokens_per_request',
+    'Groq tokens used by a single completion, by kind',
+    ['kind'],
+    buckets=TOKEN_BUCKETS
+)
+reports = Counter(
+    'lendsure_reports_total',
+    'PDF report downloads, served from the disk cache or rendered',
+    ['outcome']
+)
+scoring_decisions = Counter(
+    'lendsure_scoring_decisions_total',
+    'Analyses by scoring tier: decided locally, sent to the LLM as borderline, or unscorable',
+    ['tier']
+)
+
+
+def timed(stage):
+    """Context manager recording the duration of one stage"""
+    return stage_seconds.time(stage=stage)
+
+
+def record_usage(usage):
+    """Count the prompt/completion tokens reported for one completion"""
+    if usage is None:
+        return
+    for kind in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+        value = getattr(usage, kind, None)
+        if value is None and isinstance(usage, dict):
+            value = usage.get(kind)
+        if value is None:
+            continue
+        label = kind[:-len('_tokens')]
+        llm_tokens.inc(value, kind=label)
+        llm_tokens_per_request.observe(value, kind=label)
+
+
+def _pool_samples():
+    from .clients import pool_stats
+
+    for client, stats in pool_stats().items():
+        yield (client, 'uses', ''), stats.get('uses')
+        for pool, figures in stats.get('pools', {}).items():
+            for name in ('connections', 'idle', 'active'):
+                yield (client, name, pool), figures.get(name)
+
+
+def _cache_samples():
+    from .cache import get_cache
+
+    cache = get_cache()
+    if cache is None:
+        return
+    stats = cache.stats()
+    for name in ('hits', 'misses', 'hit_rate', 'size'):
+        yield (name,), stats.get(name)
+
+
+def _breaker_samples():
+    from .upstream import get_gateway
+
+    breaker = get_gateway().breaker.stats()
+    yield ('open',), 1 if breaker['state'] != 'closed' else 0
+    yield ('failures',), breaker['failures']
+
+
+def _scoring_samples():
+    from .scoring import local_share
+
+    yield ('local_share',), local_share()
+
+
+REGISTRY = [
+    stage_seconds,
+    llm_requests,
+    llm_tokens,
+    llm_tokens_per_request,
+    GaugeCallback('lendsure_client_pool', 'Outbound client usage and connection pool figures',
+                  ['client', 'figure', 'pool'], _pool_samples),
+    GaugeCallback('lendsure_result_cache', 'Analysis result cache figures', ['figure'], _cache_samples),
+    GaugeCallback('lendsure_groq_circuit', 'Groq circuit breaker state', ['figure'], _breaker_samples),
+    scoring_decisions,
+    reports,
+    GaugeCallback('lendsure_scoring', 'Share of analyses answered by the local scoring tier',
+                  ['figure'], _scoring_samples),
+]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        try:
+            lines.extend(metric.collect())
+        except Exception:
+            # A broken collector must not take the whole scrape down
+            continue
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """GET /metrics, protected by METRICS_TOKEN when that is set"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.META.get('HTTP_AUTHORIZATION') != f'Bearer {token}':
+        return HttpResponse('Unauthorized\n', status=401, content_type='text/plain')
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0005_analysisjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SupabaseOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changed_fields', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lock_token', models.CharField(blank=True, default='', max_length=64)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='analysis.analysis')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['next_attempt_at'], name='analysis_outbox_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0006_supabaseoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='approval_probability',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='approval_recommendation',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='customer_name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='loan_amount',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='risk_score',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+    ]
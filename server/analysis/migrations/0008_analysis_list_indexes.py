@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0007_analysis_summary_columns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='analysis_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['user', 'status', '-created_at', '-id'], name='analysis_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['user', 'loan_amount', 'id'], name='analysis_user_loan_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['user', 'risk_score', 'id'], name='analysis_user_risk_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['user', 'approval_probability', 'id'], name='analysis_user_approval_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0009_idempotencykey'),
+    ]
+
+    operations = [
+        # The field is renamed, the analysis_result column stays where it is
+        migrations.AlterField(
+            model_name='analysis',
+            name='analysis_result',
+            field=models.JSONField(blank=True, db_column='analysis_result', null=True),
+        ),
+        migrations.RenameField(
+            model_name='analysis',
+            old_name='analysis_result',
+            new_name='result_json',
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='result_data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='result_charts',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codec', models.CharField(max_length=10)),
+                ('data', models.BinaryField()),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('analysis', '0010_analysis_result_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('approval_recommendation', models.CharField(blank=True, default='', max_length=32)),
+                ('risk_band', models.SmallIntegerField(default=-1)),
+                ('count', models.IntegerField(default=0)),
+                ('loan_amount_sum', models.FloatField(default=0)),
+                ('loan_amount_count', models.IntegerField(default=0)),
+                ('risk_score_sum', models.FloatField(default=0)),
+                ('risk_score_count', models.IntegerField(default=0)),
+                ('approval_probability_sum', models.FloatField(default=0)),
+                ('approval_probability_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='analysisrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'status', 'approval_recommendation', 'risk_band'), name='analysis_rollup_bucket'),
+        ),
+    ]
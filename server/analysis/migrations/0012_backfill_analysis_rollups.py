@@ -0,0 +1,70 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.utils import timezone
+
+# Frozen copies of AnalysisRollup's constants and analysis.rollups.rebuild, so
+# later changes to the app do not change what this migration writes
+SUMMED_FIELDS = ('loan_amount', 'risk_score', 'approval_probability')
+NO_RISK_BAND = -1
+BATCH_SIZE = 1000
+
+
+def risk_band(risk_score):
+    if risk_score is None:
+        return NO_RISK_BAND
+    return int(min(max(risk_score, 0), 99.999) // 10 * 10)
+
+
+def backfill_rollups(apps, schema_editor):
+    Analysis = apps.get_model('analysis', 'Analysis')
+    AnalysisRollup = apps.get_model('analysis', 'AnalysisRollup')
+    entries = defaultdict(lambda: [0] + [0.0, 0] * len(SUMMED_FIELDS))
+
+    last_id = 0
+    while True:
+        batch = list(
+            Analysis.objects.filter(id__gt=last_id).order_by('id').values(
+                'id', 'user_id', 'created_at', 'status', 'approval_recommendation', *SUMMED_FIELDS
+            )[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for values in batch:
+            key = (
+                values['user_id'],
+                timezone.localdate(values['created_at']),
+                values['status'],
+                values['approval_recommendation'] or '',
+                risk_band(values['risk_score']),
+            )
+            totals = entries[key]
+            totals[0] += 1
+            for index, field in enumerate(SUMMED_FIELDS):
+                if values[field] is not None:
+                    totals[1 + 2 * index] += values[field]
+                    totals[2 + 2 * index] += 1
+        last_id = batch[-1]['id']
+
+    AnalysisRollup.objects.all().delete()
+    rows = []
+    for (user_id, day, status, recommendation, band), totals in entries.items():
+        row = AnalysisRollup(user_id=user_id, day=day, status=status, approval_recommendation=recommendation,
+                             risk_band=band, count=totals[0])
+        for index, field in enumerate(SUMMED_FIELDS):
+            setattr(row, f'{field}_sum', totals[1 + 2 * index])
+            setattr(row, f'{field}_count', totals[2 + 2 * index])
+        rows.append(row)
+    AnalysisRollup.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0011_analysisrollup'),
+    ]
+
+    operations = [
+        # Existing analyses predate the rollups, which saves keep current from here on
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -1,14 +1,15 @@
-from django.db import models
+import copy
+
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
-from django.conf import settings
-import os
-from supabase import create_client
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
-# Initialize Supabase client
-supabase = create_client(
-    os.environ.get('SUPABASE_URL'),
-    os.environ.get('SUPABASE_KEY')
-)
+from . import storage
+from .db import pin_to_primary
+from .financials import parse_customer_input, to_number
+from .metrics import timed
 
 class Analysis(models.Model):
     STATUS_CHOICES = [
@@ -21,7 +22,11 @@ class Analysis(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     customer_input = models.TextField()
     customer_phone = models.CharField(max_length=20)
-    analysis_result = models.JSONField()
+    # analysis_result is read and written through the property below, these
+    # columns hold it as plain JSON or compressed (see analysis/storage.py)
+    result_json = models.JSONField(null=True, blank=True, db_column='analysis_result')
+    result_data = models.BinaryField(null=True, blank=True)
+    result_charts = models.BinaryField(null=True, blank=True)
     status = models.CharField(
         max_length=20,
         choices=STATUS_CHOICES,
@@ -31,29 +36,433 @@ class Analysis(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     supabase_id = models.CharField(max_length=100, blank=True, null=True)
 
+    # Summary columns extracted from customer_input / analysis_result on save,
+    # so lists can show and filter on them without parsing JSON per row
+    customer_name = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    loan_amount = models.FloatField(blank=True, null=True, db_index=True)
+    risk_score = models.FloatField(blank=True, null=True, db_index=True)
+    approval_probability = models.FloatField(blank=True, null=True, db_index=True)
+    approval_recommendation = models.CharField(max_length=32, blank=True, default='', db_index=True)
+
     class Meta:
         ordering = ['-created_at']
-        
-    def save(self, *args, **kwargs):
-        # Save to Supabase first
-        data = {
-            'user_email': self.user.email,
-            'customer_input': self.customer_input,
-            'customer_phone': self.customer_phone,
-            'analysis_result': self.analysis_result,
-            'status': self.status
+        # Every list query is scoped to one user, so each index leads with it.
+        # The trailing id matches the keyset pagination tiebreaker.
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='analysis_user_created_idx'),
+            models.Index(fields=['user', 'status', '-created_at', '-id'], name='analysis_user_status_idx'),
+            models.Index(fields=['user', 'loan_amount', 'id'], name='analysis_user_loan_idx'),
+            models.Index(fields=['user', 'risk_score', 'id'], name='analysis_user_risk_idx'),
+            models.Index(fields=['user', 'approval_probability', 'id'], name='analysis_user_approval_idx'),
+        ]
+
+    # Columns mirrored to the Supabase `analyses` table
+    MIRRORED_FIELDS = ('customer_input', 'customer_phone', 'analysis_result', 'status')
+    # Summary columns and the source fields they are extracted from
+    SUMMARY_FIELDS = ('customer_name', 'loan_amount', 'risk_score',
+                      'approval_probability', 'approval_recommendation')
+    SUMMARY_SOURCES = ('customer_input', 'analysis_result')
+    # Columns storing analysis_result, and those needed for all but its heavy sections
+    RESULT_COLUMNS = ('result_json', 'result_data', 'result_charts')
+    LIGHT_RESULT_COLUMNS = ('result_json', 'result_data')
+    # Columns that decide an analysis' AnalysisRollup entry
+    ROLLUP_FIELDS = ('user_id', 'created_at', 'status', 'approval_recommendation',
+                     'risk_score', 'loan_amount', 'approval_probability')
+
+    @property
+    def analysis_result(self):
+        if '_analysis_result' not in self.__dict__:
+            self._analysis_result = storage.decode(self.result_json, self.result_data, self.result_charts)
+        return self._analysis_result
+
+    @analysis_result.setter
+    def analysis_result(self, value):
+        self._analysis_result = value
+
+    def light_result(self):
+        """analysis_result without the heavy sections, which are not read when stored apart"""
+        if '_analysis_result' in self.__dict__:
+            return self._analysis_result
+        return storage.decode_light(self.result_json, self.result_data)
+
+    def _store_result(self):
+        """Encode a result that was set or read since loading into its columns"""
+        if '_analysis_result' in self.__dict__:
+            for column, value in zip(self.RESULT_COLUMNS, storage.encode(self._analysis_result)):
+                setattr(self, column, value)
+
+    def _stored_result(self):
+        deferred = self.get_deferred_fields()
+        if deferred.intersection(self.RESULT_COLUMNS):
+            return None
+        return tuple(bytes(value) if isinstance(value, memoryview) else value
+                     for value in (getattr(self, column) for column in self.RESULT_COLUMNS))
+
+    def _deferred_sources(self):
+        """Deferred fields, counting analysis_result when its light columns are"""
+        deferred = self.get_deferred_fields()
+        if '_analysis_result' not in self.__dict__ and deferred.intersection(self.LIGHT_RESULT_COLUMNS):
+            deferred.add('analysis_result')
+        return deferred
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_mirrored_values()
+        return instance
+
+    def _remember_mirrored_values(self):
+        deferred = self.get_deferred_fields()
+        self._mirrored_values = {
+            field: copy.deepcopy(getattr(self, field))
+            for field in self.MIRRORED_FIELDS
+            if field not in deferred and field != 'analysis_result'
         }
-        
-        if not self.supabase_id:
-            # Create new record in Supabase
-            result = supabase.table('analyses').insert(data).execute()
-            if result.data:
-                self.supabase_id = result.data[0]['id']
-        else:
-            # Update existing record in Supabase
-            supabase.table('analyses').update(data).eq('id', self.supabase_id).execute()
-            
-        super().save(*args, **kwargs)
-        
+        # The result is compared in its stored form, so loading a row does not decode it
+        self._stored_result_values = self._stored_result()
+
+    def rollup_entry(self):
+        """This analysis' AnalysisRollup entry, None when a field it needs is not loaded"""
+        if self._state.adding or self.get_deferred_fields().intersection(self.ROLLUP_FIELDS):
+            return None
+        return rollup_entry({field: getattr(self, field) for field in self.ROLLUP_FIELDS})
+
+    def _locked_rollup_values(self, using):
+        """The row's rollup fields as stored, locked until the transaction ends"""
+        rows = Analysis.objects.using(using).filter(pk=self.pk)
+        if connections[using].vendor == 'sqlite':
+            # SQLite ignores FOR UPDATE, and a transaction that reads before it
+            # writes fails at once when another writer got in between. Writing
+            # first takes the database lock, waiting out the busy timeout.
+            rows.update(id=F('id'))
+        return rows.select_for_update().values(*self.ROLLUP_FIELDS).first()
+
+    def refresh_from_db(self, using=None, fields=None):
+        reload_result = fields is None or 'analysis_result' in fields
+        if fields is not None and 'analysis_result' in fields:
+            fields = [field for field in fields if field != 'analysis_result'] + list(self.RESULT_COLUMNS)
+        super().refresh_from_db(using=using, fields=fields)
+        if reload_result:
+            self.__dict__.pop('_analysis_result', None)
+            self._remember_mirrored_values()
+        elif '_analysis_result' not in self.__dict__ and set(fields).intersection(self.RESULT_COLUMNS):
+            # A deferred result column was loaded on first access
+            self._stored_result_values = self._stored_result()
+
+    def changed_mirrored_fields(self, update_fields=None):
+        """Mirrored columns whose value differs from what was last loaded or saved"""
+        if self._state.adding:
+            return list(self.MIRRORED_FIELDS)
+
+        previous = getattr(self, '_mirrored_values', {})
+        candidates = self.MIRRORED_FIELDS if update_fields is None else [
+            field for field in self.MIRRORED_FIELDS if field in update_fields
+        ]
+        return [
+            field for field in candidates
+            if field == 'analysis_result' and self._result_changed()
+            or field in previous and getattr(self, field) != previous[field]
+        ]
+
+    def _result_changed(self):
+        if '_analysis_result' not in self.__dict__:
+            return False
+        self._store_result()
+        stored = getattr(self, '_stored_result_values', None)
+        return stored is None or self._stored_result() != stored
+
+    def refresh_summary_fields(self):
+        for field, value in extract_summary(self.customer_input, self.light_result()).items():
+            setattr(self, field, value)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        deferred = self._deferred_sources()
+        if update_fields is None:
+            if not deferred.intersection(self.SUMMARY_SOURCES):
+                self.refresh_summary_fields()
+        elif set(update_fields).intersection(self.SUMMARY_SOURCES) and not deferred.intersection(self.SUMMARY_SOURCES):
+            self.refresh_summary_fields()
+            kwargs['update_fields'] = update_fields = list(set(update_fields).union(self.SUMMARY_FIELDS))
+
+        # Record what changed in the outbox, in the same transaction as the row
+        # itself. The sync worker mirrors it to Supabase outside the request.
+        changed = self.changed_mirrored_fields(update_fields)
+        self._store_result()
+        if update_fields is not None and 'analysis_result' in update_fields:
+            kwargs['update_fields'] = update_fields = [
+                field for field in update_fields if field != 'analysis_result'
+            ] + list(self.RESULT_COLUMNS)
+
+        if not self._state.adding and update_fields is None:
+            deferred = self.get_deferred_fields()
+            # supabase_id is only ever written by the sync worker, do not
+            # overwrite it from an instance loaded before the first sync
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'supabase_id'
+                and field.attname not in deferred
+            ]
+
+        adding = self._state.adding
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        update_fields = kwargs.get('update_fields')
+        # Rollup fields this save writes; the others keep whatever the row holds
+        written = [
+            field for field in self.ROLLUP_FIELDS
+            if update_fields is None or self._meta.get_field(field).name in update_fields
+        ]
+        with timed('db_save'), transaction.atomic(using=using):
+            # Read from the row, not the instance, which may be stale by now
+            stored = self._locked_rollup_values(using) if not adding and written else None
+            super().save(*args, **kwargs)
+            if changed:
+                SupabaseOutbox.objects.create(analysis=self, changed_fields=changed)
+            # Move this analysis between rollup buckets in the same transaction
+            if adding:
+                AnalysisRollup.apply(self.rollup_entry(), 1)
+            elif stored is not None:
+                previous = rollup_entry(stored)
+                current = rollup_entry(dict(stored, **{field: getattr(self, field) for field in written}))
+                if current != previous:
+                    AnalysisRollup.apply(previous, -1)
+                    AnalysisRollup.apply(current, 1)
+
+        self._remember_mirrored_values()
+        if changed:
+            transaction.on_commit(_notify_supabase_sync)
+        if {'analysis_result', 'status'}.intersection(changed):
+            # The cached PDF shows both, drop it rather than wait for it to be pruned
+            transaction.on_commit(lambda analysis_id=self.pk: _invalidate_report(analysis_id))
+        # Until the replicas have this write, the user's reads go to the primary
+        transaction.on_commit(lambda user_id=self.user_id: pin_to_primary(user_id))
+
+    def save_result(self, analysis_result):
+        """
+        Store a finished analysis without writing the other columns, so a
+        status changed while the LLM was running is not put back
+        """
+        self.analysis_result = analysis_result
+        self.save(update_fields=['analysis_result', 'updated_at'])
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            stored = self._locked_rollup_values(using)
+            deleted = super().delete(*args, **kwargs)
+            AnalysisRollup.apply(rollup_entry(stored) if stored is not None else None, -1)
+        transaction.on_commit(lambda user_id=self.user_id: pin_to_primary(user_id))
+        return deleted
+
     def __str__(self):
         return f"Analysis for {self.customer_phone} by {self.user.email}"
+
+
+def extract_summary(customer_input, analysis_result):
+    """Values of the Analysis summary columns for the given input and result"""
+    data = parse_customer_input(customer_input) or {}
+    result = analysis_result if isinstance(analysis_result, dict) else {}
+    risk = result.get('credit_risk_analysis')
+    risk = risk if isinstance(risk, dict) else {}
+
+    return {
+        'customer_name': str(data.get('customer_name') or '')[:255],
+        'loan_amount': to_number(data.get('loan_amount')),
+        'risk_score': to_number(risk.get('risk_score')),
+        'approval_probability': to_number(risk.get('approval_probability')),
+        'approval_recommendation': str(risk.get('approval_recommendation') or '')[:32],
+    }
+
+
+def risk_band(risk_score):
+    """Lower bound of the 10 point band risk_score falls in, NO_RISK_BAND without one"""
+    if risk_score is None:
+        return AnalysisRollup.NO_RISK_BAND
+    return int(min(max(risk_score, 0), 99.999) // 10 * 10)
+
+
+def rollup_entry(values):
+    """(bucket key, summed values) an analysis adds to AnalysisRollup, from its ROLLUP_FIELDS"""
+    key = (
+        values['user_id'],
+        timezone.localdate(values['created_at']),
+        values['status'],
+        values['approval_recommendation'] or '',
+        risk_band(values['risk_score']),
+    )
+    return key, tuple(values[field] for field in AnalysisRollup.SUMMED_FIELDS)
+
+
+class AnalysisRollup(models.Model):
+    """
+    Running counts and sums of a user's analyses per day, status,
+    recommendation and risk band. Analysis.save and delete keep it current,
+    `rebuild_analysis_rollups` recomputes it, and GET /api/analyses/stats/
+    reads only these rows (see analysis/rollups.py).
+    """
+    NO_RISK_BAND = -1
+    # Fields averaged by the stats endpoint, each with a _sum and _count column
+    SUMMED_FIELDS = ('loan_amount', 'risk_score', 'approval_probability')
+    KEY_FIELDS = ('user_id', 'day', 'status', 'approval_recommendation', 'risk_band')
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    approval_recommendation = models.CharField(max_length=32, blank=True, default='')
+    # Lower bound of a 10 point risk score band, NO_RISK_BAND when unscored
+    risk_band = models.SmallIntegerField(default=NO_RISK_BAND)
+    count = models.IntegerField(default=0)
+    loan_amount_sum = models.FloatField(default=0)
+    loan_amount_count = models.IntegerField(default=0)
+    risk_score_sum = models.FloatField(default=0)
+    risk_score_count = models.IntegerField(default=0)
+    approval_probability_sum = models.FloatField(default=0)
+    approval_probability_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'status', 'approval_recommendation', 'risk_band'],
+                                    name='analysis_rollup_bucket'),
+        ]
+
+    @classmethod
+    def apply(cls, entry, sign):
+        """Add (sign=1) or remove (sign=-1) one analysis' entry"""
+        if entry is None:
+            return
+        key, values = entry
+        lookup = dict(zip(cls.KEY_FIELDS, key))
+        changes = {'count': F('count') + sign}
+        initial = {'count': sign}
+        for field, value in zip(cls.SUMMED_FIELDS, values):
+            if value is not None:
+                changes[f'{field}_sum'] = F(f'{field}_sum') + sign * value
+                changes[f'{field}_count'] = F(f'{field}_count') + sign
+                initial[f'{field}_sum'] = sign * value
+                initial[f'{field}_count'] = sign
+        if cls.objects.filter(**lookup).update(**changes) or sign < 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(**lookup, **initial)
+        except IntegrityError:
+            # Created by a concurrent save in the meantime
+            cls.objects.filter(**lookup).update(**changes)
+
+    def __str__(self):
+        return f"Rollup {self.day} {self.status} {self.approval_recommendation} {self.risk_band} ({self.count})"
+
+
+class AnalysisJob(models.Model):
+    """Queue entry for an analysis that is run by the background worker pool"""
+    STATE_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed')
+    ]
+    TERMINAL_STATES = ('succeeded', 'failed')
+
+    analysis = models.OneToOneField(Analysis, on_delete=models.CASCADE, related_name='job')
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['enqueued_at']
+        indexes = [
+            models.Index(fields=['state', 'enqueued_at'], name='analysis_job_state_idx'),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.state in self.TERMINAL_STATES
+
+    @property
+    def queue_seconds(self):
+        """Time spent waiting in the queue before a worker picked the job up"""
+        if not self.started_at:
+            return None
+        return (self.started_at - self.enqueued_at).total_seconds()
+
+    @property
+    def run_seconds(self):
+        """Time spent running the analysis"""
+        if not self.started_at or not self.finished_at:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+    def __str__(self):
+        return f"Job {self.state} for analysis {self.analysis_id}"
+
+
+class CompressionDictionary(models.Model):
+    """Trained dictionary for compressing analysis results, see analysis/storage.py"""
+    codec = models.CharField(max_length=10)
+    data = models.BinaryField()
+    sample_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.codec} dictionary {self.id} ({len(self.data)} bytes)"
+
+
+class SupabaseOutbox(models.Model):
+    """Pending change to an Analysis that still has to be mirrored to Supabase"""
+    analysis = models.ForeignKey(Analysis, on_delete=models.CASCADE, related_name='outbox')
+    changed_fields = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    lock_token = models.CharField(max_length=64, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='analysis_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Outbox entry for analysis {self.analysis_id}: {', '.join(self.changed_fields)}"
+
+
+class IdempotencyKey(models.Model):
+    """Stored outcome of a create request sent with an Idempotency-Key header"""
+    STATE_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='in_progress')
+    analysis = models.ForeignKey(Analysis, null=True, blank=True, on_delete=models.CASCADE,
+                                 related_name='idempotency_keys')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    response_headers = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='analysis_idempotency_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} ({self.state})"
+
+
+def _notify_supabase_sync():
+    from .sync import notify
+    notify()
+
+
+def _invalidate_report(analysis_id):
+    from .report import invalidate_report
+    invalidate_report(analysis_id)
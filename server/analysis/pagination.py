@@ -0,0 +1,132 @@
+"""
+Keyset (cursor) pagination for analyses.
+
+Pages are addressed by the (sort key, id) of the last row already seen, so
+fetching page N costs the same as page 1: the database seeks straight to the
+cursor instead of counting and skipping OFFSET rows. Rows whose sort key is
+NULL come last in either direction, ordered by id, and a cursor positioned
+on one of them pages through the rest of the NULLs.
+"""
+import base64
+import json
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages of a queryset ordered by (sort field, id), newest first by default.
+
+    Views choose the sort with a `get_sort(request)` method returning
+    (field, descending).
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    default_sort = ('created_at', True)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_sort(self, request, view):
+        if view is not None and hasattr(view, 'get_sort'):
+            return view.get_sort(request)
+        return self.default_sort
+
+    @staticmethod
+    def nullable(queryset, field):
+        return queryset.model._meta.get_field(field).null
+
+    @classmethod
+    def order_queryset(cls, queryset, field, descending):
+        prefix = '-' if descending else ''
+        if not cls.nullable(queryset, field):
+            return queryset.order_by(f'{prefix}{field}', f'{prefix}id')
+        key = F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+        return queryset.order_by(key, f'{prefix}id')
+
+    @staticmethod
+    def encode_cursor(instance, field):
+        value = getattr(instance, field)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        position = {'field': field, 'value': value, 'id': instance.id}
+        raw = json.dumps(position, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor, field):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            if position['field'] != field:
+                raise ValueError('Cursor belongs to a different ordering')
+            if field == 'created_at':
+                value = parse_datetime(position['value'])
+                if value is None:
+                    raise ValueError('Invalid timestamp')
+            elif position['value'] is None:
+                value = None
+            else:
+                value = float(position['value'])
+            return value, int(position['id'])
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.sort_field, descending = self.get_sort(request, view)
+        queryset = self.order_queryset(queryset, self.sort_field, descending)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor, self.sort_field)
+            lookup = 'lt' if descending else 'gt'
+            if value is None:
+                # Past the last keyed row: only NULLs remain, in id order
+                after = Q(**{f'{self.sort_field}__isnull': True, f'id__{lookup}': pk})
+            else:
+                after = (Q(**{f'{self.sort_field}__{lookup}': value}) |
+                         Q(**{self.sort_field: value, f'id__{lookup}': pk}))
+                if self.nullable(queryset, self.sort_field):
+                    after |= Q(**{f'{self.sort_field}__isnull': True})
+            queryset = queryset.filter(after)
+
+        # Fetch one extra row to learn whether there is a next page
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        cursor = self.encode_cursor(self.page[-1], self.sort_field)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
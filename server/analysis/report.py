@@ -0,0 +1,437 @@
+"""
+Server-side PDF reports for GET /api/analyses/{id}/report/.
+
+render_report uses reportlab to draw an Analysis: the decision, the
+narrative, the metric tables and the same charts the client shows.
+ReportCache keeps rendered files on disk, named by analysis id and
+updated_at, so a repeat download is a file read. A save that changes the
+result or status moves updated_at and deletes the stale file.
+"""
+import glob
+import io
+import os
+import tempfile
+import threading
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.utils import timezone
+from reportlab.graphics.charts.barcharts import VerticalBarChart
+from reportlab.graphics.charts.legends import Legend
+from reportlab.graphics.charts.linecharts import HorizontalLineChart
+from reportlab.graphics.charts.piecharts import Pie
+from reportlab.graphics.shapes import Drawing, String
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import (KeepTogether, ListFlowable, ListItem, Paragraph, SimpleDocTemplate,
+                                Spacer, Table, TableStyle)
+from rest_framework.renderers import BaseRenderer
+
+from .idempotency import SingleFlight
+from .metrics import reports, timed
+
+# Bump when the layout changes so cached files from the old layout are not served
+REPORT_VERSION = 1
+
+# The client's chart palette
+PALETTE = [colors.HexColor(value) for value in ('#0088FE', '#00C49F', '#FFBB28', '#FF8042', '#8884D8')]
+LINE_COLORS = [colors.HexColor(value) for value in ('#8884D8', '#82CA9D', '#FFC658')]
+DECISION_COLORS = {
+    'Approved': colors.HexColor('#2E7D32'),
+    'Denied': colors.HexColor('#C62828'),
+    'Manual Review': colors.HexColor('#EF6C00'),
+}
+CONTENT_WIDTH = A4[0] - 40 * mm
+CHART_HEIGHT = 65 * mm
+
+_styles = getSampleStyleSheet()
+STYLES = {
+    'title': _styles['Title'],
+    'heading': _styles['Heading2'],
+    'subheading': _styles['Heading4'],
+    'body': _styles['BodyText'],
+    'muted': ParagraphStyle('muted', parent=_styles['BodyText'], textColor=colors.grey, fontSize=8),
+    'decision': ParagraphStyle('decision', parent=_styles['Heading3'], alignment=1),
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def money(value):
+    value = _number(value)
+    return 'N/A' if value is None else f'${value:,.0f}'
+
+
+def percent(value):
+    value = _number(value)
+    return 'N/A' if value is None else f'{value:.1f}%'
+
+
+def plain(value):
+    if value is None or value == '':
+        return 'N/A'
+    value_number = _number(value)
+    return f'{value_number:,.2f}'.rstrip('0').rstrip('.') if value_number is not None else str(value)
+
+
+def _section(result, name):
+    value = result.get(name)
+    return value if isinstance(value, dict) else {}
+
+
+def _bullets(items):
+    items = [item for item in items or [] if item]
+    if not items:
+        return Paragraph('None noted.', STYLES['body'])
+    return ListFlowable(
+        [ListItem(Paragraph(escape(str(item)), STYLES['body']), leftIndent=10) for item in items],
+        bulletType='bullet', start='•', leftIndent=10
+    )
+
+
+def _table(rows):
+    table = Table([[label, value] for label, value in rows], colWidths=[CONTENT_WIDTH * 0.55, CONTENT_WIDTH * 0.45])
+    table.setStyle(TableStyle([
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#555555')),
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ('LINEBELOW', (0, 0), (-1, -1), 0.25, colors.HexColor('#DDDDDD')),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+    ]))
+    return table
+
+
+def _chart_title(drawing, title):
+    drawing.add(String(0, CHART_HEIGHT - 10, title, fontName='Helvetica-Bold', fontSize=10))
+
+
+def _series(mapping):
+    """(labels, values) of the numeric entries of a chart_data mapping"""
+    if not isinstance(mapping, dict):
+        return [], []
+    pairs = [(str(label), _number(value)) for label, value in mapping.items()]
+    pairs = [(label, value) for label, value in pairs if value is not None]
+    return [label for label, _ in pairs], [value for _, value in pairs]
+
+
+def bar_chart(title, mapping):
+    labels, values = _series(mapping)
+    if not values:
+        return None
+    drawing = Drawing(CONTENT_WIDTH, CHART_HEIGHT)
+    _chart_title(drawing, title)
+    chart = VerticalBarChart()
+    chart.x, chart.y = 45, 20
+    chart.width, chart.height = CONTENT_WIDTH - 60, CHART_HEIGHT - 45
+    chart.data = [values]
+    chart.categoryAxis.categoryNames = labels
+    chart.categoryAxis.labels.fontSize = 8
+    chart.valueAxis.valueMin = min(0, min(values))
+    chart.valueAxis.labels.fontSize = 8
+    chart.valueAxis.labelTextFormat = lambda value: f'${value:,.0f}'
+    chart.bars[0].fillColor = PALETTE[4]
+    for index in range(len(values)):
+        chart.bars[(0, index)].fillColor = PALETTE[index % len(PALETTE)]
+    drawing.add(chart)
+    return drawing
+
+
+def pie_chart(title, mapping):
+    labels, values = _series(mapping)
+    # A pie needs positive slices
+    pairs = [(label, value) for label, value in zip(labels, values) if value > 0]
+    if not pairs:
+        return None
+    drawing = Drawing(CONTENT_WIDTH, CHART_HEIGHT)
+    _chart_title(drawing, title)
+    pie = Pie()
+    pie.x, pie.y = 20, 10
+    pie.width = pie.height = CHART_HEIGHT - 30
+    pie.data = [value for _, value in pairs]
+    for index in range(len(pairs)):
+        pie.slices[index].fillColor = PALETTE[index % len(PALETTE)]
+        pie.slices[index].strokeColor = colors.white
+    drawing.add(pie)
+    legend = Legend()
+    legend.x, legend.y = CHART_HEIGHT + 10, CHART_HEIGHT - 30
+    legend.fontSize = 9
+    legend.colorNamePairs = [(PALETTE[index % len(PALETTE)], f'{label}: {money(value)}')
+                             for index, (label, value) in enumerate(pairs)]
+    drawing.add(legend)
+    return drawing
+
+
+def amortization_chart(rows):
+    rows = [row for row in rows or [] if isinstance(row, dict)]
+    keys = (('principal_paid', 'Principal Paid'), ('interest_paid', 'Interest Paid'),
+            ('remaining_balance', 'Remaining Balance'))
+    data = [[_number(row.get(key)) or 0 for row in rows] for key, _ in keys]
+    if not rows or not any(any(line) for line in data):
+        return None
+    drawing = Drawing(CONTENT_WIDTH, CHART_HEIGHT + 15)
+    drawing.add(String(0, CHART_HEIGHT + 5, 'Loan Amortization', fontName='Helvetica-Bold', fontSize=10))
+    chart = HorizontalLineChart()
+    chart.x, chart.y = 55, 35
+    chart.width, chart.height = CONTENT_WIDTH - 70, CHART_HEIGHT - 35
+    chart.data = data
+    chart.categoryAxis.categoryNames = [f"Year {row.get('year', index + 1)}" for index, row in enumerate(rows)]
+    chart.categoryAxis.labels.fontSize = 8
+    chart.valueAxis.valueMin = 0
+    chart.valueAxis.labels.fontSize = 8
+    chart.valueAxis.labelTextFormat = lambda value: f'${value:,.0f}'
+    for index, color in enumerate(LINE_COLORS):
+        chart.lines[index].strokeColor = color
+        chart.lines[index].strokeWidth = 1.5
+    drawing.add(chart)
+    legend = Legend()
+    legend.x, legend.y = 55, 12
+    legend.alignment = 'right'
+    legend.columnMaximum = 1
+    legend.fontSize = 8
+    legend.deltax = 120
+    legend.colorNamePairs = [(color, label) for color, (_, label) in zip(LINE_COLORS, keys)]
+    drawing.add(legend)
+    return drawing
+
+
+def _footer(canvas, doc):
+    canvas.saveState()
+    canvas.setFont('Helvetica', 8)
+    canvas.setFillColor(colors.grey)
+    canvas.drawRightString(A4[0] - 20 * mm, 10 * mm, f'Page {doc.page}')
+    canvas.restoreState()
+
+
+def render_report(analysis):
+    """The analysis as PDF bytes"""
+    result = analysis.analysis_result if isinstance(analysis.analysis_result, dict) else {}
+    summary = _section(result, 'summary')
+    risk = _section(result, 'credit_risk_analysis')
+    financial = _section(result, 'financial_metrics')
+    loan = _section(result, 'loan_metrics')
+    prop = _section(result, 'property_analysis')
+    economic = _section(result, 'economic_factors')
+    charts = _section(result, 'chart_data')
+
+    story = [
+        Paragraph('Loan Analysis Report', STYLES['title']),
+        Paragraph(
+            f"{escape(analysis.customer_name or 'Unnamed applicant')} &middot; "
+            f"{escape(analysis.customer_phone)} &middot; Status: {escape(analysis.get_status_display())}",
+            STYLES['body']
+        ),
+        Paragraph(
+            f"Analysis #{analysis.id}, created {analysis.created_at:%Y-%m-%d %H:%M} UTC, "
+            f"report generated {timezone.now():%Y-%m-%d %H:%M} UTC",
+            STYLES['muted']
+        ),
+        Spacer(1, 6 * mm),
+    ]
+
+    if 'error' in result:
+        story.append(Paragraph('The analysis did not complete.', STYLES['heading']))
+        story.append(Paragraph(escape(str(result['error'])), STYLES['body']))
+        return _build(story)
+
+    recommendation = risk.get('approval_recommendation') or 'Pending'
+    decision = Table([[
+        Paragraph(f"<b>{escape(str(recommendation))}</b>", STYLES['decision']),
+        Paragraph(f"Risk score<br/><b>{plain(risk.get('risk_score'))}</b>", STYLES['decision']),
+        Paragraph(f"Approval probability<br/><b>{percent(risk.get('approval_probability'))}</b>",
+                  STYLES['decision']),
+    ]], colWidths=[CONTENT_WIDTH / 3] * 3)
+    decision.setStyle(TableStyle([
+        ('BOX', (0, 0), (-1, -1), 1, DECISION_COLORS.get(recommendation, colors.grey)),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('TOPPADDING', (0, 0), (-1, -1), 6),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    story += [decision, Spacer(1, 6 * mm)]
+
+    story += [
+        Paragraph('Executive Summary', STYLES['heading']),
+        Paragraph(escape(str(summary.get('overall_assessment') or 'No assessment available.')), STYLES['body']),
+        Paragraph('Key Strengths', STYLES['subheading']), _bullets(summary.get('key_strengths')),
+        Paragraph('Key Concerns', STYLES['subheading']), _bullets(summary.get('key_concerns')),
+        Paragraph('Recommendations', STYLES['subheading']), _bullets(summary.get('recommendations')),
+    ]
+    if risk.get('risk_factors'):
+        story += [Paragraph('Risk Factors', STYLES['subheading']), _bullets(risk.get('risk_factors'))]
+
+    story += [
+        KeepTogether([
+            Paragraph('Financial Metrics', STYLES['heading']),
+            _table([
+                ('Debt-to-income ratio', percent(financial.get('debt_to_income_ratio'))),
+                ('Loan-to-value ratio', percent(financial.get('loan_to_value_ratio'))),
+                ('Credit utilization', percent(financial.get('credit_utilization'))),
+                ('Savings rate', percent(financial.get('savings_rate'))),
+                ('Monthly savings', money(financial.get('monthly_savings'))),
+                ('Net worth', money(financial.get('net_worth'))),
+                ('Total assets', money(financial.get('total_assets'))),
+                ('Total liabilities', money(financial.get('total_liabilities'))),
+            ]),
+        ]),
+        KeepTogether([
+            Paragraph('Loan Metrics', STYLES['heading']),
+            _table([
+                ('Monthly payment', money(loan.get('monthly_payment'))),
+                ('Total interest paid', money(loan.get('total_interest_paid'))),
+                ('Break-even years', plain(loan.get('break_even_years'))),
+                ('Savings from 20% extra payments', money(loan.get('early_payment_savings'))),
+            ]),
+        ]),
+        KeepTogether([
+            Paragraph('Property and Economy', STYLES['heading']),
+            _table([
+                ('Property value growth (5 years)', percent(prop.get('property_value_growth_5yr'))),
+                ('Market risk', plain(prop.get('market_risk'))),
+                ('Property tax rate', percent(prop.get('property_tax_rate'))),
+                ('Economic conditions risk', plain(economic.get('economic_conditions_risk'))),
+                ('Inflation rate', percent(economic.get('inflation_rate'))),
+                ('Interest rate trend', plain(economic.get('interest_rate_trend'))),
+            ]),
+        ]),
+    ]
+
+    drawings = [
+        pie_chart('Monthly Debt Breakdown', charts.get('debt_breakdown')),
+        bar_chart('Monthly Income vs Expenses', charts.get('income_vs_expenses')),
+        pie_chart('Net Worth Composition', charts.get('net_worth_composition')),
+        amortization_chart(charts.get('loan_amortization')),
+    ]
+    drawings = [drawing for drawing in drawings if drawing is not None]
+    if drawings:
+        story.append(Paragraph('Charts', STYLES['heading']))
+        for drawing in drawings:
+            story += [KeepTogether([drawing]), Spacer(1, 4 * mm)]
+
+    return _build(story)
+
+
+def _build(story):
+    buffer = io.BytesIO()
+    document = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=20 * mm, rightMargin=20 * mm,
+                                 topMargin=18 * mm, bottomMargin=18 * mm, title='Loan Analysis Report')
+    document.build(story, onFirstPage=_footer, onLaterPages=_footer)
+    return buffer.getvalue()
+
+
+class ReportCache:
+    """Rendered PDFs on disk, one file per analysis version"""
+
+    def __init__(self, directory, max_files):
+        self.directory = Path(directory)
+        self.max_files = max_files
+
+    def path(self, analysis):
+        version = int(analysis.updated_at.timestamp() * 1_000_000)
+        return self.directory / f'{analysis.id}-{version}-v{REPORT_VERSION}.pdf'
+
+    def _files(self, analysis_id='*'):
+        return glob.glob(str(self.directory / f'{analysis_id}-*.pdf'))
+
+    def put(self, analysis, data):
+        """Write a rendered report atomically, replacing older versions of it"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(analysis)
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+        for stale in self._files(analysis.id):
+            if stale != str(path):
+                self._remove(stale)
+        self.prune()
+        return path
+
+    def invalidate(self, analysis_id):
+        for path in self._files(analysis_id):
+            self._remove(path)
+
+    def prune(self):
+        """Keep at most max_files reports, dropping the least recently written"""
+        files = self._files()
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in files[:len(files) - self.max_files]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+# Concurrent downloads of the same uncached report render it once
+_rendering = SingleFlight()
+
+
+def get_report_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReportCache(
+                _setting('ANALYSIS_REPORT_CACHE_DIR', settings.BASE_DIR / 'report_cache'),
+                max_files=_setting('ANALYSIS_REPORT_CACHE_MAX_FILES', 1000)
+            )
+        return _cache
+
+
+def report_etag(analysis):
+    return f'"{get_report_cache().path(analysis).stem}"'
+
+
+def _render_to_cache(analysis):
+    # The list-sized row the view loads does not include the heavy columns
+    analysis.refresh_from_db(fields=['customer_input', 'analysis_result'])
+    with timed('report_render'):
+        data = render_report(analysis)
+    return get_report_cache().put(analysis, data)
+
+
+def open_report(analysis):
+    """An open file with the analysis PDF, rendered only if no cached copy exists"""
+    path = get_report_cache().path(analysis)
+    try:
+        handle = open(path, 'rb')
+        reports.inc(outcome='hit')
+        return handle
+    except FileNotFoundError:
+        pass
+    path = _rendering.do(str(path), _render_to_cache, analysis)
+    reports.inc(outcome='rendered')
+    return open(path, 'rb')
+
+
+def invalidate_report(analysis_id):
+    get_report_cache().invalidate(analysis_id)
+
+
+class PDFRenderer(BaseRenderer):
+    """Lets DRF content negotiation accept `Accept: application/pdf`"""
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only reached for error responses, reports bypass the renderer
+        if isinstance(data, bytes):
+            return data
+        return str(data).encode('utf-8')
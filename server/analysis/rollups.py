@@ -0,0 +1,138 @@
+"""
+Portfolio statistics served from AnalysisRollup.
+
+Each rollup row holds the count and the summed loan amount, risk score and
+approval probability of one user's analyses for one day, status,
+recommendation and risk band. Analysis.save and delete move an analysis
+between rows as it changes, so the stats endpoint reads a few rows per day
+in range however many analyses there are. Weeks (starting on Monday) are
+summed from their days.
+
+rebuild recomputes the rows from the analyses themselves, for existing data
+and to repair drift from writes that bypass Analysis.save (bulk_update,
+queryset.update).
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from .models import Analysis, AnalysisRollup, rollup_entry
+
+PERIODS = ('day', 'week')
+
+
+def parse_day(name, value):
+    day = parse_date(value[:10]) if value else None
+    if day is None:
+        raise ValidationError({name: 'Must be an ISO 8601 date'})
+    return day
+
+
+def period_start(day, period):
+    return day - timedelta(days=day.weekday()) if period == 'week' else day
+
+
+def band_label(band):
+    if band == AnalysisRollup.NO_RISK_BAND:
+        return 'unscored'
+    return f'{band}-{band + 9}' if band < 90 else '90-100'
+
+
+class _Totals:
+    def __init__(self):
+        self.count = 0
+        self.sums = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.status = defaultdict(int)
+        self.recommendation = defaultdict(int)
+        self.risk_bands = defaultdict(int)
+
+    def add(self, row):
+        self.count += row['count']
+        for field in AnalysisRollup.SUMMED_FIELDS:
+            self.sums[field] += row[f'{field}_sum']
+            self.counts[field] += row[f'{field}_count']
+        self.status[row['status']] += row['count']
+        self.recommendation[row['approval_recommendation'] or 'none'] += row['count']
+        self.risk_bands[row['risk_band']] += row['count']
+
+    def as_dict(self):
+        data = {'count': self.count}
+        for field in AnalysisRollup.SUMMED_FIELDS:
+            count = self.counts[field]
+            data[f'average_{field}'] = round(self.sums[field] / count, 2) if count else None
+        data['status'] = {status: self.status[status] for status, _ in Analysis.STATUS_CHOICES}
+        data['approval_recommendation'] = dict(sorted(self.recommendation.items()))
+        data['risk_score_distribution'] = {
+            band_label(band): self.risk_bands[band] for band in sorted(self.risk_bands) if self.risk_bands[band]
+        }
+        return data
+
+
+def portfolio_stats(user, period='day', since=None, until=None):
+    """Totals and per-period figures for the user's analyses created in [since, until]"""
+    if period not in PERIODS:
+        raise ValidationError({'period': f'Must be one of {list(PERIODS)}'})
+
+    rows = AnalysisRollup.objects.filter(user=user, count__gt=0)
+    if since is not None:
+        rows = rows.filter(day__gte=since)
+    if until is not None:
+        rows = rows.filter(day__lte=until)
+
+    totals = _Totals()
+    buckets = defaultdict(_Totals)
+    for row in rows.values('day', 'status', 'approval_recommendation', 'risk_band', 'count',
+                           *(f'{field}_{part}' for field in AnalysisRollup.SUMMED_FIELDS
+                             for part in ('sum', 'count'))):
+        totals.add(row)
+        buckets[period_start(row['day'], period)].add(row)
+
+    return {
+        'period': period,
+        'totals': totals.as_dict(),
+        'buckets': [
+            {'period_start': start.isoformat(), **buckets[start].as_dict()}
+            for start in sorted(buckets)
+        ],
+    }
+
+
+def rebuild(user=None, batch_size=1000):
+    """Recompute the rollup rows (of one user, or everyone) from the analyses, returns the row count"""
+    analyses = Analysis.objects.all() if user is None else Analysis.objects.filter(user=user)
+    entries = defaultdict(lambda: [0] + [0.0, 0] * len(AnalysisRollup.SUMMED_FIELDS))
+
+    with transaction.atomic():
+        last_id = 0
+        while True:
+            # Walk the table by primary key so each batch is an index range scan
+            batch = list(
+                analyses.filter(id__gt=last_id).order_by('id').values('id', *Analysis.ROLLUP_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+            for values in batch:
+                key, summed = rollup_entry(values)
+                totals = entries[key]
+                totals[0] += 1
+                for index, value in enumerate(summed):
+                    if value is not None:
+                        totals[1 + 2 * index] += value
+                        totals[2 + 2 * index] += 1
+            last_id = batch[-1]['id']
+
+        rollups = AnalysisRollup.objects.all() if user is None else AnalysisRollup.objects.filter(user=user)
+        rollups.delete()
+        rows = []
+        for key, totals in entries.items():
+            row = AnalysisRollup(**dict(zip(AnalysisRollup.KEY_FIELDS, key)), count=totals[0])
+            for index, field in enumerate(AnalysisRollup.SUMMED_FIELDS):
+                setattr(row, f'{field}_sum', totals[1 + 2 * index])
+                setattr(row, f'{field}_count', totals[2 + 2 * index])
+            rows.append(row)
+        AnalysisRollup.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
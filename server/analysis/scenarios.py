@@ -0,0 +1,183 @@
+"""
+What-if scenarios for an existing analysis.
+
+POST /api/analyses/{id}/scenarios/ takes grids of interest rate, term
+(term_months or term_years), principal and extra monthly payment, each a
+list of values or a {"start", "stop", "step"} range. Axes that are left out keep the
+application's own value (no extra payment). Rates are annual percentages:
+send 6.5 for 6.5%, and 0.5 means half a percent, not 50%. The cartesian product of the
+grids is evaluated in one pass over NumPy arrays with the helpers in
+financials.py, so thousands of scenarios take milliseconds and no LLM call.
+
+The result is columnar: every per-scenario figure is a list in grid order
+(rate varies slowest, extra payment fastest), and the amortization columns
+are one row per scenario with one value per schedule year.
+"""
+import numpy as np
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from .financials import (
+    AMORTIZATION_YEARS, extract_loan_inputs, monthly_payment, parse_customer_input,
+    payoff_months, remaining_balance, to_number,
+)
+
+# Request field -> key of the application's own value in extract_loan_inputs
+AXES = {
+    'rate': 'annual_rate',
+    'term_months': 'months',
+    'principal': 'loan_amount',
+    'extra_payment': None,
+}
+# Accepted range of each axis. Beyond these the amortization formulas overflow
+# to inf/NaN, which no JSON response can carry.
+LIMITS = {
+    'rate': (0.0, 100.0),
+    'term_months': (1.0, 1200.0),
+    'principal': (0.01, 1e12),
+    'extra_payment': (0.0, 1e12),
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _values(name, spec, max_points):
+    """A grid axis from a list of numbers or a {start, stop, step} range (stop included)"""
+    if isinstance(spec, dict):
+        start, stop, step = (to_number(spec.get(key)) for key in ('start', 'stop', 'step'))
+        if None in (start, stop, step) or step <= 0 or stop < start:
+            raise ValidationError({name: 'A range needs numeric start <= stop and a positive step'})
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        if count > max_points:
+            raise ValidationError({name: f'The range has more than {max_points} values'})
+        values = start + step * np.arange(count)
+    else:
+        items = spec if isinstance(spec, list) else [spec]
+        numbers = [to_number(item) for item in items]
+        if not numbers or None in numbers:
+            raise ValidationError({name: 'Must be a number, a list of numbers or a {start, stop, step} range'})
+        values = np.array(numbers, dtype=float)
+    if not np.all(np.isfinite(values)) or np.any(values < 0):
+        raise ValidationError({name: 'Values must be finite and not negative'})
+    return values
+
+
+def parse_grid(data, inputs):
+    """The four grid axes as arrays, defaulting to the application's own values"""
+    if not isinstance(data, dict):
+        raise ValidationError({'detail': 'Expected a JSON object of grids'})
+    max_points = _setting('ANALYSIS_SCENARIO_MAX_POINTS', 10000)
+    if 'term_years' in data and 'term_months' in data:
+        raise ValidationError({'term_years': 'Send term_years or term_months, not both'})
+
+    grid = {}
+    for name, source in AXES.items():
+        if name in data:
+            grid[name] = _values(name, data[name], max_points)
+        elif name == 'term_months' and 'term_years' in data:
+            grid[name] = _values('term_years', data['term_years'], max_points) * 12.0
+        elif source is None:
+            grid[name] = np.zeros(1)
+        elif inputs.get(source) is not None:
+            grid[name] = np.array([inputs[source]], dtype=float)
+        else:
+            raise ValidationError({name: 'The application has no value for this, so the grid must include it'})
+
+    for name, (low, high) in LIMITS.items():
+        if np.any(grid[name] < low) or np.any(grid[name] > high):
+            raise ValidationError({name: f'Values must be between {low:g} and {high:g}'})
+    points = int(np.prod([axis.size for axis in grid.values()]))
+    if points > max_points:
+        raise ValidationError({'detail': f'The grid has {points} scenarios, the limit is {max_points}'})
+    return grid
+
+
+def schedule_years(value):
+    if value is None:
+        return np.array(AMORTIZATION_YEARS, dtype=float)
+    years = _values('schedule_years', value, 100)
+    if np.any(years <= 0):
+        raise ValidationError({'schedule_years': 'Years must be positive'})
+    return np.unique(years)
+
+
+def _column(values):
+    """Rounded values as a list, None where a ratio came out infinite"""
+    values = np.round(values, 2)
+    if np.all(np.isfinite(values)):
+        return values.tolist()
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+def evaluate(grid, inputs, years=None):
+    """Payment, interest, DTI, LTV and amortization for every point of the grid"""
+    years = np.array(AMORTIZATION_YEARS, dtype=float) if years is None else years
+    rate, months, principal, extra = (
+        axis.ravel() for axis in np.meshgrid(
+            grid['rate'], grid['term_months'], grid['principal'], grid['extra_payment'], indexing='ij'
+        )
+    )
+
+    payment = monthly_payment(principal, rate, months)
+    total_interest = payment * months - principal
+    paid_monthly = payment + extra
+    # Paying more than the schedule finishes early; never later than the term
+    paid_months = np.minimum(payoff_months(principal, rate, paid_monthly), months)
+    interest_with_extra = np.maximum(paid_monthly * paid_months - principal, 0.0)
+
+    # Schedule rows: (scenarios, years), balances after paying paid_monthly
+    months_paid = np.minimum(years[None, :] * 12.0, paid_months[:, None])
+    balance = remaining_balance(principal[:, None], rate[:, None], paid_monthly[:, None], months_paid)
+    balance = np.where(months_paid >= paid_months[:, None], 0.0, balance)
+    principal_paid = principal[:, None] - balance
+    interest_paid = np.maximum(paid_monthly[:, None] * months_paid - principal_paid, 0.0)
+
+    computed = (payment, total_interest, paid_months, interest_with_extra, balance, interest_paid)
+    if not all(np.all(np.isfinite(values)) for values in computed):
+        raise ValidationError({'detail': 'The grid includes loans whose figures cannot be computed'})
+
+    count = principal.size
+    income = inputs.get('monthly_income')
+    if income:
+        other_debt = inputs['car_payment'] + inputs['credit_card_payment'] + inputs['other_debt_payment']
+        dti = _column((payment + other_debt) / income * 100)
+    else:
+        dti = [None] * count
+    property_value = inputs.get('property_value')
+    ltv = _column(principal / property_value * 100) if property_value else [None] * count
+
+    return {
+        'count': count,
+        'scenarios': {
+            'rate': _column(rate),
+            'term_months': _column(months),
+            'principal': _column(principal),
+            'extra_payment': _column(extra),
+            'monthly_payment': _column(payment),
+            'total_interest_paid': _column(total_interest),
+            'payoff_months': _column(paid_months),
+            'total_interest_with_extra': _column(interest_with_extra),
+            'interest_saved': _column(total_interest - interest_with_extra),
+            'debt_to_income_ratio': dti,
+            'loan_to_value_ratio': ltv,
+        },
+        'amortization': {
+            'years': [int(year) if float(year).is_integer() else float(year) for year in years],
+            'principal_paid': _column(principal_paid),
+            'interest_paid': _column(interest_paid),
+            'remaining_balance': _column(balance),
+        },
+    }
+
+
+def run_scenarios(customer_input, data):
+    """Parse the request grids against the application and evaluate them"""
+    application = parse_customer_input(customer_input)
+    inputs = extract_loan_inputs(application) if application is not None else {}
+    grid = parse_grid(data, inputs)
+    years = schedule_years(data.get('schedule_years'))
+    result = evaluate(grid, inputs, years)
+    result['grid'] = {name: _column(axis) for name, axis in grid.items()}
+    return result
@@ -0,0 +1,268 @@
+"""
+Schema of `analysis_result` and a validator compiled from it.
+
+The schema is declared once below and compiled at import time into a tree of
+closures, so checking a result only walks the data. Validation coerces what
+the model gets nearly right ("35%" or "$1,200" where a number belongs,
+"approve" for "Approved", a lone string where a list belongs) and reports
+everything it cannot fix together in one SchemaError.
+"""
+import math
+
+from .financials import to_number
+
+
+class SchemaError(ValueError):
+    """The analysis does not match the schema; errors lists (path, message) pairs"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(f'{path}: {message}' for path, message in errors))
+
+
+def _join(path, name):
+    return f'{path}.{name}' if path else str(name)
+
+
+class Number:
+    def __init__(self, minimum=None, maximum=None, required=False):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.required = required
+
+    def compile(self):
+        minimum, maximum, required = self.minimum, self.maximum, self.required
+
+        def check(value, path, errors):
+            if value is None:
+                if required:
+                    errors.append((path, 'expected a number, got null'))
+                return None
+            if type(value) not in (int, float):
+                number = to_number(value)
+                if number is None:
+                    if required or not isinstance(value, str):
+                        errors.append((path, f'expected a number, got {value!r}'))
+                        return value
+                    # "N/A", "Unknown": an optional figure the model could not give
+                    return None
+                value = int(number) if number.is_integer() else number
+            elif type(value) is float and not math.isfinite(value):
+                # 1e999 parses as inf; NaN and inf fail every range check below
+                errors.append((path, f'expected a finite number, got {value!r}'))
+                return None
+            # Out of range is clamped rather than rejected: 104 means "as high as it goes"
+            if minimum is not None and value < minimum:
+                return minimum
+            if maximum is not None and value > maximum:
+                return maximum
+            return value
+        return check
+
+
+class Text:
+    def __init__(self, required=False):
+        self.required = required
+
+    def compile(self):
+        required = self.required
+
+        def check(value, path, errors):
+            if value is None:
+                if required:
+                    errors.append((path, 'expected text, got null'))
+                return None
+            if isinstance(value, str):
+                return value
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return str(value)
+            errors.append((path, f'expected text, got {type(value).__name__}'))
+            return value
+        return check
+
+
+class Choice:
+    """One of a fixed set of strings, matched case-insensitively or through an alias"""
+
+    def __init__(self, *choices, aliases=None, required=False):
+        self.choices = choices
+        self.aliases = aliases or {}
+        self.required = required
+
+    def compile(self):
+        lookup = {choice.lower(): choice for choice in self.choices}
+        lookup.update((alias.lower(), choice) for alias, choice in self.aliases.items())
+        expected = ', '.join(self.choices)
+        required = self.required
+
+        def check(value, path, errors):
+            if value is None:
+                if required:
+                    errors.append((path, f'expected one of {expected}, got null'))
+                return None
+            if isinstance(value, str):
+                choice = lookup.get(value.strip().rstrip('.').lower())
+                if choice is not None:
+                    return choice
+            errors.append((path, f'expected one of {expected}, got {value!r}'))
+            return value
+        return check
+
+
+class ListOf:
+    def __init__(self, item, required=False):
+        self.item = item
+        self.required = required
+
+    def compile(self):
+        check_item = compile_schema(self.item)
+
+        def check(value, path, errors):
+            if value is None:
+                return []
+            if not isinstance(value, list):
+                # A single entry where a list of them belongs
+                value = [value]
+            return [check_item(item, f'{path}[{index}]', errors) for index, item in enumerate(value)]
+        return check
+
+
+class MappingOf:
+    """An object with free-form keys, e.g. chart series labels"""
+
+    def __init__(self, value, required=False):
+        self.value = value
+        self.required = required
+
+    def compile(self):
+        check_value = compile_schema(self.value)
+
+        def check(value, path, errors):
+            if value is None:
+                return None
+            if not isinstance(value, dict):
+                errors.append((path, f'expected an object, got {type(value).__name__}'))
+                return value
+            return {key: check_value(item, _join(path, key), errors) for key, item in value.items()}
+        return check
+
+
+def _compile_object(fields):
+    """Validator for a dict of known fields; unknown fields are kept as they are"""
+    checks = tuple((name, compile_schema(field), getattr(field, 'required', False))
+                   for name, field in fields.items())
+
+    def check(value, path, errors):
+        if value is None:
+            return None
+        if not isinstance(value, dict):
+            errors.append((path, f'expected an object, got {type(value).__name__}'))
+            return value
+        result = dict(value)
+        for name, check_field, required in checks:
+            if name in result:
+                result[name] = check_field(result[name], _join(path, name), errors)
+            elif required:
+                errors.append((_join(path, name), 'missing'))
+        return result
+    return check
+
+
+def compile_schema(spec):
+    if isinstance(spec, dict):
+        return _compile_object(spec)
+    return spec.compile()
+
+
+RISK_LEVEL = Choice('Low', 'Moderate', 'High', aliases={'medium': 'Moderate', 'moderate risk': 'Moderate',
+                                                         'low risk': 'Low', 'high risk': 'High'})
+
+SECTIONS = {
+    'summary': {
+        'overall_assessment': Text(required=True),
+        'key_strengths': ListOf(Text()),
+        'key_concerns': ListOf(Text()),
+        'recommendations': ListOf(Text()),
+    },
+    'credit_risk_analysis': {
+        'risk_score': Number(0, 100, required=True),
+        'risk_factors': ListOf(Text()),
+        'approval_probability': Number(0, 100, required=True),
+        'approval_recommendation': Choice(
+            'Approved', 'Denied', 'Manual Review', required=True,
+            aliases={'approve': 'Approved', 'approval': 'Approved', 'deny': 'Denied',
+                     'declined': 'Denied', 'decline': 'Denied', 'rejected': 'Denied', 'reject': 'Denied',
+                     'review': 'Manual Review', 'manual': 'Manual Review',
+                     'manual_review': 'Manual Review', 'needs review': 'Manual Review'}
+        ),
+    },
+    'financial_metrics': {
+        'debt_to_income_ratio': Number(),
+        'loan_to_value_ratio': Number(),
+        'credit_utilization': Number(),
+        'savings_rate': Number(),
+        'monthly_savings': Number(),
+        'net_worth': Number(),
+        'total_assets': Number(),
+        'total_liabilities': Number(),
+    },
+    'loan_metrics': {
+        'monthly_payment': Number(),
+        'total_interest_paid': Number(),
+        'break_even_years': Number(),
+        'early_payment_savings': Number(),
+    },
+    'property_analysis': {
+        'property_value_growth_5yr': Number(),
+        'market_risk': RISK_LEVEL,
+        'property_tax_rate': Number(),
+    },
+    'economic_factors': {
+        'economic_conditions_risk': RISK_LEVEL,
+        'inflation_rate': Number(),
+        'interest_rate_trend': Choice('Increasing', 'Stable', 'Decreasing', aliases={
+            'rising': 'Increasing', 'up': 'Increasing', 'upward': 'Increasing',
+            'steady': 'Stable', 'flat': 'Stable', 'unchanged': 'Stable',
+            'falling': 'Decreasing', 'declining': 'Decreasing', 'down': 'Decreasing', 'downward': 'Decreasing',
+        }),
+    },
+    'chart_data': {
+        'debt_breakdown': MappingOf(Number()),
+        'income_vs_expenses': MappingOf(Number()),
+        'net_worth_composition': MappingOf(Number()),
+        'loan_amortization': ListOf({
+            'year': Number(),
+            'principal_paid': Number(),
+            'interest_paid': Number(),
+            'remaining_balance': Number(),
+        }),
+    },
+}
+
+_SECTION_CHECKS = {name: compile_schema(fields) for name, fields in SECTIONS.items()}
+
+
+def validate_section(name, value):
+    """Coerce one top-level section, raising SchemaError if it cannot be fixed"""
+    check = _SECTION_CHECKS.get(name)
+    if check is None:
+        return value
+    errors = []
+    value = check(value, name, errors)
+    if errors:
+        raise SchemaError(errors)
+    return value
+
+
+def validate_analysis(analysis_json, required_fields):
+    """Coerce a whole analysis, raising SchemaError listing every problem found"""
+    if not isinstance(analysis_json, dict):
+        raise SchemaError([('', f'expected an object, got {type(analysis_json).__name__}')])
+    errors = [(field, 'missing') for field in required_fields if field not in analysis_json]
+    result = dict(analysis_json)
+    for name, check in _SECTION_CHECKS.items():
+        if name in result:
+            result[name] = check(result[name], name, errors)
+    if errors:
+        raise SchemaError(errors)
+    return result
@@ -0,0 +1,256 @@
+"""
+Local scoring tier in front of the LLM.
+
+A logistic scorecard over the structured application fields (credit score,
+DTI, LTV, utilisation, savings rate, net worth) gives an approval
+probability in microseconds. Clear approvals and clear denials, outside the
+[ANALYSIS_LOCAL_DENY_BELOW, ANALYSIS_LOCAL_APPROVE_ABOVE] band, are answered
+locally with a rules-based narrative. Borderline, incomplete or unstructured
+applications still go to the LLM for narrative and review.
+"""
+import logging
+import math
+
+from django.conf import settings
+
+from .financials import compute_metrics, extract_loan_inputs, parse_customer_input
+from .metrics import scoring_decisions
+from .schema import SECTIONS, SchemaError, validate_analysis, validate_section
+
+logger = logging.getLogger(__name__)
+
+MODEL_VERSION = 'scorecard-1'
+INTERCEPT = 0.6
+# feature: (centre, scale, weight). Features are standardised as
+# (value - centre) / scale, clipped to +-3, so each weight is the change in
+# log-odds for one "typical step" away from an average applicant.
+COEFFICIENTS = {
+    'credit_score': (680.0, 60.0, 1.1),
+    'debt_to_income_ratio': (36.0, 10.0, -1.0),
+    'loan_to_value_ratio': (80.0, 10.0, -0.5),
+    'credit_utilization': (30.0, 15.0, -0.5),
+    'savings_rate': (10.0, 10.0, 0.4),
+    'net_worth_to_loan': (0.25, 0.5, 0.3),
+}
+# Without these the scorecard is guessing, so the LLM decides
+REQUIRED_FEATURES = ('credit_score', 'debt_to_income_ratio')
+# Hard limits that cap the approval probability whatever the other features say
+KNOCKOUTS = (
+    ('credit_score', lambda value: value < 500, 'Credit score below 500'),
+    ('debt_to_income_ratio', lambda value: value > 60, 'Debt-to-income ratio above 60%'),
+)
+KNOCKOUT_CAP = 0.10
+
+STRENGTHS = {
+    'credit_score': 'Credit score of {value:.0f}',
+    'debt_to_income_ratio': 'Low debt-to-income ratio of {value:.1f}%',
+    'loan_to_value_ratio': 'Conservative loan-to-value ratio of {value:.1f}%',
+    'credit_utilization': 'Low credit utilisation of {value:.0f}%',
+    'savings_rate': 'Saves {value:.1f}% of monthly income',
+    'net_worth_to_loan': 'Net worth covers {value:.0%} of the loan',
+}
+CONCERNS = {
+    'credit_score': 'Credit score of {value:.0f}',
+    'debt_to_income_ratio': 'Debt-to-income ratio of {value:.1f}%',
+    'loan_to_value_ratio': 'High loan-to-value ratio of {value:.1f}%',
+    'credit_utilization': 'Credit utilisation of {value:.0f}%',
+    'savings_rate': 'Savings rate of only {value:.1f}%',
+    'net_worth_to_loan': 'Net worth is small relative to the loan',
+}
+RECOMMENDATIONS = {
+    'credit_score': 'Improve the credit score by keeping all payments current before reapplying',
+    'debt_to_income_ratio': 'Pay down existing debts to bring the debt-to-income ratio under 36%',
+    'loan_to_value_ratio': 'Increase the down payment to bring the loan-to-value ratio to 80% or below',
+    'credit_utilization': 'Reduce revolving balances to keep credit utilisation under 30%',
+    'savings_rate': 'Build an emergency fund covering at least six months of expenses',
+    'net_worth_to_loan': 'Grow liquid assets before taking on additional debt',
+}
+# Contributions (in log-odds) smaller than this are neither strengths nor concerns
+NOTABLE = 0.15
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def extract_features(metrics, inputs):
+    financial = metrics['financial_metrics']
+    features = {
+        'credit_score': inputs['credit_score'],
+        'debt_to_income_ratio': financial['debt_to_income_ratio'],
+        'loan_to_value_ratio': financial['loan_to_value_ratio'],
+        'credit_utilization': financial['credit_utilization'],
+        'savings_rate': financial['savings_rate'],
+        'net_worth_to_loan': None,
+    }
+    if financial['net_worth'] is not None and inputs['loan_amount']:
+        features['net_worth_to_loan'] = financial['net_worth'] / inputs['loan_amount']
+    return features
+
+
+def score_features(features):
+    """Approval probability (0-1) and per-feature log-odds contributions"""
+    contributions = {}
+    for name, (centre, scale, weight) in COEFFICIENTS.items():
+        value = features.get(name)
+        if value is None:
+            continue
+        standardised = max(-3.0, min(3.0, (value - centre) / scale))
+        contributions[name] = weight * standardised
+
+    probability = 1.0 / (1.0 + math.exp(-(INTERCEPT + sum(contributions.values()))))
+    knockouts = {
+        name: reason for name, rule, reason in KNOCKOUTS
+        if features.get(name) is not None and rule(features[name])
+    }
+    if knockouts:
+        probability = min(probability, KNOCKOUT_CAP)
+    return probability, contributions, knockouts
+
+
+def _concerns(features, contributions, knockouts):
+    """Knockout reasons first, then the features pulling the score down, worst first"""
+    ranked = sorted(contributions.items(), key=lambda item: item[1])
+    return list(knockouts.values()) + [
+        CONCERNS[name].format(value=features[name])
+        for name, value in ranked if value < -NOTABLE and name not in knockouts
+    ]
+
+
+def _market_risk(growth):
+    if growth is None:
+        return 'Moderate'
+    if growth < 0:
+        return 'High'
+    return 'Moderate' if growth < 10 else 'Low'
+
+
+def _interest_rate_trend(value):
+    """The applicant's trend as one of the schema's values, None if it is not one"""
+    try:
+        return validate_section('economic_factors', {'interest_rate_trend': value})['interest_rate_trend']
+    except SchemaError:
+        return None
+
+
+def _economic_risk(inflation, trend):
+    trend = (trend or '').lower()
+    if (inflation is not None and inflation > 5) or trend in ('rising', 'increasing'):
+        return 'High'
+    if inflation is not None and inflation > 3:
+        return 'Moderate'
+    return 'Low'
+
+
+def _narrative(data, inputs, features, probability, contributions, knockouts, recommendation):
+    ranked = sorted(contributions.items(), key=lambda item: item[1])
+    concerns = _concerns(features, contributions, knockouts)
+    strengths = [STRENGTHS[name].format(value=features[name])
+                 for name, value in reversed(ranked) if value > NOTABLE]
+    recommendations = [RECOMMENDATIONS[name] for name, value in ranked if value < -NOTABLE][:4]
+    if not recommendations:
+        recommendations = ['Keep debt payments current through closing',
+                           'Maintain the current savings rate to preserve reserves']
+
+    name = data.get('customer_name') or 'The applicant'
+    verdict = 'clearly qualifies' if recommendation == 'Approved' else 'does not qualify'
+    assessment = (
+        f"{name} {verdict} for this loan on the standard scorecard, with an estimated approval "
+        f"probability of {probability:.0%}. "
+    )
+    if strengths:
+        assessment += f"Main strengths: {', '.join(strength.lower() for strength in strengths[:2])}. "
+    if concerns:
+        assessment += f"Main concerns: {', '.join(concern.lower() for concern in concerns[:2])}."
+
+    market = data.get('market_conditions') or {}
+    trend = _interest_rate_trend(market.get('interest_rate_trend'))
+    return {
+        'summary': {
+            'overall_assessment': assessment.strip(),
+            'key_strengths': strengths[:3],
+            'key_concerns': concerns[:3],
+            'recommendations': recommendations,
+        },
+        'property_analysis': {
+            'property_value_growth_5yr': inputs['growth_5yr'],
+            'market_risk': _market_risk(inputs['growth_5yr']),
+            'property_tax_rate': inputs['property_tax_rate'],
+        },
+        'economic_factors': {
+            'economic_conditions_risk': _economic_risk(inputs['inflation_rate'], trend),
+            'inflation_rate': inputs['inflation_rate'],
+            'interest_rate_trend': trend,
+        },
+    }
+
+
+def triage(customer_input):
+    """
+    Score an application locally.
+
+    Returns (result, scoring): result is a complete analysis when the local
+    tier is confident and None when the LLM should decide; scoring describes
+    the local decision either way (None when the input could not be scored).
+    """
+    if not _setting('ANALYSIS_LOCAL_SCORING', True):
+        return None, None
+
+    data = parse_customer_input(customer_input)
+    metrics = compute_metrics(data) if data is not None else None
+    if metrics is None:
+        scoring_decisions.inc(tier='unscored')
+        return None, None
+
+    inputs = extract_loan_inputs(data)
+    features = extract_features(metrics, inputs)
+    if any(features[name] is None for name in REQUIRED_FEATURES):
+        scoring_decisions.inc(tier='unscored')
+        return None, None
+
+    probability, contributions, knockouts = score_features(features)
+    approve_above = _setting('ANALYSIS_LOCAL_APPROVE_ABOVE', 80) / 100.0
+    deny_below = _setting('ANALYSIS_LOCAL_DENY_BELOW', 25) / 100.0
+    if probability >= approve_above:
+        recommendation = 'Approved'
+    elif probability <= deny_below:
+        recommendation = 'Denied'
+    else:
+        recommendation = None
+
+    result = None
+    if recommendation is not None:
+        result = _narrative(data, inputs, features, probability, contributions, knockouts, recommendation)
+        result['credit_risk_analysis'] = {
+            'risk_score': round((1.0 - probability) * 100),
+            'risk_factors': _concerns(features, contributions, knockouts),
+            'approval_probability': round(probability * 100),
+            'approval_recommendation': recommendation,
+        }
+        result.update(metrics)
+        try:
+            # Held to the same schema as an LLM result, since parts of it echo user input
+            result = validate_analysis(result, list(SECTIONS))
+        except SchemaError as e:
+            logger.warning("Local result does not match the schema, deferring to the LLM: %s", e)
+            result = None
+
+    scoring = {
+        'tier': 'local' if result is not None else 'llm',
+        'model': MODEL_VERSION,
+        'approval_probability': round(probability * 100, 1),
+        'band': [round(deny_below * 100, 1), round(approve_above * 100, 1)],
+    }
+    scoring_decisions.inc(tier=scoring['tier'])
+    if result is None:
+        return None, scoring
+
+    result['scoring'] = scoring
+    return result, scoring
+
+
+def local_share():
+    """Fraction of scored-or-not analyses answered by the local tier"""
+    counts = {tier: scoring_decisions.value(tier=tier) for tier in ('local', 'llm', 'unscored')}
+    total = sum(counts.values())
+    return counts['local'] / total if total else None
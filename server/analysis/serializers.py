@@ -1,41 +1,30 @@
 from rest_framework import serializers
-from .models import Analysis
+from .models import Analysis, AnalysisJob
 import json
 
 class AnalysisSerializer(serializers.ModelSerializer):
     user_email = serializers.EmailField(source='user.email', read_only=True)
     customer_name = serializers.SerializerMethodField()
-    loan_amount = serializers.SerializerMethodField()
     status = serializers.CharField(required=False, default='pending')
 
     class Meta:
         model = Analysis
         fields = ['id', 'user_email', 'customer_input', 'customer_phone', 
                  'analysis_result', 'created_at', 'updated_at', 'customer_name', 'loan_amount',
-                 'status']
-        read_only_fields = ['user_email', 'analysis_result', 'created_at', 'updated_at']
+                 'risk_score', 'approval_probability', 'approval_recommendation', 'status']
+        read_only_fields = ['user_email', 'analysis_result', 'created_at', 'updated_at', 'loan_amount',
+                           'risk_score', 'approval_probability', 'approval_recommendation']
+
+    def __init__(self, *args, **kwargs):
+        # Optionally restrict output to a subset of fields (list projections)
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
     def get_customer_name(self, obj):
-        try:
-            if isinstance(obj.customer_input, str):
-                customer_input = json.loads(obj.customer_input)
-            else:
-                customer_input = obj.customer_input
-            
-            return customer_input.get('customer_name', 'N/A')
-        except:
-            return 'N/A'
-
-    def get_loan_amount(self, obj):
-        try:
-            if isinstance(obj.customer_input, str):
-                customer_input = json.loads(obj.customer_input)
-            else:
-                customer_input = obj.customer_input
-            
-            return customer_input.get('loan_amount', None)
-        except:
-            return None
+        return obj.customer_name or 'N/A'
 
     def validate(self, data):
         # Ensure customer_input is properly formatted
@@ -58,3 +47,15 @@ class AnalysisSerializer(serializers.ModelSerializer):
                     f'Missing required fields in customer_input: {missing_fields}')
 
         return data
+
+
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    analysis_id = serializers.IntegerField(read_only=True)
+    queue_seconds = serializers.FloatField(read_only=True)
+    run_seconds = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = AnalysisJob
+        fields = ['analysis_id', 'state', 'attempts', 'error', 'enqueued_at',
+                 'started_at', 'finished_at', 'queue_seconds', 'run_seconds']
+        read_only_fields = fields
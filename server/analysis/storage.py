@@ -0,0 +1,171 @@
+"""
+Compact storage for Analysis.analysis_result.
+
+ANALYSIS_RESULT_STORAGE chooses how results are written:
+- 'json' (the default) keeps the whole result as plain JSON in result_json.
+- 'zlib' or 'zstd' (the latter needs the zstandard package) stores
+  compressed JSON. The heavy sections (chart_data) go to result_charts and
+  the rest to result_data, so reading the narrative and scores neither
+  reads nor inflates the charts.
+
+Each blob starts with a header naming its codec and the dictionary it was
+compressed with. Rows therefore stay readable after the setting changes,
+and every mode can read rows written by any other.
+`compact_analysis_results --train-dictionary` builds a dictionary from stored
+results. A dictionary helps most with blobs of a few KB like these, which
+share most of their keys and phrasing.
+"""
+import json
+import struct
+import threading
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+MODES = ('json', 'zlib', 'zstd')
+# Sections kept in their own column, only read when the full result is
+HEAVY_SECTIONS = ('chart_data',)
+# Codec byte and dictionary id (0 for none)
+HEADER = struct.Struct('>cI')
+CODEC_BYTES = {'zlib': b'z', 'zstd': b's'}
+CODEC_NAMES = {value: key for key, value in CODEC_BYTES.items()}
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_dictionaries = {}
+_write_dictionaries = {}
+_lock = threading.Lock()
+
+
+def storage_mode():
+    mode = getattr(settings, 'ANALYSIS_RESULT_STORAGE', 'json')
+    if mode not in MODES:
+        raise ImproperlyConfigured(f'ANALYSIS_RESULT_STORAGE must be one of {MODES}, not {mode!r}')
+    return mode
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImproperlyConfigured('Reading or writing zstd results needs the zstandard package')
+    return zstandard
+
+
+def get_dictionary(dictionary_id):
+    """The bytes of a stored dictionary, cached for the life of the process"""
+    with _lock:
+        if dictionary_id in _dictionaries:
+            return _dictionaries[dictionary_id]
+    from .models import CompressionDictionary
+
+    data = bytes(CompressionDictionary.objects.values_list('data', flat=True).get(pk=dictionary_id))
+    with _lock:
+        _dictionaries[dictionary_id] = data
+    return data
+
+
+def write_dictionary(codec):
+    """(id, bytes) of the newest dictionary for codec, or (0, None) without one"""
+    with _lock:
+        if codec in _write_dictionaries:
+            return _write_dictionaries[codec]
+    from .models import CompressionDictionary
+
+    latest = CompressionDictionary.objects.filter(codec=codec).order_by('-id').first()
+    entry = (latest.id, bytes(latest.data)) if latest is not None else (0, None)
+    with _lock:
+        _write_dictionaries[codec] = entry
+        if latest is not None:
+            _dictionaries[latest.id] = entry[1]
+    return entry
+
+
+def forget_dictionaries():
+    """Pick up a newly trained dictionary for writing"""
+    with _lock:
+        _write_dictionaries.clear()
+
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def compress(value, codec):
+    data = dumps(value)
+    dictionary_id, dictionary = write_dictionary(codec)
+    if codec == 'zstd':
+        zstandard = _zstd()
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        payload = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data).compress(data)
+    else:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zdict=dictionary) if dictionary else zlib.compressobj(ZLIB_LEVEL)
+        payload = compressor.compress(data) + compressor.flush()
+    return HEADER.pack(CODEC_BYTES[codec], dictionary_id) + payload
+
+
+def decompress(blob):
+    blob = bytes(blob)
+    codec_byte, dictionary_id = HEADER.unpack_from(blob)
+    codec = CODEC_NAMES.get(codec_byte)
+    if codec is None:
+        raise ValueError(f'Unknown result codec {codec_byte!r}')
+    payload = blob[HEADER.size:]
+    dictionary = get_dictionary(dictionary_id) if dictionary_id else None
+    if codec == 'zstd':
+        zstandard = _zstd()
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        data = zstandard.ZstdDecompressor(dict_data=dict_data).decompress(payload)
+    else:
+        decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        data = decompressor.decompress(payload) + decompressor.flush()
+    return json.loads(data)
+
+
+def split(result):
+    """(light sections, heavy sections) of a result"""
+    light = {key: value for key, value in result.items() if key not in HEAVY_SECTIONS}
+    heavy = {key: result[key] for key in HEAVY_SECTIONS if key in result}
+    return light, heavy
+
+
+def encode(result, mode=None):
+    """Values of (result_json, result_data, result_charts) that store result"""
+    mode = mode or storage_mode()
+    if mode == 'json' or not isinstance(result, dict):
+        return result, None, None
+    light, heavy = split(result)
+    return None, compress(light, mode), compress(heavy, mode) if heavy else None
+
+
+def decode(result_json, result_data, result_charts):
+    """The full result from its stored columns"""
+    if result_data is None:
+        return result_json if result_json is not None else {}
+    result = decompress(result_data)
+    if result_charts is not None:
+        result.update(decompress(result_charts))
+    return result
+
+
+def decode_light(result_json, result_data):
+    """The result without its heavy sections, where they are stored apart"""
+    if result_data is None:
+        return result_json if result_json is not None else {}
+    return decompress(result_data)
+
+
+def stored_size(result_json, result_data, result_charts):
+    """Bytes a result takes in its columns"""
+    size = len(dumps(result_json)) if result_json is not None else 0
+    return size + sum(len(blob) for blob in (result_data, result_charts) if blob is not None)
+
+
+def train_dictionary(codec, samples, size):
+    """Build a dictionary for codec from sample JSON documents (bytes)"""
+    if codec == 'zstd':
+        return _zstd().train_dictionary(size, samples).as_bytes()
+    # zlib takes any preset bytes as a dictionary (at most 32KB are used) and
+    # finds the nearest matches cheapest, so the most recent samples go last
+    return b''.join(samples)[-min(size, 32 * 1024):]
@@ -0,0 +1,113 @@
+"""
+Incremental delivery of an analysis while the LLM is still generating it.
+
+SectionParser consumes the model output chunk by chunk and hands back each
+top-level member of the JSON object as soon as its value is complete, so a
+client can render `summary` or `credit_risk_analysis` before `chart_data`
+has been written. Each character is scanned once.
+"""
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+from .jsonrepair import loads
+
+
+class SectionParser:
+    """Single-pass parser that yields completed top-level (key, value) pairs"""
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.finished = False
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.sections = {}
+
+    def feed(self, chunk):
+        """Add text and return the list of sections completed by it"""
+        self.buffer += chunk
+        completed = []
+
+        while self.pos < len(self.buffer) and not self.finished:
+            char = self.buffer[self.pos]
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.key is None and self.key_start is not None:
+                        self.key = json.loads(self.buffer[self.key_start:self.pos + 1])
+                        self.key_start = None
+            elif not self.started:
+                # Skip any preamble the model writes before the object
+                if char == '{':
+                    self.started = True
+                    self.depth = 1
+            elif char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key is None:
+                    self.key_start = self.pos
+            elif char == ':' and self.depth == 1 and self.key is not None and self.value_start is None:
+                self.value_start = self.pos + 1
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    self._complete(completed)
+                    self.finished = True
+            elif char == ',' and self.depth == 1:
+                self._complete(completed)
+
+            self.pos += 1
+
+        return completed
+
+    def _complete(self, completed):
+        if self.key is not None and self.value_start is not None:
+            value = loads(self.buffer[self.value_start:self.pos])
+            self.sections[self.key] = value
+            completed.append((self.key, value))
+        self.key = None
+        self.value_start = None
+
+
+def format_event(event, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF content negotiation accept `Accept: text/event-stream`"""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only reached for error responses, streams bypass the renderer
+        return format_event('error', data).encode(self.charset)
+
+
+def format_ndjson(data):
+    """Encode one newline-delimited JSON record"""
+    return json.dumps(data, separators=(',', ':')) + '\n'
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Lets DRF content negotiation accept `Accept: application/x-ndjson`"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only reached for error responses, streams bypass the renderer
+        return format_ndjson(data).encode(self.charset)
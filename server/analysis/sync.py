@@ -0,0 +1,228 @@
+"""
+Write-behind mirror of analyses to the Supabase `analyses` table.
+
+Analysis.save only writes an outbox row; this worker drains the outbox in
+batches. Pending entries for the same analysis are coalesced into one
+request carrying just the changed columns, new analyses are inserted with a
+single batched call, and failures are retried with exponential backoff.
+"""
+import logging
+import random
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Min
+from django.utils import timezone
+
+from .clients import get_supabase
+from .metrics import timed
+from .models import Analysis, SupabaseOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def mirror_row(analysis, fields):
+    """Supabase column values for the given Analysis fields"""
+    return {field: getattr(analysis, field) for field in fields}
+
+
+class SupabaseSyncWorker:
+    """Drains the SupabaseOutbox table into Supabase"""
+
+    def __init__(self, batch_size=None, interval=None, poll_interval=None,
+                 base_backoff=None, max_backoff=None, lease=None):
+        self.batch_size = batch_size or _setting('SUPABASE_SYNC_BATCH_SIZE', 100)
+        self.interval = interval or _setting('SUPABASE_SYNC_INTERVAL', 1.0)
+        self.poll_interval = poll_interval or _setting('SUPABASE_SYNC_POLL_INTERVAL', 5.0)
+        self.base_backoff = base_backoff or _setting('SUPABASE_SYNC_BASE_BACKOFF', 2.0)
+        self.max_backoff = max_backoff or _setting('SUPABASE_SYNC_MAX_BACKOFF', 300.0)
+        self.lease = lease or _setting('SUPABASE_SYNC_LEASE', 60)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._work, name='supabase-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def claim_batch(self):
+        """
+        Lease the due outbox entries of up to batch_size analyses.
+
+        Analyses with an entry leased by another worker are skipped, so two
+        workers (every web process runs one) never mirror the same analysis at
+        once, which could insert it into Supabase twice.
+        """
+        now = timezone.now()
+        leased = self._leased(now).values('analysis_id')
+        analysis_ids = list(
+            SupabaseOutbox.objects.filter(next_attempt_at__lte=now)
+            .exclude(analysis_id__in=leased)
+            .values('analysis_id')
+            .annotate(oldest=Min('id'))
+            .order_by('oldest')
+            .values_list('analysis_id', flat=True)[:self.batch_size]
+        )
+        if not analysis_ids:
+            return []
+
+        token = uuid.uuid4().hex
+        SupabaseOutbox.objects.filter(
+            analysis_id__in=analysis_ids,
+            next_attempt_at__lte=now
+        ).exclude(analysis_id__in=leased).update(lock_token=token, next_attempt_at=now + timedelta(seconds=self.lease))
+
+        # Two workers can still pass the check above together when the database
+        # runs their updates concurrently. Each looks again after its own lease
+        # is written, so at least one sees the other and backs off.
+        contested = list(
+            self._leased(timezone.now())
+            .filter(analysis_id__in=SupabaseOutbox.objects.filter(lock_token=token).values('analysis_id'))
+            .exclude(lock_token=token)
+            .values_list('analysis_id', flat=True)
+        )
+        if contested:
+            SupabaseOutbox.objects.filter(lock_token=token, analysis_id__in=contested).update(
+                lock_token='', next_attempt_at=now
+            )
+        return list(SupabaseOutbox.objects.filter(lock_token=token).order_by('id'))
+
+    @staticmethod
+    def _leased(now):
+        """Outbox entries under a lease that has not expired"""
+        return SupabaseOutbox.objects.filter(next_attempt_at__gt=now).exclude(lock_token='')
+
+    def run_once(self):
+        """Sync one batch, returns the number of analyses it covered"""
+        entries = self.claim_batch()
+        if not entries:
+            return 0
+
+        # Coalesce every pending change of an analysis into one set of columns
+        pending = OrderedDict()
+        for entry in entries:
+            fields, ids = pending.setdefault(entry.analysis_id, (set(), []))
+            fields.update(entry.changed_fields)
+            ids.append(entry.id)
+
+        analyses = Analysis.objects.select_related('user').in_bulk(list(pending))
+        inserts = [analyses[pk] for pk in pending if pk in analyses and not analyses[pk].supabase_id]
+        updates = [analyses[pk] for pk in pending if pk in analyses and analyses[pk].supabase_id]
+
+        if inserts:
+            self._insert(inserts, [pending[analysis.pk][1] for analysis in inserts])
+        for analysis in updates:
+            fields, ids = pending[analysis.pk]
+            self._update(analysis, fields, ids)
+
+        return len(pending)
+
+    def _insert(self, analyses, outbox_ids):
+        rows = []
+        for analysis in analyses:
+            row = mirror_row(analysis, Analysis.MIRRORED_FIELDS)
+            row['user_email'] = analysis.user.email
+            rows.append(row)
+
+        try:
+            with timed('supabase_sync'):
+                result = get_supabase().table('analyses').insert(rows).execute()
+        except Exception as e:
+            self._retry([pk for ids in outbox_ids for pk in ids], e)
+            return
+
+        # PostgREST returns the inserted rows in request order
+        inserted = result.data or []
+        for analysis, row, ids in zip(analyses, inserted, outbox_ids):
+            Analysis.objects.filter(pk=analysis.pk).update(supabase_id=row['id'])
+            SupabaseOutbox.objects.filter(id__in=ids).delete()
+        missing = [pk for ids in outbox_ids[len(inserted):] for pk in ids]
+        if missing:
+            self._retry(missing, 'Supabase did not return the inserted rows')
+
+    def _update(self, analysis, fields, outbox_ids):
+        try:
+            with timed('supabase_sync'):
+                get_supabase().table('analyses').update(
+                    mirror_row(analysis, sorted(fields))
+                ).eq('id', analysis.supabase_id).execute()
+        except Exception as e:
+            self._retry(outbox_ids, e)
+            return
+        SupabaseOutbox.objects.filter(id__in=outbox_ids).delete()
+
+    def _retry(self, outbox_ids, error):
+        logger.warning("Supabase sync failed for %d outbox entries: %s", len(outbox_ids), error)
+        now = timezone.now()
+        for entry in SupabaseOutbox.objects.filter(id__in=outbox_ids):
+            entry.attempts += 1
+            delay = min(self.base_backoff * (2 ** (entry.attempts - 1)), self.max_backoff)
+            # Full jitter keeps failed batches from retrying in lockstep
+            entry.next_attempt_at = now + timedelta(seconds=random.uniform(delay / 2, delay))
+            entry.lock_token = ''
+            entry.last_error = str(error)
+            entry.save(update_fields=['attempts', 'next_attempt_at', 'lock_token', 'last_error'])
+
+    def _work(self):
+        while not self._stopping.is_set():
+            close_old_connections()
+            try:
+                processed = self.run_once()
+            except Exception:
+                logger.exception("Supabase sync worker error")
+                processed = 0
+
+            if processed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                if not self._stopping.is_set():
+                    # Give concurrent saves a moment to land in the same batch
+                    self._stopping.wait(self.interval)
+        close_old_connections()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = SupabaseSyncWorker()
+        return _worker
+
+
+def notify():
+    """Called after a transaction that wrote outbox entries has committed"""
+    if not _setting('SUPABASE_SYNC_EMBEDDED', True):
+        return
+    worker = get_worker()
+    worker.start()
+    worker.wake()
@@ -0,0 +1,844 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+import groq
+import httpx
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import jobs, storage
+from .cache import ResultCache, cache_key, canonicalize
+from .filters import filter_analyses, parse_ordering
+from .financials import (compute_metrics, extract_loan_inputs, monthly_payment, payoff_months, remaining_balance,
+                         to_number)
+from .idempotency import AsyncSingleFlight, SingleFlight
+from .jsonrepair import extract_json, loads
+from .models import (Analysis, AnalysisJob, AnalysisRollup, CompressionDictionary, IdempotencyKey,
+                     SupabaseOutbox)
+from .pagination import KeysetPagination
+from .rollups import portfolio_stats, rebuild
+from .scoring import KNOCKOUT_CAP, extract_features, score_features, triage
+from .schema import SECTIONS, SchemaError, validate_analysis, validate_section
+from .sync import SupabaseSyncWorker
+from .upstream import CircuitBreaker, GroqGateway, RateLimiter, UpstreamUnavailable, parse_duration
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ListIndexTests(TestCase):
+    def test_list_queries_use_their_indexes(self):
+        # Raises CommandError when a plan misses its index
+        call_command('check_list_indexes', stdout=StringIO())
+
+    def test_null_cursor_pages_use_the_index(self):
+        queryset = KeysetPagination.order_queryset(
+            Analysis.objects.filter(user_id=1, risk_score__isnull=True, id__lt=100), 'risk_score', True
+        )
+        self.assertIn('analysis_user_risk_idx', queryset[:KeysetPagination.page_size + 1].explain())
+
+
+class SortListView:
+    def get_sort(self, request):
+        return parse_ordering(request.query_params)
+
+
+class NullSortKeyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='lender', email='lender@example.com')
+        scores = [40, None, 75, 40, None, 10, None]
+        cls.ids = {}
+        for score in scores:
+            analysis = Analysis.objects.create(user=cls.user, customer_input='{}', customer_phone='555')
+            # Written past save(), which derives risk_score from the result
+            Analysis.objects.filter(pk=analysis.pk).update(risk_score=score)
+            cls.ids[analysis.pk] = score
+
+    def list_all(self, ordering, page_size=2):
+        """Every row in list order, following the cursor page by page"""
+        seen, query = [], f'ordering={ordering}&page_size={page_size}'
+        factory = APIRequestFactory()
+        while query is not None:
+            request = Request(factory.get('/api/analyses/?' + query))
+            paginator = KeysetPagination()
+            queryset = filter_analyses(Analysis.objects.filter(user=self.user), QueryDict(query))
+            seen.extend(row.pk for row in paginator.paginate_queryset(queryset, request, SortListView()))
+            link = paginator.get_next_link()
+            query = link.split('?', 1)[1] if link else None
+        return seen
+
+    def assert_ordered(self, ordering, descending):
+        seen = self.list_all(ordering)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(set(seen), set(self.ids))
+
+        keyed = [pk for pk in seen if self.ids[pk] is not None]
+        nulls = [pk for pk in seen if self.ids[pk] is None]
+        self.assertEqual(seen, keyed + nulls)
+        self.assertEqual(keyed, sorted(keyed, key=lambda pk: (self.ids[pk], pk), reverse=descending))
+        self.assertEqual(nulls, sorted(nulls, reverse=descending))
+
+    def test_descending_lists_null_rows_last(self):
+        self.assert_ordered('-risk_score', descending=True)
+
+    def test_ascending_lists_null_rows_last(self):
+        self.assert_ordered('risk_score', descending=False)
+
+    def test_range_filters_still_skip_null_rows(self):
+        queryset = filter_analyses(Analysis.objects.filter(user=self.user), QueryDict('risk_score_min=0'))
+        self.assertEqual(queryset.count(), 4)
+
+
+APPLICATION = {
+    'customer_name': 'Jane Roe',
+    'loan_amount': 300000,
+    'customer_details': {'monthly_income': 9000, 'car_loan_payment': 400, 'credit_card_payment': 250},
+    'loan_details': {'interest_rate': 6.5, 'loan_term_years': 30, 'property_value': 375000},
+}
+
+
+class FinancialsTests(TestCase):
+    def test_amortization_of_the_application(self):
+        metrics = compute_metrics(json.dumps(APPLICATION))
+        self.assertEqual(metrics['loan_metrics']['monthly_payment'], 1896.2)
+        self.assertEqual(metrics['loan_metrics']['total_interest_paid'], 382633.47)
+        self.assertEqual(metrics['chart_data']['loan_amortization'], [
+            {'year': 1, 'principal_paid': 3353.18, 'interest_paid': 19401.27, 'remaining_balance': 296646.82},
+            {'year': 5, 'principal_paid': 19167.07, 'interest_paid': 94605.18, 'remaining_balance': 280832.93},
+            {'year': 10, 'principal_paid': 45671.62, 'interest_paid': 181872.87, 'remaining_balance': 254328.38},
+        ])
+
+    def test_debt_to_income_and_loan_to_value(self):
+        metrics = compute_metrics(APPLICATION)['financial_metrics']
+        # (1896.20 mortgage + 400 car + 250 cards) / 9000 income, 300000 / 375000
+        self.assertEqual(metrics['debt_to_income_ratio'], 28.29)
+        self.assertEqual(metrics['loan_to_value_ratio'], 80.0)
+
+        without_property = dict(APPLICATION, loan_details={'interest_rate': 6.5, 'loan_term_years': 30})
+        self.assertIsNone(compute_metrics(without_property)['financial_metrics']['loan_to_value_ratio'])
+
+    def test_annual_income_and_term_months_are_accepted(self):
+        data = dict(APPLICATION, customer_details={'annual_income': 108000, 'car_loan_payment': 400,
+                                                   'credit_card_payment': 250},
+                    loan_details={'interest_rate': '6.5%', 'loan_term_months': 360, 'property_value': 375000})
+        self.assertEqual(compute_metrics(data)['financial_metrics']['debt_to_income_ratio'], 28.29)
+
+    def test_zero_rate_and_unpayable_loans(self):
+        self.assertEqual(float(monthly_payment(12000, 0, 12)), 1000.0)
+        self.assertEqual(float(remaining_balance(12000, 0, 1000, 12)), 0.0)
+        # 1000 a month never covers 1% a month on 100000
+        self.assertEqual(float(payoff_months(100000, 12, 1000)), float('inf'))
+
+    def test_arrays_broadcast(self):
+        payments = monthly_payment(300000, [0.5, 6.5], 360)
+        self.assertEqual([round(float(payment), 2) for payment in payments], [897.57, 1896.2])
+
+    def test_incomplete_input_is_left_to_the_llm(self):
+        self.assertIsNone(compute_metrics('Jane wants a mortgage'))
+        self.assertIsNone(compute_metrics(dict(APPLICATION, customer_details={'monthly_income': 0})))
+        self.assertIsNone(compute_metrics({'loan_amount': 300000}))
+
+    def test_numbers_are_coerced(self):
+        self.assertEqual([to_number(value) for value in ('6.5%', '$1,200', 7, 'nan', 'inf', True, 'n/a')],
+                         [6.5, 1200.0, 7.0, None, None, None, None])
+
+
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = ResultCache(Path(directory.name) / 'cache.sqlite3', ttl=3600, max_entries=2)
+
+    def test_key_ignores_formatting(self):
+        key = cache_key(json.dumps(APPLICATION), 'model', 'v1')
+        reordered = json.dumps(dict(reversed(list(APPLICATION.items()))), indent=2)
+        self.assertEqual(cache_key(reordered, 'model', 'v1'), key)
+        self.assertEqual(cache_key(APPLICATION, 'model', 'v1'), key)
+        self.assertEqual(canonicalize('  Jane \n wants\ta loan '), 'Jane wants a loan')
+
+    def test_key_changes_with_the_input_model_and_prompt(self):
+        key = cache_key(APPLICATION, 'model', 'v1')
+        self.assertNotEqual(cache_key(dict(APPLICATION, loan_amount=300001), 'model', 'v1'), key)
+        self.assertNotEqual(cache_key(APPLICATION, 'other-model', 'v1'), key)
+        self.assertNotEqual(cache_key(APPLICATION, 'model', 'v2'), key)
+
+    def test_hits_and_misses(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', {'summary': {'overall_assessment': 'Strong'}})
+        self.assertEqual(self.cache.get('a'), {'summary': {'overall_assessment': 'Strong'}})
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate'], stats['size']), (1, 1, 0.5, 1))
+
+    def test_expired_entries_miss(self):
+        self.cache.set('a', {})
+        self.cache.ttl = -1
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('a', {})
+        self.cache.set('b', {})
+        self.cache.get('a')
+        self.cache.set('c', {})
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), {})
+
+
+def applicant(**details):
+    return dict(APPLICATION, customer_details=dict(APPLICATION['customer_details'], **details))
+
+
+class ScorecardTests(TestCase):
+    def probability(self, data):
+        metrics = compute_metrics(data)
+        return score_features(extract_features(metrics, extract_loan_inputs(data)))[0] * 100
+
+    def assert_tier(self, data, tier, recommendation=None):
+        result, scoring = triage(data)
+        self.assertEqual(scoring['tier'], tier)
+        if recommendation is None:
+            self.assertIsNone(result)
+        else:
+            self.assertEqual(result['credit_risk_analysis']['approval_recommendation'], recommendation)
+            self.assertEqual(result['scoring'], scoring)
+
+    def test_average_applicant_goes_to_the_llm(self):
+        # DTI 28.3% and an average credit score: about 80%, just inside the default band
+        data = applicant(credit_score=680)
+        self.assertAlmostEqual(self.probability(data), 79.75, places=2)
+        self.assert_tier(data, 'llm')
+
+    def test_approve_boundary(self):
+        data = applicant(credit_score=680)
+        probability = self.probability(data)
+        with override_settings(ANALYSIS_LOCAL_APPROVE_ABOVE=probability - 1e-6):
+            self.assert_tier(data, 'local', 'Approved')
+        with override_settings(ANALYSIS_LOCAL_APPROVE_ABOVE=probability + 1e-6):
+            self.assert_tier(data, 'llm')
+
+    def test_deny_boundary(self):
+        data = applicant(credit_score=560)
+        probability = self.probability(data)
+        with override_settings(ANALYSIS_LOCAL_DENY_BELOW=probability + 1e-6):
+            self.assert_tier(data, 'local', 'Denied')
+        with override_settings(ANALYSIS_LOCAL_DENY_BELOW=probability - 1e-6):
+            self.assert_tier(data, 'llm')
+
+    def test_clear_approval_is_answered_locally(self):
+        result, scoring = triage(applicant(credit_score=800, total_assets=400000, total_liabilities=50000))
+        self.assertEqual(scoring['approval_probability'], 98.4)
+        self.assertEqual(result['credit_risk_analysis']['risk_score'], 2)
+        self.assertEqual(result['loan_metrics']['monthly_payment'], 1896.2)
+
+    def test_knockouts_cap_the_probability(self):
+        self.assertEqual(self.probability(applicant(credit_score=450, total_assets=5e6, total_liabilities=0)),
+                         KNOCKOUT_CAP * 100)
+        result, _ = triage(applicant(credit_score=450))
+        self.assertEqual(result['credit_risk_analysis']['risk_factors'][0], 'Credit score below 500')
+
+    def test_missing_features_are_unscored(self):
+        self.assertEqual(triage(APPLICATION), (None, None))
+        self.assertEqual(triage('Jane wants a mortgage'), (None, None))
+        with override_settings(ANALYSIS_LOCAL_SCORING=False):
+            self.assertEqual(triage(applicant(credit_score=800)), (None, None))
+
+
+class ScenarioTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='lender', email='lender@example.com')
+        cls.analysis = Analysis.objects.create(
+            user=cls.user, customer_input=json.dumps(APPLICATION), customer_phone='555'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, grid):
+        return self.client.post(f'/api/analyses/{self.analysis.id}/scenarios/', grid, format='json')
+
+    def assert_rejected(self, grid):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.post(grid).status_code, 400)
+
+    def test_defaults_to_the_application(self):
+        response = self.post({})
+        self.assertEqual(response.status_code, 200)
+        scenarios = response.json()['scenarios']
+        self.assertEqual(scenarios['monthly_payment'], [1896.2])
+        self.assertEqual(scenarios['debt_to_income_ratio'], [28.29])
+        self.assertEqual(scenarios['loan_to_value_ratio'], [80.0])
+
+    def test_rates_are_percentages(self):
+        scenarios = self.post({'rate': [0.5, 6.5]}).json()['scenarios']
+        self.assertEqual(scenarios['monthly_payment'], [897.57, 1896.2])
+
+    def test_grid_is_the_cartesian_product(self):
+        body = self.post({'rate': {'start': 5, 'stop': 7, 'step': 0.5}, 'term_years': [15, 30],
+                          'extra_payment': [0, 200]}).json()
+        self.assertEqual(body['count'], 5 * 2 * 2)
+        self.assertEqual(body['scenarios']['rate'][:4], [5.0] * 4)
+        self.assertEqual(body['scenarios']['extra_payment'][:2], [0.0, 200.0])
+        self.assertEqual(len(body['amortization']['remaining_balance']), 20)
+
+    @override_settings(ANALYSIS_SCENARIO_MAX_POINTS=100)
+    def test_grid_size_is_limited(self):
+        self.assert_rejected({'rate': {'start': 1, 'stop': 10, 'step': 0.5}, 'principal': list(range(1000, 7000, 1000))})
+        self.assert_rejected({'rate': {'start': 1, 'stop': 100, 'step': 0.001}})
+
+    def test_out_of_range_values_are_rejected(self):
+        for grid in ({'extra_payment': [1e308]}, {'term_months': [1e308]}, {'rate': [10], 'term_months': [100000]},
+                     {'rate': [1e300]}, {'principal': [0]}, {'rate': [-1]}, {'rate': 'x'}, [1, 2]):
+            with self.subTest(grid=grid):
+                self.assert_rejected(grid)
+
+    def test_largest_values_stay_finite(self):
+        response = self.post({'rate': [100], 'term_months': [1200], 'principal': [1e12], 'extra_payment': [1e12]})
+        self.assertEqual(response.status_code, 200)
+
+
+class SupabaseSyncClaimTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='lender', email='lender@example.com')
+
+    def create(self):
+        # Creating an analysis writes its first outbox entry
+        return Analysis.objects.create(user=self.user, customer_input='{}', customer_phone='555')
+
+    def test_claims_every_due_entry_of_an_analysis(self):
+        analysis = self.create()
+        analysis.status = 'approved'
+        analysis.save(update_fields=['status', 'updated_at'])
+        entries = SupabaseSyncWorker().claim_batch()
+        self.assertEqual([entry.analysis_id for entry in entries], [analysis.id, analysis.id])
+
+    def test_skips_analyses_leased_by_another_worker(self):
+        first, second = self.create(), self.create()
+        self.assertEqual({entry.analysis_id for entry in SupabaseSyncWorker(batch_size=1).claim_batch()}, {first.id})
+
+        # A change made while the first worker is still inserting the row
+        first.status = 'approved'
+        first.save(update_fields=['status', 'updated_at'])
+        entries = SupabaseSyncWorker().claim_batch()
+        self.assertEqual({entry.analysis_id for entry in entries}, {second.id})
+
+    def test_expired_leases_are_claimed_again(self):
+        analysis = self.create()
+        SupabaseSyncWorker(lease=60).claim_batch()
+        SupabaseOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(len(SupabaseSyncWorker().claim_batch()), 1)
+        self.assertEqual(SupabaseOutbox.objects.get().analysis_id, analysis.id)
+
+
+class AnalysisJobClaimTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='lender', email='lender@example.com')
+
+    def setUp(self):
+        self.analysis = Analysis.objects.create(user=self.user, customer_input='{}', customer_phone='555')
+
+    def test_only_one_owner_claims_a_new_analysis(self):
+        job = jobs.claim(self.analysis, 'stream-a')
+        self.assertEqual((job.state, job.worker, job.attempts), ('running', 'stream-a', 1))
+        self.assertIsNone(jobs.claim(self.analysis, 'stream-b'))
+
+    def test_failed_jobs_are_claimed_again(self):
+        jobs.finish(jobs.claim(self.analysis, 'stream-a'), error='LLM unavailable')
+        job = jobs.claim(self.analysis, 'stream-b')
+        self.assertEqual((job.state, job.worker, job.attempts), ('running', 'stream-b', 2))
+
+    def test_succeeded_jobs_are_not_claimed(self):
+        jobs.finish(jobs.claim(self.analysis, 'stream-a'))
+        self.assertIsNone(jobs.claim(self.analysis, 'stream-b'))
+
+    @override_settings(ANALYSIS_JOB_LEASE_TIMEOUT=60)
+    def test_expired_leases_are_taken_over(self):
+        jobs.claim(self.analysis, 'stream-a')
+        self.assertIsNone(jobs.claim(self.analysis, 'stream-b'))
+        AnalysisJob.objects.update(started_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(jobs.claim(self.analysis, 'stream-b').worker, 'stream-b')
+
+
+class SchemaTests(TestCase):
+    def assert_invalid(self, section, value, path):
+        with self.assertRaises(SchemaError) as raised:
+            validate_section(section, value)
+        self.assertIn(path, [error[0] for error in raised.exception.errors])
+
+    def test_near_misses_are_coerced(self):
+        section = validate_section('credit_risk_analysis', {
+            'risk_score': '35%', 'risk_factors': 'High DTI',
+            'approval_probability': 104, 'approval_recommendation': 'approve.',
+        })
+        self.assertEqual(section, {
+            'risk_score': 35, 'risk_factors': ['High DTI'],
+            'approval_probability': 100, 'approval_recommendation': 'Approved',
+        })
+        self.assertEqual(validate_section('loan_metrics', {'monthly_payment': '$1,896.20'}),
+                         {'monthly_payment': 1896.2})
+
+    def test_optional_fields_may_be_null(self):
+        self.assertEqual(validate_section('financial_metrics', {'net_worth': None, 'savings_rate': 'N/A'}),
+                         {'net_worth': None, 'savings_rate': None})
+        self.assertEqual(validate_section('property_analysis', {'market_risk': None}), {'market_risk': None})
+
+    def test_required_fields_may_not_be_null(self):
+        credit = {'risk_score': 40, 'approval_probability': 60, 'approval_recommendation': 'Approved'}
+        for name in credit:
+            with self.subTest(field=name):
+                self.assert_invalid('credit_risk_analysis', {**credit, name: None}, f'credit_risk_analysis.{name}')
+        self.assert_invalid('summary', {'overall_assessment': None}, 'summary.overall_assessment')
+
+    def test_missing_and_unfixable_values_are_reported_together(self):
+        with self.assertRaises(SchemaError) as raised:
+            validate_analysis({'credit_risk_analysis': {'risk_score': 'high', 'approval_probability': float('inf'),
+                                                        'approval_recommendation': 'maybe'}}, list(SECTIONS))
+        paths = {error[0] for error in raised.exception.errors}
+        self.assertLessEqual({'summary', 'credit_risk_analysis.risk_score', 'credit_risk_analysis.approval_probability',
+                              'credit_risk_analysis.approval_recommendation'}, paths)
+
+
+class JSONRepairTests(TestCase):
+    def repaired(self, text):
+        with self.assertLogs('analysis.jsonrepair', 'INFO'):
+            return loads(text)
+
+    def test_common_mistakes_are_repaired(self):
+        text = "{'risk_score': 35%, approved: True, // comment\n 'notes': None, 'list': [1, 2,],}"
+        self.assertEqual(self.repaired(text),{'risk_score': '35%', 'approved': True, 'notes': None, 'list': [1, 2]})
+
+    def test_truncated_output_is_closed(self):
+        self.assertEqual(self.repaired('{"summary": {"key_strengths": ["Income"'), {'summary': {'key_strengths': ['Income']}})
+
+    def test_object_is_found_among_prose(self):
+        text = 'Here is {the} analysis:\n```json\n{"risk_score": 40, "note": "a } brace"}\n```\nThanks {!}'
+        self.assertEqual(extract_json(text), {'risk_score': 40, 'note': 'a } brace'})
+
+    def test_non_finite_numbers_become_null(self):
+        for text in ('{"risk_score": NaN}', '{"risk_score": Infinity}', '{"risk_score": -Infinity}'):
+            with self.subTest(text=text):
+                self.assertEqual(loads(text), {'risk_score': None})
+        self.assertEqual(self.repaired("{'risk_score': NaN,}"), {'risk_score': None})
+
+    def test_null_required_number_from_repair_is_rejected(self):
+        section = loads('{"risk_score": NaN, "approval_probability": 60, "approval_recommendation": "Denied"}')
+        with self.assertRaises(SchemaError):
+            validate_section('credit_risk_analysis', section)
+
+
+class RollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='lender', email='lender@example.com')
+
+    def create(self, risk_score=None, loan_amount=300000):
+        analysis = Analysis.objects.create(
+            user=self.user, customer_input=json.dumps({'loan_amount': loan_amount}), customer_phone='555'
+        )
+        if risk_score is not None:
+            analysis.save_result({'credit_risk_analysis': {
+                'risk_score': risk_score, 'approval_probability': 100 - risk_score,
+                'approval_recommendation': 'Approved' if risk_score < 50 else 'Denied',
+            }})
+        return analysis
+
+    def buckets(self):
+        return {
+            (row.status, row.approval_recommendation, row.risk_band): row.count
+            for row in AnalysisRollup.objects.filter(count__gt=0)
+        }
+
+    def rows(self):
+        return sorted(AnalysisRollup.objects.filter(count__gt=0).values_list(
+            'user_id', 'day', 'status', 'approval_recommendation', 'risk_band', 'count',
+            *(f'{field}_{part}' for field in AnalysisRollup.SUMMED_FIELDS for part in ('sum', 'count'))
+        ))
+
+    def test_saving_a_result_moves_the_analysis(self):
+        analysis = self.create()
+        self.assertEqual(self.buckets(), {('pending', '', AnalysisRollup.NO_RISK_BAND): 1})
+        analysis.save_result({'credit_risk_analysis': {'risk_score': 35, 'approval_recommendation': 'Approved'}})
+        self.assertEqual(self.buckets(), {('pending', 'Approved', 30): 1})
+
+    def test_status_change_moves_the_analysis(self):
+        analysis = self.create(risk_score=72)
+        analysis.status = 'rejected'
+        analysis.save(update_fields=['status', 'updated_at'])
+        self.assertEqual(self.buckets(), {('rejected', 'Denied', 70): 1})
+
+    def test_stale_instance_moves_the_stored_values(self):
+        analysis = self.create(risk_score=20)
+        stale = Analysis.objects.get(pk=analysis.pk)
+        analysis.status = 'approved'
+        analysis.save(update_fields=['status', 'updated_at'])
+        stale.save_result({'credit_risk_analysis': {'risk_score': 95}})
+        self.assertEqual(self.buckets(), {('approved', '', 90): 1})
+
+    def test_delete_removes_the_analysis(self):
+        self.create(risk_score=20)
+        deleted = self.create(risk_score=20)
+        deleted.delete()
+        self.assertEqual(self.buckets(), {('pending', 'Approved', 20): 1})
+        totals = portfolio_stats(self.user)['totals']
+        self.assertEqual((totals['count'], totals['average_risk_score']), (1, 20.0))
+
+    def test_rebuild_matches_the_running_rollups(self):
+        for risk_score in (None, 5, 45, 45, 99, 100):
+            self.create(risk_score=risk_score, loan_amount=100000 + 1000 * (risk_score or 0))
+        self.create(loan_amount=None).delete()
+        analysis = self.create(risk_score=60)
+        analysis.status = 'approved'
+        analysis.save()
+
+        running = self.rows()
+        self.assertEqual(rebuild(), AnalysisRollup.objects.count())
+        self.assertEqual(self.rows(), running)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def groq_error(error_class, status, headers=None):
+    response = httpx.Response(status, request=httpx.Request('POST', 'https://api.groq.com'), headers=headers)
+    return error_class('Groq error', response=response, body=None)
+
+
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(max_wait=5, clock=self.clock, sleep=None)
+
+    def test_reset_headers_are_parsed(self):
+        self.assertEqual([parse_duration(value) for value in ('7.66s', '2m59.56s', '120ms', '3', 'soon', None)],
+                         [7.66, 179.56, 0.12, 3.0, None, None])
+
+    def test_unbounded_until_the_first_response(self):
+        for _ in range(100):
+            self.assertEqual(self.limiter.reserve(10000), 0)
+
+    def test_waits_for_the_reported_refill(self):
+        # 2 of 10 requests left, all 10 back after 8s: one request a second
+        self.limiter.update({'x-ratelimit-limit-requests': '10', 'x-ratelimit-remaining-requests': '2',
+                             'x-ratelimit-reset-requests': '8s'})
+        self.assertEqual(self.limiter.reserve(100), 0)
+        self.assertEqual(self.limiter.reserve(100), 0)
+        self.assertEqual(self.limiter.reserve(100), 1.0)
+        self.assertEqual(self.limiter.reserve(100), 2.0)
+        self.clock.now += 2
+        self.assertEqual(self.limiter.reserve(100), 1.0)
+
+    def test_refuses_waits_longer_than_max_wait(self):
+        self.limiter.update({'x-ratelimit-limit-tokens': '1000', 'x-ratelimit-remaining-tokens': '0',
+                             'x-ratelimit-reset-tokens': '1m'})
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            self.limiter.reserve(500)
+        self.assertAlmostEqual(raised.exception.retry_after, 30.0)
+        # The refused reservation was refunded
+        self.assertEqual(self.limiter.tokens.level, 0)
+
+    def test_pause_holds_every_caller(self):
+        self.limiter.pause(3)
+        self.assertEqual(self.limiter.reserve(1), 3)
+        self.clock.now += 3
+        self.assertEqual(self.limiter.reserve(1), 0)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=self.clock)
+
+    def open(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def test_opens_after_repeated_failures(self):
+        self.breaker.record_failure()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            self.breaker.before_call()
+        self.assertEqual(raised.exception.retry_after, 30)
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.stats(), {'state': 'closed', 'failures': 1})
+
+    def test_one_probe_after_the_cool_down(self):
+        self.open()
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, 'half_open')
+        with self.assertRaises(UpstreamUnavailable):
+            self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.before_call()
+
+    def test_failed_probe_opens_again(self):
+        self.open()
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(UpstreamUnavailable):
+            self.breaker.before_call()
+
+
+class GroqRetryTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.gateway = GroqGateway(
+            limiter=RateLimiter(max_wait=60, clock=self.clock),
+            breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30, clock=self.clock),
+            max_attempts=3, base_delay=1, max_delay=20,
+        )
+
+    def fail(self, error, attempt):
+        with self.assertLogs('analysis.upstream', 'WARNING'):
+            return self.gateway.failed(error, attempt)
+
+    def test_server_errors_back_off_then_give_up(self):
+        error = groq_error(groq.InternalServerError, 503)
+        self.assertLessEqual(self.fail(error, 1), 1)
+        self.assertLessEqual(self.fail(error, 2), 2)
+        with self.assertRaises(UpstreamUnavailable):
+            self.fail(error, 3)
+        self.assertEqual(self.gateway.breaker.failures, 3)
+
+    def test_retry_after_is_honoured(self):
+        error = groq_error(groq.InternalServerError, 503, {'retry-after': '7'})
+        self.assertEqual(self.fail(error, 1), 7)
+
+    def test_rate_limits_pause_without_tripping_the_breaker(self):
+        error = groq_error(groq.RateLimitError, 429, {'retry-after': '4'})
+        self.assertEqual(self.fail(error, 1), 0)
+        self.assertEqual(self.gateway.limiter.reserve(1), 4)
+        self.assertEqual(self.gateway.breaker.stats(), {'state': 'closed', 'failures': 0})
+
+    def test_client_errors_are_not_retried(self):
+        error = groq_error(groq.BadRequestError, 400)
+        with self.assertRaises(groq.BadRequestError):
+            self.gateway.failed(error, 1)
+        self.assertEqual(self.gateway.breaker.failures, 0)
+
+    def test_connection_errors_trip_the_breaker(self):
+        error = groq.APIConnectionError(request=httpx.Request('POST', 'https://api.groq.com'))
+        self.gateway.breaker.failure_threshold = 1
+        self.fail(error, 1)
+        with self.assertRaises(UpstreamUnavailable):
+            self.gateway.admit(100)
+
+
+class IdempotencyKeyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='lender', email='lender@example.com')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, key, phone='555'):
+        # Stream mode answers without calling the LLM
+        return self.client.post('/api/analyses/?mode=stream', {'customer_input': json.dumps(APPLICATION),
+                                                               'customer_phone': phone},
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeat_replays_the_first_response(self):
+        first = self.create('key-1')
+        with self.assertLogs('analysis.idempotency', 'INFO'):
+            second = self.create('key-1')
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual((second.status_code, second['Idempotent-Replayed']), (202, 'true'))
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(Analysis.objects.count(), 1)
+
+    def test_key_reused_for_another_request_conflicts(self):
+        self.create('key-1')
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.create('key-1', phone='556')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Analysis.objects.count(), 1)
+
+    def test_keys_are_per_user(self):
+        self.create('key-1')
+        self.client.force_authenticate(User.objects.create(username='other', email='other@example.com'))
+        self.assertNotIn('Idempotent-Replayed', self.create('key-1'))
+        self.assertEqual(Analysis.objects.count(), 2)
+
+    def test_failed_requests_free_the_key(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.create('key-1', phone='').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.create('key-1').status_code, 202)
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        self.create('')
+        self.create('')
+        self.assertEqual(Analysis.objects.count(), 2)
+
+
+class SingleFlightTests(TestCase):
+    def wait_for_waiters(self, flight, count):
+        while flight.in_flight() == 0 or flight._calls['key'].waiters < count:
+            time.sleep(0.01)
+
+    def test_concurrent_callers_share_one_call(self):
+        flight, release, calls = SingleFlight(), threading.Event(), []
+
+        def analyze():
+            calls.append(1)
+            release.wait(5)
+            return {'risk_score': 40}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', analyze))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        self.wait_for_waiters(flight, 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'risk_score': 40}] * 3)
+        # Every caller gets its own copy
+        self.assertEqual(len({id(result) for result in results}), 3)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_errors_reach_every_waiter(self):
+        flight, release = SingleFlight(), threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError('LLM down')
+
+        errors = []
+
+        def call():
+            try:
+                flight.do('key', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        self.wait_for_waiters(flight, 1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 2)
+
+    def test_async_callers_share_one_await(self):
+        flight, calls = AsyncSingleFlight(), []
+
+        async def analyze():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'risk_score': 40}
+
+        async def main():
+            return await asyncio.gather(*(flight.do('key', analyze) for _ in range(3)))
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'risk_score': 40}] * 3)
+        self.assertEqual(flight.in_flight(), 0)
+
+
+RESULT = {
+    'summary': {'overall_assessment': 'Strong application', 'key_strengths': ['Income'], 'key_concerns': []},
+    'credit_risk_analysis': {'risk_score': 35, 'approval_probability': 80, 'approval_recommendation': 'Approved'},
+    'chart_data': {'loan_amortization': [{'year': year, 'remaining_balance': 300000 - 10000 * year}
+                                         for year in range(1, 31)]},
+}
+
+
+class ResultStorageTests(TestCase):
+    def setUp(self):
+        # Dictionaries are cached per process, by id
+        self.addCleanup(storage._dictionaries.clear)
+        self.addCleanup(storage.forget_dictionaries)
+
+    def assert_round_trip(self, mode):
+        columns = storage.encode(RESULT, mode)
+        self.assertEqual(storage.decode(*columns), RESULT)
+        light = {key: value for key, value in RESULT.items() if key != 'chart_data'}
+        self.assertEqual(storage.decode_light(*columns[:2]), RESULT if mode == 'json' else light)
+        return columns
+
+    def test_json_is_stored_as_is(self):
+        self.assertEqual(self.assert_round_trip('json'), (RESULT, None, None))
+
+    def test_zlib_stores_the_charts_apart(self):
+        result_json, result_data, result_charts = self.assert_round_trip('zlib')
+        self.assertIsNone(result_json)
+        self.assertEqual(result_data[:1], b'z')
+        self.assertLess(storage.stored_size(result_json, result_data, result_charts), len(storage.dumps(RESULT)))
+
+    @unittest.skipIf(zstandard is None, 'needs the zstandard package')
+    def test_zstd_round_trip(self):
+        self.assertEqual(self.assert_round_trip('zstd')[1][:1], b's')
+
+    def test_results_without_charts_or_not_objects(self):
+        light = {'summary': RESULT['summary']}
+        self.assertEqual(storage.encode(light, 'zlib')[2], None)
+        self.assertEqual(storage.decode(*storage.encode(light, 'zlib')), light)
+        self.assertEqual(storage.encode(['not', 'an', 'object'], 'zlib'), (['not', 'an', 'object'], None, None))
+        self.assertEqual(storage.decode(None, None, None), {})
+
+    def test_blobs_name_their_dictionary(self):
+        samples = [storage.dumps(RESULT)] * 4
+        dictionary = CompressionDictionary.objects.create(
+            codec='zlib', data=storage.train_dictionary('zlib', samples, 4096), sample_count=4
+        )
+        columns = self.assert_round_trip('zlib')
+        self.assertEqual(storage.HEADER.unpack_from(columns[1]), (b'z', dictionary.id))
+
+        # Still readable after a newer dictionary replaces it for writing
+        CompressionDictionary.objects.create(codec='zlib', data=b'{"other":1}')
+        storage.forget_dictionaries()
+        self.assertEqual(storage.decode(*columns), RESULT)
+
+    def test_rows_stay_readable_across_modes(self):
+        user = User.objects.create(username='lender', email='lender@example.com')
+        with override_settings(ANALYSIS_RESULT_STORAGE='zlib'):
+            compressed = Analysis.objects.create(user=user, customer_input='{}', customer_phone='555',
+                                                 analysis_result=RESULT)
+        plain = Analysis.objects.create(user=user, customer_input='{}', customer_phone='555',
+                                        analysis_result=RESULT)
+        self.assertIsNotNone(Analysis.objects.get(pk=compressed.pk).result_data)
+        for analysis in Analysis.objects.filter(pk__in=[compressed.pk, plain.pk]):
+            self.assertEqual(analysis.analysis_result, RESULT)
+        light = Analysis.objects.defer('result_charts').get(pk=compressed.pk).light_result()
+        self.assertNotIn('chart_data', light)
+        self.assertEqual(light['credit_risk_analysis'], RESULT['credit_risk_analysis'])
@@ -0,0 +1,353 @@
+"""
+Rate-limit-aware access to the Groq chat completions API.
+
+Every completion goes through GroqGateway, which
+- paces requests with token buckets sized from Groq's `x-ratelimit-*`
+  response headers, so a burst waits locally instead of drawing 429s,
+- retries 429s, 5xx responses and connection errors with jittered
+  exponential backoff (honouring `retry-after`), and
+- opens a circuit breaker after repeated upstream failures so callers fail
+  fast while Groq is down, probing again after a cool-down.
+
+The Groq client itself is created with max_retries=0 so retries only
+happen here. Point GROQ_BASE_URL at a local stub server to exercise it.
+achat_completion is the same for async callers, on the AsyncGroq client;
+both share one limiter and breaker.
+"""
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+
+import groq
+from django.conf import settings
+
+from .clients import get_async_groq, get_groq
+from .metrics import llm_requests, timed
+
+logger = logging.getLogger(__name__)
+
+RETRIABLE_ERRORS = (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class UpstreamUnavailable(Exception):
+    """Groq cannot take the request now; retry_after says when to try again"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_duration(value):
+    """Seconds in a Groq reset header such as '7.66s', '2m59.56s' or '120ms'"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _UNITS[unit] for amount, unit in parts)
+
+
+def _header_number(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages, max_tokens):
+    """Upper bound on the tokens a request may use, ~4 characters per token"""
+    prompt = sum(len(message.get('content') or '') for message in messages)
+    return prompt // 4 + (max_tokens or 0)
+
+
+class TokenBucket:
+    """
+    A bucket refilled at the rate the provider reports.
+
+    Until the first response arrives the bucket is unbounded. Reservations may
+    push the level below zero, which makes later callers queue behind earlier
+    ones instead of racing for the same refill.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.capacity = None
+        self.level = 0.0
+        self.rate = 0.0
+        self.updated = clock()
+
+    def _refill(self, now):
+        if self.capacity is not None and self.rate > 0:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost, now):
+        """Take cost from the bucket, returns the seconds to wait before using it"""
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        self.level -= cost
+        if self.level >= 0:
+            return 0.0
+        return -self.level / self.rate if self.rate > 0 else float('inf')
+
+    def refund(self, cost):
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + min(cost, self.capacity))
+
+    def update(self, limit, remaining, reset_seconds, now):
+        """Resynchronise with the limit, remaining budget and reset time reported upstream"""
+        if limit is None or remaining is None:
+            return
+        self.capacity = limit
+        self.level = remaining
+        if reset_seconds and reset_seconds > 0:
+            # The budget is back to full after reset_seconds
+            self.rate = max(limit - remaining, 1.0) / reset_seconds
+        elif self.rate <= 0:
+            self.rate = limit / 60.0
+        self.updated = now
+
+
+class RateLimiter:
+    """Request and token buckets for one API key, shared by every thread"""
+
+    def __init__(self, max_wait=None, clock=time.monotonic, sleep=time.sleep):
+        self.max_wait = max_wait if max_wait is not None else _setting('GROQ_RATE_LIMIT_MAX_WAIT', 30.0)
+        self.clock = clock
+        self.sleep = sleep
+        self.requests = TokenBucket(clock)
+        self.tokens = TokenBucket(clock)
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, token_cost):
+        """Block until one request and token_cost tokens may be spent"""
+        wait = self.reserve(token_cost)
+        if wait > 0:
+            self.sleep(wait)
+
+    def reserve(self, token_cost):
+        """Spend one request and token_cost tokens, returns the seconds to wait first"""
+        with self._lock:
+            now = self.clock()
+            wait = max(
+                self.paused_until - now,
+                self.requests.reserve(1, now),
+                self.tokens.reserve(token_cost, now),
+            )
+            if wait > self.max_wait:
+                self.requests.refund(1)
+                self.tokens.refund(token_cost)
+                raise UpstreamUnavailable('Groq rate limit reached', retry_after=wait)
+        return wait
+
+    def update(self, headers):
+        if not headers:
+            return
+        with self._lock:
+            now = self.clock()
+            self.requests.update(
+                _header_number(headers, 'x-ratelimit-limit-requests'),
+                _header_number(headers, 'x-ratelimit-remaining-requests'),
+                parse_duration(headers.get('x-ratelimit-reset-requests')),
+                now
+            )
+            self.tokens.update(
+                _header_number(headers, 'x-ratelimit-limit-tokens'),
+                _header_number(headers, 'x-ratelimit-remaining-tokens'),
+                parse_duration(headers.get('x-ratelimit-reset-tokens')),
+                now
+            )
+
+    def pause(self, seconds):
+        """Hold every caller back, e.g. for a 429's retry-after"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open probe after a cool-down"""
+
+    def __init__(self, failure_threshold=None, reset_timeout=None, clock=time.monotonic):
+        self.failure_threshold = failure_threshold or _setting('GROQ_BREAKER_FAILURE_THRESHOLD', 5)
+        self.reset_timeout = reset_timeout or _setting('GROQ_BREAKER_RESET_TIMEOUT', 30.0)
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            remaining = self.opened_at + self.reset_timeout - self.clock()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                # Let exactly one request find out whether Groq has recovered
+                self._probing = True
+                return
+            raise UpstreamUnavailable('Groq is unavailable, circuit open', retry_after=max(remaining, 1.0))
+
+    def release(self):
+        """Give up a half-open probe slot without making the call"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = self.clock()
+
+    def stats(self):
+        return {'state': self.state, 'failures': self.failures}
+
+
+class GroqGateway:
+    """Chat completions with pacing, retries and a circuit breaker"""
+
+    def __init__(self, limiter=None, breaker=None, max_attempts=None, base_delay=None,
+                 max_delay=None, sleep=time.sleep):
+        self.limiter = limiter or RateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts or _setting('GROQ_MAX_ATTEMPTS', 4)
+        self.base_delay = base_delay or _setting('GROQ_RETRY_BASE_DELAY', 0.5)
+        self.max_delay = max_delay or _setting('GROQ_RETRY_MAX_DELAY', 20.0)
+        self.sleep = sleep
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.base_delay * (2 ** (attempt - 1)), self.max_delay)
+        # Full jitter keeps concurrent callers from retrying in lockstep
+        return random.uniform(0, delay)
+
+    def admit(self, token_cost):
+        """Pass the breaker and reserve the rate limit, returns the seconds to wait first"""
+        self.breaker.before_call()
+        try:
+            return self.limiter.reserve(token_cost)
+        except UpstreamUnavailable:
+            self.breaker.release()
+            raise
+
+    def failed(self, error, attempt):
+        """Record a failed attempt: re-raises unless it is retried, else returns the delay"""
+        llm_requests.inc(outcome=type(error).__name__)
+        if not isinstance(error, RETRIABLE_ERRORS):
+            if isinstance(error, groq.APIStatusError):
+                # A 4xx other than 429 is our request's fault, Groq itself is fine
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            raise error
+
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+        self.limiter.update(headers)
+        retry_after = parse_duration(headers.get('retry-after')) if headers else None
+        if isinstance(error, groq.RateLimitError):
+            # Rate limited, not broken: slow everyone down instead of tripping
+            self.breaker.record_success()
+            self.limiter.pause(self.backoff(attempt, retry_after))
+        else:
+            self.breaker.record_failure()
+
+        logger.warning("Groq attempt %d/%d failed: %s: %s", attempt, self.max_attempts,
+                       type(error).__name__, error, extra={'retry_after': retry_after})
+        if attempt == self.max_attempts:
+            raise UpstreamUnavailable(
+                f'Groq unavailable after {attempt} attempts: {str(error)}',
+                retry_after=retry_after or self.max_delay
+            ) from error
+        if isinstance(error, groq.RateLimitError):
+            # The limiter pause holds the next attempt back
+            return 0
+        return self.backoff(attempt, retry_after)
+
+    def succeeded(self, raw):
+        llm_requests.inc(outcome='ok')
+        self.limiter.update(raw.headers)
+        self.breaker.record_success()
+        return raw.parse()
+
+    def chat_completion(self, **kwargs):
+        """Create a chat completion, returning the parsed response (or stream)"""
+        token_cost = estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens'))
+        for attempt in range(1, self.max_attempts + 1):
+            wait = self.admit(token_cost)
+            if wait > 0:
+                self.limiter.sleep(wait)
+            try:
+                with timed('llm'):
+                    raw = get_groq().chat.completions.with_raw_response.create(**kwargs)
+            except Exception as e:
+                delay = self.failed(e, attempt)
+                if delay > 0:
+                    self.sleep(delay)
+                continue
+            return self.succeeded(raw)
+
+    async def achat_completion(self, **kwargs):
+        """chat_completion for async callers: waits and the request itself are awaited"""
+        token_cost = estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens'))
+        for attempt in range(1, self.max_attempts + 1):
+            wait = self.admit(token_cost)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                with timed('llm'):
+                    raw = await get_async_groq().chat.completions.with_raw_response.create(**kwargs)
+            except Exception as e:
+                delay = self.failed(e, attempt)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                continue
+            return self.succeeded(raw)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = GroqGateway()
+        return _gateway
+
+
+def chat_completion(**kwargs):
+    return get_gateway().chat_completion(**kwargs)
+
+
+async def achat_completion(**kwargs):
+    return await get_gateway().achat_completion(**kwargs)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import AnalysisViewSet
@@ -5,6 +6,14 @@ from .views import AnalysisViewSet
 router = DefaultRouter()
 router.register(r'analyses', AnalysisViewSet, basename='analysis')
 
+router_urls = router.urls
+if settings.ANALYSIS_ASYNC_VIEWS:
+    # Create and retrieve run on the event loop (asyncviews.py). The routes
+    # keep their place, so /analyses/bulk/ etc. still match before {pk}.
+    for pattern in router_urls:
+        if pattern.name in ('analysis-list', 'analysis-detail'):
+            pattern.callback = AnalysisViewSet.as_async_view(pattern.callback.actions)
+
 urlpatterns = [
-    path('', include(router.urls)),
+    path('', include(router_urls)),
 ]
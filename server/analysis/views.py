@@ -1,60 +1,54 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.authentication import BaseAuthentication
-from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import IsAuthenticated
-from django.contrib.auth.models import User
-from .models import Analysis
-from .serializers import AnalysisSerializer
-import os
-import json
-from supabase import create_client
-from groq import Groq
-
-# Initialize Supabase client
-supabase = create_client(
-    os.environ.get('SUPABASE_URL'),
-    os.environ.get('SUPABASE_KEY')
-)
-
-class SupabaseAuthentication(BaseAuthentication):
-    def authenticate(self, request):
-        auth_header = request.META.get('HTTP_AUTHORIZATION')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return None
-
-        token = auth_header.split(' ')[1]
-        try:
-            # Verify token with Supabase
-            response = supabase.auth.get_user(token)
-            user_data = response.user
-            
-            if not user_data:
-                raise AuthenticationFailed('Invalid token')
-
-            # Get or create Django user
-            django_user, created = User.objects.get_or_create(
-                username=user_data.email,
-                defaults={
-                    'email': user_data.email,
-                    'is_active': True
-                }
-            )
-            
-            # Store the token in the request for later use
-            request.auth = token
-            return (django_user, token)
-            
-        except Exception as e:
-            print(f'Authentication error: {str(e)}')
-            raise AuthenticationFailed('Invalid token or authentication failed')
+from rest_framework.renderers import JSONRenderer
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import router
+from django.http import FileResponse, Http404, HttpResponseNotModified, StreamingHttpResponse
+from rest_framework.generics import get_object_or_404
+from .authentication import SupabaseAuthentication
+from .models import Analysis, AnalysisJob
+from .serializers import AnalysisSerializer, AnalysisJobSerializer
+from .llm import aanalyze_loan, analyze_loan, astream_analysis, stream_analysis
+from .upstream import UpstreamUnavailable
+from .idempotency import aidempotent, idempotent
+from .log import log_payload, sample_payloads
+from .streaming import EventStreamRenderer, NDJSONRenderer, format_event, format_ndjson
+from .bulk import BulkAnalysisRun, BulkUploadParser, read_upload
+from .report import PDFRenderer, open_report, report_etag
+from .rollups import parse_day, portfolio_stats
+from .scenarios import run_scenarios
+from .export import CSVRenderer, OPTIONAL_FIELDS as EXPORT_FIELDS, AnalysisExport
+from .pagination import KeysetPagination
+from .filters import filter_analyses, parse_ordering
+from .asyncviews import AsyncViewSetMixin
+from .db import db_call, replica_reads
+from . import jobs
+import csv
+import math
+import logging
+
+logger = logging.getLogger(__name__)
 
-class AnalysisViewSet(viewsets.ModelViewSet):
+class AnalysisViewSet(AsyncViewSetMixin, viewsets.ModelViewSet):
     serializer_class = AnalysisSerializer
     authentication_classes = [SupabaseAuthentication]
     permission_classes = [IsAuthenticated]
-    
+    pagination_class = KeysetPagination
+
+    # Fields returned by list unless more are requested with ?fields=
+    LIST_FIELDS = ['id', 'user_email', 'customer_phone', 'customer_name', 'loan_amount', 'risk_score',
+                   'approval_probability', 'approval_recommendation', 'status', 'created_at', 'updated_at']
+    # Heavier fields list can return on request, with the columns each one needs
+    LIST_OPTIONAL_FIELDS = {
+        'customer_input': ['customer_input'],
+        'analysis_result': list(Analysis.RESULT_COLUMNS),
+    }
+
     def get_queryset(self):
         """Return analyses for the current user"""
         return Analysis.objects.filter(user=self.request.user)
@@ -63,220 +57,308 @@ class AnalysisViewSet(viewsets.ModelViewSet):
         """Save the analysis with the current user"""
         serializer.save(user=self.request.user)
 
+    def get_list_fields(self, request):
+        """Parse ?fields= into the output fields and the model columns to load"""
+        requested = [name.strip() for name in request.query_params.get('fields', '').split(',') if name.strip()]
+        unknown = [name for name in requested if name not in self.LIST_OPTIONAL_FIELDS and name not in self.LIST_FIELDS]
+        if unknown:
+            raise ValidationError({'fields': f'Unknown fields: {unknown}. Optional fields are {list(self.LIST_OPTIONAL_FIELDS)}'})
+
+        fields = self.LIST_FIELDS + [name for name in requested if name in self.LIST_OPTIONAL_FIELDS]
+        columns = {column for name in fields for column in self.LIST_OPTIONAL_FIELDS.get(name, [])}
+        return fields, sorted(columns)
+
+    def get_sort(self, request):
+        """The (field, descending) list order requested with ?ordering="""
+        return parse_ordering(request.query_params)
+
     def list(self, request, *args, **kwargs):
-        """List all analyses for the current user with customer info"""
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        """List a page of the current user's analyses as lightweight summaries"""
+        fields, columns = self.get_list_fields(request)
+        # Heavy JSON/text columns stay out of the SELECT unless asked for
+        queryset = filter_analyses(self.get_queryset(), request.query_params)
+        queryset = queryset.select_related('user').only(
+            'id', 'user__email', 'customer_phone', 'status', 'created_at', 'updated_at',
+            *Analysis.SUMMARY_FIELDS, *columns
+        )
+        with replica_reads(request.user):
+            page = self.paginate_queryset(queryset)
+            serializer = self.get_serializer(page, many=True, fields=fields)
+            return self.get_paginated_response(serializer.data)
 
     def retrieve(self, request, *args, **kwargs):
         """Retrieve a single analysis with customer info"""
+        with replica_reads(request.user) as on_replica:
+            try:
+                instance = self.get_object()
+                return Response(self.get_serializer(instance).data)
+            except Http404:
+                if not on_replica:
+                    raise
+        # Not on the replica yet, e.g. created by another client moments ago
         instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        return Response(self.get_serializer(instance).data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        # Only the ORM work, which runs off the event loop
+        return await db_call(self.retrieve, request, *args, **kwargs)
 
     def analyze_loan(self, customer_input):
         """Analyze loan application and return structured data"""
+        return analyze_loan(customer_input)
+
+    async def aanalyze_loan(self, customer_input):
+        return await aanalyze_loan(customer_input)
+
+    def get_create_mode(self, request):
+        """
+        How create runs the analysis: 'sync' (inline), 'async' (worker pool) or
+        'stream' (deferred until the client opens the stream endpoint)
+        """
+        mode = request.query_params.get('mode')
+        if mode in ('async', 'sync', 'stream'):
+            return mode
+        return 'async' if getattr(settings, 'ANALYSIS_JOB_MODE', False) else 'sync'
+
+    @action(detail=True, methods=['get'])
+    def job(self, request, pk=None):
+        """Return the background job state, optionally waiting for it to finish"""
+        analysis = self.get_object()
         try:
-            print("\n=== Starting loan analysis ===")
-            print(f"Customer input: {customer_input}")
-            
-            groq_api_key = os.environ.get('GROQ_API_KEY')
-            if not groq_api_key:
-                raise ValueError("GROQ_API_KEY not found in environment variables")
-            print("Found GROQ_API_KEY in environment")
-
-            from groq import Groq
-            client = Groq(api_key=groq_api_key)
-
-            # Structured prompt to get detailed JSON response
-            system_prompt = """You are an expert loan analysis system. Analyze the provided loan application data and return a detailed JSON response.
-            You must ONLY return a valid JSON object matching this exact structure (do not include comments in output):
-
-            {
-              "summary": {
-                "overall_assessment": "A detailed paragraph summarizing the loan application analysis in human-friendly terms",
-                "key_strengths": [
-                  "List of 2-3 key positive factors"
-                ],
-                "key_concerns": [
-                  "List of 2-3 key risk factors or concerns"
-                ],
-                "recommendations": [
-                  "List of 3-4 actionable recommendations for the applicant"
-                ]
-              },
-              "credit_risk_analysis": {
-                "risk_score": (number 0-100),
-                "risk_factors": [(list of risk factor strings)],
-                "approval_probability": (number 0-100),
-                "approval_recommendation": ("Approved", "Denied", or "Manual Review")
-              },
-              "financial_metrics": {
-                "debt_to_income_ratio": (calculated as total monthly debt / monthly income * 100),
-                "loan_to_value_ratio": (calculated as loan amount / property value * 100),
-                "credit_utilization": (from input or calculate),
-                "savings_rate": (from input or calculate as monthly_savings / monthly_income * 100),
-                "monthly_savings": (from input),
-                "net_worth": (total_assets - total_liabilities),
-                "total_assets": (from input),
-                "total_liabilities": (from input)
-              },
-              "loan_metrics": {
-                "monthly_payment": (calculated using loan amount, term, and interest rate),
-                "total_interest_paid": (calculated over full loan term),
-                "break_even_years": (calculated based on property appreciation),
-                "early_payment_savings": (potential savings with 20% extra monthly payment)
-              },
-              "property_analysis": {
-                "property_value_growth_5yr": (from input),
-                "market_risk": ("Low", "Moderate", or "High", based on location and market factors),
-                "property_tax_rate": (from input)
-              },
-              "economic_factors": {
-                "economic_conditions_risk": ("Low", "Moderate", or "High"),
-                "inflation_rate": (current rate from input),
-                "interest_rate_trend": ("Increasing", "Stable", or "Decreasing")
-              },
-              "chart_data": {
-                "debt_breakdown": {
-                  "Car Loan": (monthly car payment),
-                  "Mortgage": (calculated monthly mortgage),
-                  "Credit Cards": (monthly credit card payments)
-                },
-                "income_vs_expenses": {
-                  "Income": (monthly income),
-                  "Expenses": (estimated monthly expenses),
-                  "Savings": (monthly savings)
-                },
-                "net_worth_composition": {
-                  "Assets": (total assets),
-                  "Liabilities": (total liabilities)
-                },
-                "loan_amortization": [
-                  {
-                    "year": 1,
-                    "principal_paid": (first year principal),
-                    "interest_paid": (first year interest),
-                    "remaining_balance": (end of year 1 balance)
-                  },
-                  {
-                    "year": 5,
-                    "principal_paid": (cumulative 5 year principal),
-                    "interest_paid": (cumulative 5 year interest),
-                    "remaining_balance": (end of year 5 balance)
-                  },
-                  {
-                    "year": 10,
-                    "principal_paid": (cumulative 10 year principal),
-                    "interest_paid": (cumulative 10 year interest),
-                    "remaining_balance": (end of year 10 balance)
-                  }
-                ]
-              }
-            }
-
-            Make the overall_assessment engaging and easy to understand, focusing on:
-            1. The applicant's financial health
-            2. The loan's affordability
-            3. Property and market conditions
-            4. Final verdict on the loan
-
-            Recommendations should be specific and actionable, such as:
-            - Ways to improve approval chances
-            - Suggestions for better loan terms
-            - Financial management advice
-            - Property-related considerations
-
-            Calculate all metrics based on standard financial formulas:
-            1. Monthly mortgage payment = P * (r * (1 + r)^n) / ((1 + r)^n - 1)
-               where P = principal, r = monthly interest rate, n = total months
-            2. DTI = Total Monthly Debt Payments / Monthly Income
-            3. LTV = Loan Amount / Property Value
-            4. Use market standards for risk assessment
-            
-            Return ONLY the JSON object, no other text or explanation."""
+            job = analysis.job
+        except AnalysisJob.DoesNotExist:
+            return Response({'error': 'No background job for this analysis'}, status=404)
 
-            user_prompt = f"""Please analyze this loan application and return ONLY a JSON response matching the specified format:
+        try:
+            wait = min(float(request.query_params.get('wait', 0)), settings.ANALYSIS_JOB_MAX_WAIT)
+        except ValueError:
+            return Response({'error': 'wait must be a number of seconds'}, status=400)
+        if wait > 0:
+            job = jobs.wait_for(job, wait)
 
-Customer Information:
-{customer_input}
+        return Response(AnalysisJobSerializer(job).data)
 
-Remember: Return ONLY the JSON object, no other text."""
+    @action(detail=True, methods=['get'], renderer_classes=[JSONRenderer, EventStreamRenderer])
+    def stream(self, request, pk=None):
+        """Stream the analysis result section by section as Server-Sent Events"""
+        analysis = self.get_object()
+        # Under ASGI a sync iterator would be read whole before sending
+        asynchronous = isinstance(request._request, ASGIRequest)
+        response = StreamingHttpResponse(
+            self.astream_events(analysis) if asynchronous else self.stream_events(analysis),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering events
+        return response
 
-            print("\n=== Sending request to Groq API ===")
-            try:
-                completion = client.chat.completions.create(
-                    model="llama-3.3-70b-versatile",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.1,
-                    max_tokens=2048,
-                    top_p=1,
-                    stream=False
-                )
-                print("Completion object:", completion)
-                
-                if not completion.choices:
-                    raise ValueError("No choices in completion response")
-                
-                response_text = completion.choices[0].message.content.strip()
-                print("\n=== Raw Response ===")
-                print(response_text)
-                
-                # Try to find JSON in the response
-                try:
-                    # First try direct JSON parsing
-                    analysis_json = json.loads(response_text)
-                except json.JSONDecodeError:
-                    print("Direct JSON parsing failed, trying to extract JSON")
-                    # Try to extract JSON if there's any extra text
-                    import re
-                    json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                    if json_match:
-                        try:
-                            analysis_json = json.loads(json_match.group())
-                        except json.JSONDecodeError as e:
-                            print(f"Failed to parse extracted JSON: {e}")
-                            raise
-                    else:
-                        raise ValueError("No JSON object found in response")
-
-                print("\n=== Parsed JSON ===")
-                print(json.dumps(analysis_json, indent=2))
-
-                # Validate required top-level fields
-                required_fields = [
-                    'summary',
-                    'credit_risk_analysis',
-                    'financial_metrics',
-                    'loan_metrics',
-                    'property_analysis',
-                    'economic_factors',
-                    'chart_data'
-                ]
-                
-                missing_fields = [field for field in required_fields if field not in analysis_json]
-                if missing_fields:
-                    raise ValueError(f"Missing required fields in analysis: {', '.join(missing_fields)}")
-
-                return analysis_json
-
-            except Exception as api_error:
-                print(f"\n=== API Error ===")
-                print(f"Error type: {type(api_error)}")
-                print(f"Error message: {str(api_error)}")
-                raise ValueError(f"Groq API error: {str(api_error)}")
+    @action(detail=True, methods=['get'], renderer_classes=[JSONRenderer, PDFRenderer])
+    def report(self, request, pk=None):
+        """Download the analysis as a PDF, rendered once per version of the analysis"""
+        # The heavy columns are only read when the report has to be rendered
+        queryset = self.get_queryset().defer('customer_input', *Analysis.RESULT_COLUMNS)
+        analysis = get_object_or_404(queryset, pk=pk)
+
+        etag = report_etag(analysis)
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(
+                open_report(analysis),
+                content_type='application/pdf',
+                as_attachment=True,
+                filename=f'loan-analysis-report-{analysis.id}.pdf'
+            )
+        response['ETag'] = etag
+        # Browsers keep the file but check the ETag before reusing it
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @action(detail=True, methods=['post'])
+    def scenarios(self, request, pk=None):
+        """Evaluate a grid of rate/term/principal/extra payment variants of the loan locally"""
+        queryset = self.get_queryset().only('id', 'user_id', 'customer_input')
+        analysis = get_object_or_404(queryset, pk=pk)
+        return Response(run_scenarios(analysis.customer_input, request.data))
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Portfolio figures per day or week (?period=), read from the rollup table"""
+        params = request.query_params
+        since = parse_day('created_after', params['created_after']) if params.get('created_after') else None
+        until = parse_day('created_before', params['created_before']) if params.get('created_before') else None
+        with replica_reads(request.user):
+            return Response(portfolio_stats(request.user, params.get('period', 'day'), since, until))
+
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """Stream all of the user's analyses as CSV or NDJSON (?format=csv|ndjson)"""
+        fields = [name.strip() for name in request.query_params.get('fields', '').split(',') if name.strip()]
+        unknown = [name for name in fields if name not in EXPORT_FIELDS]
+        if unknown:
+            raise ValidationError({'fields': f'Unknown fields: {unknown}. Optional fields are {list(EXPORT_FIELDS)}'})
+
+        queryset = filter_analyses(self.get_queryset(), request.query_params)
+        # A full dump can come from a replica, unless the user has just written
+        with replica_reads(request.user):
+            queryset = queryset.using(router.db_for_read(Analysis))
+
+        export = AnalysisExport(
+            queryset,
+            request.accepted_renderer.format,
+            fields,
+            compress=request.query_params.get('gzip', '').lower() in ('1', 'true')
+        )
+        # Under ASGI a sync iterator would be read whole before sending
+        asynchronous = isinstance(request._request, ASGIRequest)
+        response = StreamingHttpResponse(
+            export.achunks() if asynchronous else export.chunks(),
+            content_type=export.content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export.filename}"'
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def stream_events(self, analysis):
+        """Generate SSE events for an analysis, running it if nobody has yet"""
+        worker_name = self.stream_worker_name()
+        # Only the connection that claims the analysis calls the LLM
+        claimed = jobs.claim(analysis, worker_name) if self.needs_run(analysis) else None
+        job = claimed or AnalysisJob.objects.filter(analysis=analysis).first()
+        waited = False
+        while claimed is None and job is not None and not job.is_finished:
+            # Another connection or a worker owns this analysis, report progress until it is done
+            yield format_event('job', AnalysisJobSerializer(job).data)
+            job = jobs.wait_for(job, 10)
+            waited = True
+            if not job.is_finished:
+                # Takes over once the owner's lease has expired, e.g. it died
+                claimed = jobs.claim(analysis, worker_name)
+
+        if claimed is not None:
+            yield from self.run_stream(analysis, claimed)
+            return
+        if waited:
+            analysis.refresh_from_db()
+        yield from self.result_events(analysis, job)
+
+    async def astream_events(self, analysis):
+        """stream_events for ASGI: ORM work goes through db_call, the LLM stream is awaited"""
+        worker_name = self.stream_worker_name()
+        claimed = await db_call(jobs.claim, analysis, worker_name) if self.needs_run(analysis) else None
+        job = claimed or await db_call(AnalysisJob.objects.filter(analysis=analysis).first)
+        waited = False
+        while claimed is None and job is not None and not job.is_finished:
+            yield format_event('job', AnalysisJobSerializer(job).data)
+            job = await jobs.await_for(job, 10)
+            waited = True
+            if not job.is_finished:
+                claimed = await db_call(jobs.claim, analysis, worker_name)
+
+        if claimed is not None:
+            async for event in self.arun_stream(analysis, claimed):
+                yield event
+            return
+        if waited:
+            await db_call(analysis.refresh_from_db)
+        for event in self.result_events(analysis, job):
+            yield event
+
+    @staticmethod
+    def needs_run(analysis):
+        result = analysis.analysis_result
+        return not result or 'error' in result
+
+    @staticmethod
+    def stream_worker_name():
+        return f'stream:{jobs.get_pool().name}'
+
+    def result_events(self, analysis, job):
+        """Replay a finished analysis, or report why it has no result"""
+        result = analysis.analysis_result
+        if result and 'error' not in result:
+            for section, value in result.items():
+                yield format_event('section', {'section': section, 'data': value})
+            yield format_event('done', {'id': analysis.id})
+            return
+
+        detail = result.get('error') if result else (job.error if job is not None else None)
+        yield format_event('error', {'error': 'Failed to analyze loan application', 'detail': detail})
+
+    def finish_stream(self, analysis, job, analysis_result, error=''):
+        analysis.save_result(analysis_result)
+        jobs.finish(job, error)
 
+    def run_stream(self, analysis, job):
+        """Run a claimed analysis, yielding each section as the LLM completes it"""
+        analysis_result = {}
+        finished = False
+        try:
+            for section, value in stream_analysis(analysis.customer_input):
+                analysis_result[section] = value
+                yield format_event('section', {'section': section, 'data': value})
+            self.finish_stream(analysis, job, analysis_result)
+            finished = True
+        except Exception as e:
+            logger.warning("Stream analysis error: %s", e)
+            self.finish_stream(analysis, job, {'error': str(e)}, str(e))
+            finished = True
+            yield format_event('error', {'error': 'Failed to analyze loan application', 'detail': str(e)})
+            return
+        finally:
+            if not finished:
+                # The client went away mid-stream, the worker pool finishes the analysis
+                jobs.release(job)
+
+        yield format_event('done', {'id': analysis.id})
+
+    async def arun_stream(self, analysis, job):
+        """run_stream reading the LLM stream from the async Groq client"""
+        analysis_result = {}
+        finished = False
+        try:
+            async for section, value in astream_analysis(analysis.customer_input):
+                analysis_result[section] = value
+                yield format_event('section', {'section': section, 'data': value})
+            await db_call(self.finish_stream, analysis, job, analysis_result)
+            finished = True
         except Exception as e:
-            print(f"\n=== Analysis Error ===")
-            print(f"Error type: {type(e)}")
-            print(f"Error message: {str(e)}")
-            import traceback
-            print("Traceback:", traceback.format_exc())
-            raise ValueError(f"Failed to analyze loan application: {str(e)}")
+            logger.warning("Stream analysis error: %s", e)
+            await db_call(self.finish_stream, analysis, job, {'error': str(e)}, str(e))
+            finished = True
+            yield format_event('error', {'error': 'Failed to analyze loan application', 'detail': str(e)})
+            return
+        finally:
+            if not finished:
+                await db_call(jobs.release, job)
+
+        yield format_event('done', {'id': analysis.id})
+
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, JSONParser, BulkUploadParser],
+            renderer_classes=[JSONRenderer, NDJSONRenderer])
+    def bulk(self, request):
+        """Analyse a JSONL or CSV batch of applications, streaming NDJSON progress"""
+        try:
+            concurrency = request.query_params.get('concurrency')
+            concurrency = int(concurrency) if concurrency else None
+        except ValueError:
+            return Response({'error': 'concurrency must be an integer'}, status=400)
+
+        try:
+            content, kind = read_upload(request)
+            run = BulkAnalysisRun(request.user, content, kind, concurrency)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return Response({'error': 'Invalid upload', 'detail': str(e)}, status=400)
+
+        if isinstance(request._request, ASGIRequest):
+            events = (format_ndjson(event) async for event in run.aevents())
+        else:
+            events = (format_ndjson(event) for event in run.events())
+        response = StreamingHttpResponse(events, content_type='application/x-ndjson')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
@@ -293,7 +375,7 @@ Remember: Return ONLY the JSON object, no other text."""
                 )
             
             analysis.status = new_status
-            analysis.save()
+            analysis.save(update_fields=['status', 'updated_at'])
             
             serializer = self.get_serializer(analysis)
             return Response(serializer.data)
@@ -305,57 +387,125 @@ Remember: Return ONLY the JSON object, no other text."""
             )
 
     def create(self, request, *args, **kwargs):
+        """Create and analyse an application, once per Idempotency-Key when one is sent"""
+        return idempotent(request, lambda: self.create_analysis(request))
+
+    async def acreate(self, request, *args, **kwargs):
+        """create for async deployments: the Groq call is awaited on the event loop"""
+        return await aidempotent(request, lambda: self.acreate_analysis(request))
+
+    def create_analysis(self, request):
         try:
-            # Print request data for debugging
-            print("Request data:", request.data)
-            
-            # Validate required fields
-            if not request.data:
-                return Response({'error': 'No data provided'}, status=400)
-                
-            customer_input = request.data.get('customer_input', request.data.get('customerInput', ''))
-            customer_phone = request.data.get('customer_phone', request.data.get('customerPhone', ''))
-            
-            if not customer_input or not customer_phone:
-                return Response({
-                    'error': 'Missing required fields',
-                    'required': ['customer_input/customerInput', 'customer_phone/customerPhone'],
-                    'received': request.data
-                }, status=400)
-
-            # Create analysis object
-            analysis = Analysis.objects.create(
-                user=request.user,
-                customer_phone=customer_phone,
-                customer_input=customer_input,
-                analysis_result={}  # Initialize with empty dict
-            )
+            analysis, response = self.start_analysis(request)
+            if response is not None:
+                return response
 
             try:
-                # Get analysis result
-                analysis_result = self.analyze_loan(customer_input)
-                
-                # Store analysis result
-                analysis.analysis_result = analysis_result
-                analysis.save()
+                analysis_result = self.analyze_loan(analysis.customer_input)
+                return self.finish_analysis(analysis, analysis_result)
+            except Exception as e:
+                return self.fail_analysis(analysis, e)
+
+        except Exception as e:
+            return self.create_failed(e)
 
-                # Return the complete analysis object with the result
-                serializer = self.get_serializer(analysis)
-                return Response(serializer.data, status=201)
+    async def acreate_analysis(self, request):
+        try:
+            analysis, response = await db_call(self.start_analysis, request)
+            if response is not None:
+                return response
 
+            try:
+                analysis_result = await self.aanalyze_loan(analysis.customer_input)
+                return await db_call(self.finish_analysis, analysis, analysis_result)
             except Exception as e:
-                print(f"Analysis error: {str(e)}")
-                # If analysis fails, update status and return error
-                analysis.analysis_result = {'error': str(e)}
-                analysis.save()
-                return Response({
-                    'error': 'Failed to analyze loan application',
-                    'detail': str(e)
-                }, status=400)
+                return await db_call(self.fail_analysis, analysis, e)
 
         except Exception as e:
-            print(f"Create error: {str(e)}")
-            return Response({
-                'error': 'Failed to create analysis',
-                'detail': str(e)
+            return self.create_failed(e)
+
+    def start_analysis(self, request):
+        """
+        Validate the request and create its Analysis row.
+
+        Returns (analysis, None) when the analysis should run now, or
+        (None, response) when the request is answered without it.
+        """
+        log_payload(logger, "Request data", request.data, sample_payloads())
+
+        # Validate required fields
+        if not request.data:
+            return None, Response({'error': 'No data provided'}, status=400)
+
+        customer_input = request.data.get('customer_input', request.data.get('customerInput', ''))
+        customer_phone = request.data.get('customer_phone', request.data.get('customerPhone', ''))
+        if not customer_input or not customer_phone:
+            return None, Response({
+                'error': 'Missing required fields',
+                'required': ['customer_input/customerInput', 'customer_phone/customerPhone'],
+                'received': request.data
             }, status=400)
+
+        # Create analysis object
+        analysis = Analysis.objects.create(
+            user=request.user,
+            customer_phone=customer_phone,
+            customer_input=customer_input,
+            analysis_result={}  # Initialize with empty dict
+        )
+
+        mode = self.get_create_mode(request)
+        if mode == 'stream':
+            # The analysis runs when the client connects to the stream endpoint
+            data = self.get_serializer(analysis).data
+            return None, Response(
+                data,
+                status=202,
+                headers={'Location': f"{request.build_absolute_uri(request.path)}{analysis.id}/stream/"}
+            )
+
+        if mode == 'async':
+            # Hand the analysis to the worker pool and return straight away
+            job = jobs.enqueue(analysis)
+            data = self.get_serializer(analysis).data
+            data['job'] = AnalysisJobSerializer(job).data
+            return None, Response(
+                data,
+                status=202,
+                headers={'Location': f"{request.build_absolute_uri(request.path)}{analysis.id}/job/"}
+            )
+
+        return analysis, None
+
+    def finish_analysis(self, analysis, analysis_result):
+        # Store analysis result
+        analysis.save_result(analysis_result)
+
+        # Return the complete analysis object with the result
+        serializer = self.get_serializer(analysis)
+        return Response(serializer.data, status=201)
+
+    def fail_analysis(self, analysis, error):
+        if isinstance(error, UpstreamUnavailable):
+            logger.warning("Analysis %s deferred, Groq unavailable: %s", analysis.id, error)
+            analysis.save_result({'error': str(error)})
+            # Tell the client when to retry rather than having it resubmit at once
+            return Response({
+                'error': 'Analysis service is temporarily unavailable',
+                'detail': str(error)
+            }, status=503, headers={'Retry-After': str(math.ceil(error.retry_after or 1))})
+
+        logger.warning("Analysis %s failed: %s", analysis.id, error)
+        # If analysis fails, update status and return error
+        analysis.save_result({'error': str(error)})
+        return Response({
+            'error': 'Failed to analyze loan application',
+            'detail': str(error)
+        }, status=400)
+
+    def create_failed(self, error):
+        logger.exception("Create error")
+        return Response({
+            'error': 'Failed to create analysis',
+            'detail': str(error)
+        }, status=400)
@@ -0,0 +1,7 @@
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+# Served over ASGI, create and retrieve use the async views
+os.environ.setdefault('ANALYSIS_ASYNC_VIEWS', 'True')
+application = get_asgi_application()
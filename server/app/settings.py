@@ -65,13 +65,65 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'app.wsgi.application'
+ASGI_APPLICATION = 'app.asgi:application'
+# Serve create and retrieve from async views (analysis/asyncviews.py), so a
+# request waiting on Groq holds no thread. app/asgi.py turns this on; under
+# WSGI each async view would run on its own event loop, so leave it off there.
+ANALYSIS_ASYNC_VIEWS = os.environ.get('ANALYSIS_ASYNC_VIEWS', 'False') == 'True'
 
 # Database
-# Using local SQLite for Django models while using Supabase for data storage
-DATABASES = {
-    'default': {
+# Using local SQLite for Django models while using Supabase for data storage.
+# DB_ENGINE=postgresql with the POSTGRES_* variables uses Postgres instead
+# (needs psycopg or psycopg2).
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+# Seconds a connection is kept open and reused across requests; it is
+# health-checked before reuse. 0 closes it at the end of every request.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+# SQLite: seconds a writer waits for the file lock before "database is locked",
+# and the journal/synchronous modes set on each connection (analysis/db.py)
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', '20'))
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+
+if DB_ENGINE == 'postgresql':
+    _primary_database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'lendsure'),
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+else:
+    _primary_database = {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {'timeout': SQLITE_BUSY_TIMEOUT},
+    }
+_primary_database.update(CONN_MAX_AGE=DB_CONN_MAX_AGE, CONN_HEALTH_CHECKS=True)
+DATABASES = {'default': _primary_database}
+
+# Read replicas, comma separated: Postgres host[:port]s, or SQLite file paths
+# (the primary's own file works too: under WAL its readers do not wait for
+# the writer). List and retrieve read from them; everything else, and any
+# user who wrote in the last DB_REPLICA_PIN_SECONDS, uses the primary.
+for _index, _replica in enumerate(filter(None, (
+        entry.strip() for entry in os.environ.get('DB_REPLICAS', '').split(','))), start=1):
+    if DB_ENGINE == 'postgresql':
+        _host, _, _port = _replica.partition(':')
+        _location = {'HOST': _host, 'PORT': _port or _primary_database['PORT']}
+    else:
+        _location = {'NAME': _replica}
+    DATABASES[f'replica{_index}'] = {**_primary_database, **_location, 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['analysis.db.PrimaryReplicaRouter']
+DB_REPLICA_PIN_SECONDS = float(os.environ.get('DB_REPLICA_PIN_SECONDS', '5'))
+
+# Cache shared by every worker process, it holds the read-your-writes pins
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', BASE_DIR / 'django_cache'),
     }
 }
 
@@ -79,6 +131,27 @@ DATABASES = {
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
 
+# Groq configuration
+# Clients are created on first use (see analysis/clients.py) and share one
+# keep-alive connection pool across threads.
+GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
+GROQ_BASE_URL = os.environ.get('GROQ_BASE_URL')  # e.g. a local stand-in server
+GROQ_TIMEOUT = float(os.environ.get('GROQ_TIMEOUT', '60'))
+GROQ_MAX_CONNECTIONS = int(os.environ.get('GROQ_MAX_CONNECTIONS', '100'))
+GROQ_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('GROQ_MAX_KEEPALIVE_CONNECTIONS', '20'))
+GROQ_KEEPALIVE_EXPIRY = float(os.environ.get('GROQ_KEEPALIVE_EXPIRY', '30'))
+# Outbound pacing, retries and circuit breaker (analysis/upstream.py).
+# Requests are paced from Groq's x-ratelimit-* headers; a caller that would
+# have to wait longer than GROQ_RATE_LIMIT_MAX_WAIT seconds fails fast instead.
+GROQ_MAX_ATTEMPTS = int(os.environ.get('GROQ_MAX_ATTEMPTS', '4'))
+GROQ_RETRY_BASE_DELAY = float(os.environ.get('GROQ_RETRY_BASE_DELAY', '0.5'))
+GROQ_RETRY_MAX_DELAY = float(os.environ.get('GROQ_RETRY_MAX_DELAY', '20'))
+GROQ_RATE_LIMIT_MAX_WAIT = float(os.environ.get('GROQ_RATE_LIMIT_MAX_WAIT', '30'))
+# Consecutive upstream failures before the circuit opens, and how long it
+# stays open before a single probe request is let through
+GROQ_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('GROQ_BREAKER_FAILURE_THRESHOLD', '5'))
+GROQ_BREAKER_RESET_TIMEOUT = float(os.environ.get('GROQ_BREAKER_RESET_TIMEOUT', '30'))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -123,3 +196,132 @@ REST_FRAMEWORK = {
 
 # Add 'rest_framework.authtoken' to INSTALLED_APPS
 INSTALLED_APPS += ['rest_framework.authtoken']
+
+# Background analysis jobs
+# When ANALYSIS_JOB_MODE is on, POST /api/analyses/ returns 202 and the analysis
+# is run by the worker pool. Clients can also opt in per request with ?mode=async.
+ANALYSIS_JOB_MODE = os.environ.get('ANALYSIS_JOB_MODE', 'False') == 'True'
+# Run the worker pool inside the web process. Turn this off when running
+# `python manage.py run_analysis_workers` as a separate process.
+ANALYSIS_JOB_EMBEDDED_WORKERS = os.environ.get('ANALYSIS_JOB_EMBEDDED_WORKERS', 'True') == 'True'
+ANALYSIS_JOB_WORKERS = int(os.environ.get('ANALYSIS_JOB_WORKERS', '4'))
+ANALYSIS_JOB_POLL_INTERVAL = float(os.environ.get('ANALYSIS_JOB_POLL_INTERVAL', '2.0'))
+ANALYSIS_JOB_LEASE_TIMEOUT = int(os.environ.get('ANALYSIS_JOB_LEASE_TIMEOUT', '300'))
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_JOB_MAX_ATTEMPTS', '1'))
+# Upper bound for GET /api/analyses/{id}/job/?wait=<seconds> long polling
+ANALYSIS_JOB_MAX_WAIT = float(os.environ.get('ANALYSIS_JOB_MAX_WAIT', '30'))
+
+# Bulk analysis (POST /api/analyses/bulk/)
+# Rows are analysed ANALYSIS_BULK_CONCURRENCY at a time unless the request asks
+# for a different ?concurrency=, which is capped at ANALYSIS_BULK_MAX_CONCURRENCY.
+# Keep the cap at or below what the Groq rate limit allows.
+ANALYSIS_BULK_CONCURRENCY = int(os.environ.get('ANALYSIS_BULK_CONCURRENCY', '4'))
+ANALYSIS_BULK_MAX_CONCURRENCY = int(os.environ.get('ANALYSIS_BULK_MAX_CONCURRENCY', '16'))
+ANALYSIS_BULK_MAX_ROWS = int(os.environ.get('ANALYSIS_BULK_MAX_ROWS', '1000'))
+
+# Analysis result cache
+# Identical customer_input (for the same model and prompt version) is answered
+# from a local SQLite file instead of another LLM call.
+ANALYSIS_CACHE_ENABLED = os.environ.get('ANALYSIS_CACHE_ENABLED', 'True') == 'True'
+ANALYSIS_CACHE_PATH = os.environ.get('ANALYSIS_CACHE_PATH', BASE_DIR / 'analysis_cache.sqlite3')
+ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', str(24 * 60 * 60)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', '1000'))
+
+# Idempotent create (Idempotency-Key header on POST /api/analyses/)
+# A repeated key replays the stored response for IDEMPOTENCY_KEY_TTL seconds.
+# A repeat that arrives while the first request is still running waits up to
+# IDEMPOTENCY_WAIT seconds for its response before getting a 409. A key still
+# in progress after IDEMPOTENCY_LOCK_TIMEOUT is treated as abandoned.
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', str(24 * 60 * 60)))
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', '30'))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', '300'))
+
+# Analysis result storage (analysis/storage.py)
+# 'json' stores analysis_result as plain JSON. 'zlib' or 'zstd' (needs the
+# zstandard package) stores it compressed, with chart_data in its own column
+# that is only read when the full result is. Convert existing rows, and
+# optionally train a compression dictionary, with
+# `python manage.py compact_analysis_results`.
+ANALYSIS_RESULT_STORAGE = os.environ.get('ANALYSIS_RESULT_STORAGE', 'json')
+
+# PDF reports (GET /api/analyses/{id}/report/)
+# Rendered reports are cached on disk per analysis version; the least recently
+# written are removed beyond ANALYSIS_REPORT_CACHE_MAX_FILES.
+ANALYSIS_REPORT_CACHE_DIR = os.environ.get('ANALYSIS_REPORT_CACHE_DIR', BASE_DIR / 'report_cache')
+ANALYSIS_REPORT_CACHE_MAX_FILES = int(os.environ.get('ANALYSIS_REPORT_CACHE_MAX_FILES', '1000'))
+
+# Rows read per query by GET /api/analyses/export/ (analysis/export.py)
+ANALYSIS_EXPORT_BATCH_SIZE = int(os.environ.get('ANALYSIS_EXPORT_BATCH_SIZE', '500'))
+
+# Supabase token verification
+# HS256 tokens are checked locally with the project's JWT secret (Project
+# Settings -> API -> JWT Secret), asymmetric ones against the cached JWKS.
+# Without either, tokens fall back to a remote supabase.auth.get_user call.
+SUPABASE_JWT_SECRET = os.environ.get('SUPABASE_JWT_SECRET')
+SUPABASE_JWT_AUDIENCE = os.environ.get('SUPABASE_JWT_AUDIENCE', 'authenticated')
+SUPABASE_JWKS_CACHE_TTL = int(os.environ.get('SUPABASE_JWKS_CACHE_TTL', '600'))
+# Verified token -> user mappings, bounded in size and never kept past token expiry
+SUPABASE_AUTH_CACHE_SIZE = int(os.environ.get('SUPABASE_AUTH_CACHE_SIZE', '10000'))
+SUPABASE_AUTH_CACHE_TTL = int(os.environ.get('SUPABASE_AUTH_CACHE_TTL', '300'))
+
+# Supabase mirror
+# Analysis changes are written to an outbox table and mirrored to Supabase by
+# a background worker. Set SUPABASE_SYNC_EMBEDDED=False when running
+# `python manage.py sync_supabase` as a separate process instead.
+SUPABASE_SYNC_EMBEDDED = os.environ.get('SUPABASE_SYNC_EMBEDDED', 'True') == 'True'
+SUPABASE_SYNC_BATCH_SIZE = int(os.environ.get('SUPABASE_SYNC_BATCH_SIZE', '100'))
+# Seconds to let further changes accumulate into a batch after a wake-up
+SUPABASE_SYNC_INTERVAL = float(os.environ.get('SUPABASE_SYNC_INTERVAL', '1.0'))
+SUPABASE_SYNC_POLL_INTERVAL = float(os.environ.get('SUPABASE_SYNC_POLL_INTERVAL', '5.0'))
+SUPABASE_SYNC_BASE_BACKOFF = float(os.environ.get('SUPABASE_SYNC_BASE_BACKOFF', '2.0'))
+SUPABASE_SYNC_MAX_BACKOFF = float(os.environ.get('SUPABASE_SYNC_MAX_BACKOFF', '300.0'))
+
+# Logging
+# LOG_FORMAT=json writes one JSON object per line; use 'text' for local reading.
+# Large payloads (request bodies, raw model output) are only logged at DEBUG,
+# for a LOG_PAYLOAD_SAMPLE_RATE fraction of analyses, cut to LOG_PAYLOAD_MAX_CHARS.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get('LOG_PAYLOAD_MAX_CHARS', '2000'))
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'analysis.log.JSONFormatter'},
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': LOG_FORMAT,
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'analysis': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
+# Metrics
+# GET /metrics serves Prometheus text format. When METRICS_TOKEN is set,
+# scrapers must send `Authorization: Bearer <METRICS_TOKEN>`.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Local scoring tier (analysis/scoring.py)
+# Applications whose local approval probability (0-100) is at or above
+# ANALYSIS_LOCAL_APPROVE_ABOVE or at or below ANALYSIS_LOCAL_DENY_BELOW are
+# decided without an LLM call; the band between them goes to the LLM.
+ANALYSIS_LOCAL_SCORING = os.environ.get('ANALYSIS_LOCAL_SCORING', 'True') == 'True'
+ANALYSIS_LOCAL_APPROVE_ABOVE = float(os.environ.get('ANALYSIS_LOCAL_APPROVE_ABOVE', '80'))
+ANALYSIS_LOCAL_DENY_BELOW = float(os.environ.get('ANALYSIS_LOCAL_DENY_BELOW', '25'))
+
+# Largest grid POST /api/analyses/{id}/scenarios/ evaluates in one request
+ANALYSIS_SCENARIO_MAX_POINTS = int(os.environ.get('ANALYSIS_SCENARIO_MAX_POINTS', '10000'))
@@ -0,0 +1,253 @@
+"""
+Local stand-ins for the Groq chat completions API and the Supabase REST/auth
+APIs, with configurable latency and error rates.
+
+They answer just enough of each protocol for the server's clients: Groq
+completions (plain and streamed, with usage and x-ratelimit-* headers),
+PostgREST insert/update on /rest/v1/<table> and /auth/v1/user.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NARRATIVE = {
+    'summary': {
+        'overall_assessment': 'The applicant shows stable income and moderate leverage.',
+        'key_strengths': ['Consistent savings', 'Good credit history'],
+        'key_concerns': ['Debt-to-income above 30%'],
+        'recommendations': ['Verify employment history'],
+    },
+    'credit_risk_analysis': {
+        'risk_score': 34,
+        'risk_factors': ['Existing car loan'],
+        'approval_probability': 76,
+        'approval_recommendation': 'Approved',
+    },
+    'property_analysis': {'property_value_growth_5yr': 18, 'market_risk': 'Low', 'property_tax_rate': 1.2},
+    'economic_factors': {'economic_conditions_risk': 'Moderate', 'inflation_rate': 3.1, 'interest_rate_trend': 'Stable'},
+}
+
+
+class FaultProfile:
+    """Latency and error injection shared by the handlers of one fake server"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            extra = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+            failed = self._random.random() < self.error_rate
+        time.sleep(self.latency + extra)
+        return failed
+
+
+class FakeServer:
+    """A threaded HTTP server on an ephemeral localhost port"""
+
+    handler_class = None
+
+    def __init__(self, profile=None, host='127.0.0.1', port=0):
+        self.profile = profile or FaultProfile()
+        self.requests = 0
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        handler = type('Handler', (self.handler_class,), {'server_state': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def next_id(self):
+        return next(self._counter)
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def fail(self):
+        status = self.server_state.profile.error_status
+        headers = {'retry-after': '1'} if status == 429 else None
+        self.send_json(status, {'error': {'message': f'Injected {status}', 'type': 'fake_error'}}, headers)
+
+
+class _GroqHandler(_Handler):
+    RATE_LIMIT_HEADERS = {
+        'x-ratelimit-limit-requests': '14400',
+        'x-ratelimit-remaining-requests': '14399',
+        'x-ratelimit-reset-requests': '6s',
+        'x-ratelimit-limit-tokens': '1000000',
+        'x-ratelimit-remaining-tokens': '999000',
+        'x-ratelimit-reset-tokens': '60ms',
+    }
+
+    def do_POST(self):
+        state = self.server_state
+        state.count()
+        request = self.read_json() or {}
+        if not self.path.endswith('/chat/completions'):
+            self.send_json(404, {'error': {'message': 'Not found'}})
+            return
+        if state.profile.delay():
+            self.fail()
+            return
+
+        content = json.dumps(NARRATIVE)
+        prompt_tokens = sum(len(message.get('content') or '') for message in request.get('messages', [])) // 4
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(content) // 4,
+            'total_tokens': prompt_tokens + len(content) // 4,
+        }
+        completion_id = f'chatcmpl-{state.next_id()}'
+        if request.get('stream'):
+            self.stream(completion_id, request.get('model'), content, usage)
+            return
+
+        self.send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': usage,
+        }, self.RATE_LIMIT_HEADERS)
+
+    def stream(self, completion_id, model, content, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        for name, value in self.RATE_LIMIT_HEADERS.items():
+            self.send_header(name, value)
+        self.end_headers()
+        base = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model}
+        for start in range(0, len(content), 32):
+            chunk = dict(base, choices=[{'index': 0, 'delta': {'content': content[start:start + 32]}, 'finish_reason': None}])
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+        final = dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], x_groq={'usage': usage})
+        self.wfile.write(f'data: {json.dumps(final)}\n\ndata: [DONE]\n\n'.encode('utf-8'))
+        self.close_connection = True
+
+
+class FakeGroqServer(FakeServer):
+    """Serves POST /openai/v1/chat/completions"""
+    handler_class = _GroqHandler
+
+
+class _SupabaseHandler(_Handler):
+    def do_GET(self):
+        state = self.server_state
+        state.count()
+        if state.profile.delay():
+            self.fail()
+            return
+        if self.path.startswith('/auth/v1/user'):
+            self.send_json(200, {'id': 'bench-user', 'email': 'bench@example.com', 'aud': 'authenticated'})
+        else:
+            self.send_json(404, {'message': 'Not found'})
+
+    def do_POST(self):
+        state = self.server_state
+        state.count()
+        rows = self.read_json()
+        if state.profile.delay():
+            self.fail()
+            return
+        rows = rows if isinstance(rows, list) else [rows]
+        self.send_json(201, [dict(row, id=state.next_id()) for row in rows])
+
+    def do_PATCH(self):
+        state = self.server_state
+        state.count()
+        row = self.read_json() or {}
+        if state.profile.delay():
+            self.fail()
+            return
+        self.send_json(200, [row])
+
+
+class FakeSupabaseServer(FakeServer):
+    """Serves PostgREST insert/update under /rest/v1/ and GET /auth/v1/user"""
+    handler_class = _SupabaseHandler
+
+
+def main(argv=None):
+    """Serve the fake Groq API in the foreground, e.g. for offline runs of credit_risk_analysis.py"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds per completion')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Extra random seconds per completion')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of completions that fail')
+    parser.add_argument('--error-status', type=int, default=500, help='Status of injected failures')
+    args = parser.parse_args(argv)
+
+    profile = FaultProfile(args.latency, args.jitter, args.error_rate, args.error_status)
+    server = FakeGroqServer(profile, port=args.port)
+    print(f'Fake Groq API on {server.url}/openai/v1/chat/completions', flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+Load benchmark for the analyses API.
+
+Starts the fake Groq and Supabase servers, runs the Django app against them
+in a child process with its own SQLite database, then drives create, list,
+retrieve and update_status at each concurrency level. Results are written
+as JSON; pass --baseline to compare with an earlier run.
+
+    python -m benchmarks.run --concurrency 1,8,32 --requests 200 --output bench.json
+    python -m benchmarks.run --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import jwt
+
+from .fakes import FakeGroqServer, FakeSupabaseServer, FaultProfile
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ('create', 'list', 'retrieve', 'update_status')
+JWT_SECRET = 'benchmark-jwt-secret-benchmark-jwt-secret'
+STATUSES = ('approved', 'rejected', 'review', 'pending')
+CREDIT_SCORES = (560, 610, 640, 660, 690, 720, 760, 800)
+
+APPLICATION = {
+    'customer_name': 'Benchmark Applicant',
+    'customer_phone': '555-0100',
+    'loan_amount': 300000,
+    'customer_details': {
+        'monthly_income': 9000, 'monthly_savings': 1500, 'total_assets': 250000,
+        'total_liabilities': 60000, 'credit_score': 720, 'credit_utilization': 25,
+        'car_loan_payment': 400, 'credit_card_payment': 250, 'monthly_expenses': 4200,
+    },
+    'loan_details': {'interest_rate': 6.5, 'loan_term_years': 30, 'property_value': 375000, 'down_payment': 75000},
+    'market_conditions': {
+        'inflation_rate': 3.1, 'property_value_growth_5yr': 18,
+        'property_tax_rate': 1.2, 'interest_rate_trend': 'Stable',
+    },
+}
+
+
+def mint_token(email='bench@example.com', ttl=3600):
+    """An HS256 Supabase-style access token the server verifies locally"""
+    now = int(time.time())
+    claims = {'sub': 'bench-user', 'email': email, 'aud': 'authenticated', 'iat': now, 'exp': now + ttl}
+    return jwt.encode(claims, JWT_SECRET, algorithm='HS256')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    # The epsilon keeps float noise (0.07 * 100 = 7.000000000000001) from adding a rank
+    rank = max(1, math.ceil(fraction * len(sorted_values) - 1e-9))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarise(scenario, concurrency, samples, elapsed):
+    latencies = sorted(latency for latency, ok in samples if ok)
+    errors = sum(1 for _, ok in samples if not ok)
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+        'requests_per_second': round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+
+
+class AppServer:
+    """The Django app in a child process, pointed at the fake upstreams"""
+
+    def __init__(self, groq_url, supabase_url, workdir, extra_env=None, command=None):
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.env = dict(
+            os.environ,
+            SECRET_KEY='benchmark',
+            DEBUG='False',
+            SQLITE_PATH=str(Path(workdir) / 'bench.sqlite3'),
+            ANALYSIS_CACHE_PATH=str(Path(workdir) / 'cache.sqlite3'),
+            GROQ_API_KEY='benchmark',
+            GROQ_BASE_URL=groq_url,
+            SUPABASE_URL=supabase_url,
+            SUPABASE_KEY=jwt.encode({'role': 'anon'}, 'anon', algorithm='HS256'),
+            SUPABASE_JWT_SECRET=JWT_SECRET,
+            LOG_LEVEL='WARNING',
+            **(extra_env or {})
+        )
+        self.command = command or [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{self.port}']
+        self.process = None
+
+    def start(self, timeout=30):
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'],
+                       cwd=SERVER_DIR, env=self.env, check=True)
+        command = [part.replace('{port}', str(self.port)) for part in self.command]
+        self.process = subprocess.Popen(command, cwd=SERVER_DIR, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'App server exited: {self.process.stderr.read().decode(errors="replace")}')
+            try:
+                httpx.get(f'{self.url}/metrics', timeout=1)
+                return self
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        raise RuntimeError('App server did not start in time')
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class LoadDriver:
+    """Runs one scenario at a fixed concurrency and collects latencies"""
+
+    def __init__(self, base_url, token, timeout=120):
+        self.base_url = base_url
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.timeout = timeout
+        self.created_ids = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = httpx.Client(base_url=self.base_url, headers=self.headers,
+                                                       timeout=self.timeout)
+        return client
+
+    def next_sequence(self):
+        with self._lock:
+            self._sequence += 1
+            return self._sequence
+
+    def request(self, scenario, index):
+        client = self.client()
+        if scenario == 'create':
+            sequence = self.next_sequence()
+            application = dict(APPLICATION, customer_name=f'Benchmark Applicant {sequence}')
+            # A spread of credit scores gives a realistic mix of applications the
+            # local scoring tier decides and borderline ones that reach the LLM
+            application['customer_details'] = dict(
+                APPLICATION['customer_details'], credit_score=CREDIT_SCORES[sequence % len(CREDIT_SCORES)]
+            )
+            response = client.post('/api/analyses/', json={
+                'customer_input': json.dumps(application),
+                'customer_phone': application['customer_phone'],
+            })
+            if response.status_code == 201:
+                with self._lock:
+                    self.created_ids.append(response.json()['id'])
+            return response.status_code == 201
+        if scenario == 'list':
+            return client.get('/api/analyses/', params={'page_size': 20}).status_code == 200
+        analysis_id = self.created_ids[index % len(self.created_ids)]
+        if scenario == 'retrieve':
+            return client.get(f'/api/analyses/{analysis_id}/').status_code == 200
+        if scenario == 'update_status':
+            response = client.post(f'/api/analyses/{analysis_id}/update_status/',
+                                   json={'status': STATUSES[index % len(STATUSES)]})
+            return response.status_code == 200
+        raise ValueError(f'Unknown scenario {scenario}')
+
+    def timed_request(self, scenario, index):
+        started = time.perf_counter()
+        try:
+            ok = self.request(scenario, index)
+        except httpx.HTTPError:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    def run(self, scenario, concurrency, requests):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(lambda index: self.timed_request(scenario, index), range(requests)))
+        return summarise(scenario, concurrency, samples, time.perf_counter() - started)
+
+
+def compare(results, baseline, max_regression):
+    """Rows whose p95 or throughput regressed by more than max_regression"""
+    previous = {(row['scenario'], row['concurrency']): row for row in baseline.get('results', [])}
+    regressions = []
+    for row in results:
+        before = previous.get((row['scenario'], row['concurrency']))
+        if not before:
+            continue
+        if before.get('p95_ms') and row.get('p95_ms') and row['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            regressions.append({'scenario': row['scenario'], 'concurrency': row['concurrency'],
+                                'metric': 'p95_ms', 'baseline': before['p95_ms'], 'current': row['p95_ms']})
+        if (before.get('requests_per_second') and row.get('requests_per_second')
+                and row['requests_per_second'] < before['requests_per_second'] * (1 - max_regression)):
+            regressions.append({'scenario': row['scenario'], 'concurrency': row['concurrency'],
+                                'metric': 'requests_per_second', 'baseline': before['requests_per_second'],
+                                'current': row['requests_per_second']})
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SERVER_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', default='1,8,32',
+                        help='Comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='Requests per scenario and concurrency level')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'Comma-separated subset of {",".join(SCENARIOS)}')
+    parser.add_argument('--groq-latency', type=float, default=0.5, help='Seconds per fake completion')
+    parser.add_argument('--groq-jitter', type=float, default=0.2, help='Extra random seconds per completion')
+    parser.add_argument('--groq-error-rate', type=float, default=0.0, help='Fraction of completions that fail')
+    parser.add_argument('--groq-error-status', type=int, default=500, help='Status of injected Groq failures')
+    parser.add_argument('--supabase-latency', type=float, default=0.05, help='Seconds per fake Supabase call')
+    parser.add_argument('--supabase-error-rate', type=float, default=0.0,
+                        help='Fraction of Supabase calls that fail')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for injected jitter and errors')
+    parser.add_argument('--cache', action='store_true', help='Leave the analysis result cache on')
+    parser.add_argument('--no-local-scoring', action='store_true',
+                        help='Send every application to the (fake) LLM')
+    parser.add_argument('--server-command', default=None,
+                        help='Command that serves the app, {port} is replaced, e.g. '
+                             '"gunicorn app.wsgi -w 4 --threads 8 -b 127.0.0.1:{port}"')
+    parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', default=None, help='Earlier report to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Allowed relative p95 / throughput regression against the baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f'Unknown scenarios: {sorted(unknown)}')
+    if 'create' not in scenarios and {'retrieve', 'update_status'} & set(scenarios):
+        # retrieve and update_status need analyses to work on
+        scenarios.insert(0, 'create')
+
+    groq_profile = FaultProfile(args.groq_latency, args.groq_jitter, args.groq_error_rate,
+                                args.groq_error_status, seed=args.seed)
+    supabase_profile = FaultProfile(args.supabase_latency, 0.0, args.supabase_error_rate, seed=args.seed)
+    extra_env = {} if args.cache else {'ANALYSIS_CACHE_ENABLED': 'False'}
+    if args.no_local_scoring:
+        extra_env['ANALYSIS_LOCAL_SCORING'] = 'False'
+    command = args.server_command.split() if args.server_command else None
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='lendsure-bench-') as workdir, \
+            FakeGroqServer(groq_profile) as groq, FakeSupabaseServer(supabase_profile) as supabase:
+        app = AppServer(groq.url, supabase.url, workdir, extra_env, command).start()
+        try:
+            driver = LoadDriver(app.url, mint_token())
+            for concurrency in levels:
+                for scenario in scenarios:
+                    row = driver.run(scenario, concurrency, args.requests)
+                    results.append(row)
+                    print(f"{scenario:>14} c={concurrency:<4} {row['requests_per_second']} req/s "
+                          f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms "
+                          f"errors={row['errors']}", file=sys.stderr)
+            upstream_calls = {'groq': groq.requests, 'supabase': supabase.requests}
+        finally:
+            app.stop()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+            'upstream_calls': upstream_calls,
+        },
+        'results': results,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as handle:
+            report['regressions'] = compare(results, json.load(handle), args.max_regression)
+        exit_code = 1 if report['regressions'] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())